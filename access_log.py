@@ -0,0 +1,135 @@
+"""Buffered AccessLog writer: batches login audit rows off the request path"""
+import atexit
+import os
+import threading
+from datetime import datetime
+from database import db
+from models import AccessLog
+
+class AccessLogWriter:
+    """Collects access log entries in memory and inserts them in batches from a background thread
+
+    An entry stays in memory for at most ACCESS_LOG_FLUSH_INTERVAL seconds (the durability
+    bound). The same thread prunes whole months of logs older than ACCESS_LOG_RETENTION_MONTHS.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._last_prune = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ACCESS_LOG_ASYNC', True)
+        app.config.setdefault('ACCESS_LOG_FLUSH_INTERVAL', float(os.environ.get('ACCESS_LOG_FLUSH_INTERVAL', 2.0)))  # seconds
+        app.config.setdefault('ACCESS_LOG_BATCH_SIZE', 200)
+        app.config.setdefault('ACCESS_LOG_MAX_BUFFER', 5000)
+        # 0 keeps logs forever
+        app.config.setdefault('ACCESS_LOG_RETENTION_MONTHS', int(os.environ.get('ACCESS_LOG_RETENTION_MONTHS', 6)))
+        self.app = app
+        # Write whatever is still buffered when a worker shuts down cleanly
+        atexit.register(self.flush)
+
+    def log(self, user, role, access_code, status):
+        """Queue an access log entry (written synchronously when ACCESS_LOG_ASYNC is off)"""
+        entry = {
+            'user': user,
+            'role': role,
+            'access_code': access_code,
+            'status': status,
+            'created_at': datetime.utcnow(),
+        }
+        with self._lock:
+            self._buffer.append(entry)
+            pending = len(self._buffer)
+
+        config = self.app.config
+        if not config['ACCESS_LOG_ASYNC'] or pending >= config['ACCESS_LOG_MAX_BUFFER']:
+            # Backpressure: never let the buffer grow without bound
+            self.flush()
+            return
+        self._ensure_thread()
+        if pending >= config['ACCESS_LOG_BATCH_SIZE']:
+            self._wakeup.set()
+
+    def flush(self):
+        """Insert all buffered entries in one statement; returns the number written"""
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries or self.app is None:
+            return 0
+
+        with self.app.app_context():
+            try:
+                db.session.execute(db.insert(AccessLog), entries)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                # Put the batch back (bounded) so a DB hiccup does not lose the audit trail
+                with self._lock:
+                    room = self.app.config['ACCESS_LOG_MAX_BUFFER'] - len(self._buffer)
+                    self._buffer[:0] = entries[-room:] if room > 0 else []
+                self.app.logger.warning(f'Access log flush failed: {e}')
+                return 0
+        return len(entries)
+
+    def prune(self, now=None):
+        """Delete whole months of logs older than the retention window, one month per statement"""
+        months = self.app.config['ACCESS_LOG_RETENTION_MONTHS']
+        if not months:
+            return 0
+        now = now or datetime.utcnow()
+        cutoff = _add_months(now.replace(day=1, hour=0, minute=0, second=0, microsecond=0), -months)
+
+        deleted = 0
+        with self.app.app_context():
+            oldest = db.session.query(db.func.min(AccessLog.created_at)).scalar()
+            if oldest is None:
+                return 0
+            month = oldest.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            while month < cutoff:
+                next_month = _add_months(month, 1)
+                deleted += AccessLog.query.filter(
+                    AccessLog.created_at >= month,
+                    AccessLog.created_at < next_month
+                ).delete(synchronize_session=False)
+                db.session.commit()
+                month = next_month
+        return deleted
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each gunicorn worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.app.config['ACCESS_LOG_FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            self.flush()
+
+            today = datetime.utcnow().date()
+            if self._last_prune != today:
+                self._last_prune = today
+                try:
+                    self.prune()
+                except Exception as e:
+                    self.app.logger.warning(f'Access log pruning failed: {e}')
+
+def _add_months(moment, months):
+    """Shift a first-of-month datetime by a number of months"""
+    month_index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+access_log_writer = AccessLogWriter()
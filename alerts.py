@@ -0,0 +1,163 @@
+"""Overspend and threshold alerts, evaluated incrementally from the running spend totals"""
+from decimal import Decimal
+from database import db
+from models import Item, AccessCode, Notification, SpendTotal, AlertRule, to_decimal, CENTS
+from rollups import budget_key, spend_total_keys, add_spend_totals
+from utils import format_currency
+
+# What a rule compares: planned vs actual cost of an item, budget or group, or a request's
+# quantity vs the item's remaining planned quantity
+ALERT_SCOPES = ('item', 'budget', 'grp', 'request')
+
+def active_rules(project_site, scope):
+    """Active rules of a scope for a project site (site-specific and every-site rules)"""
+    return db.session.execute(
+        db.select(AlertRule).where(
+            AlertRule.is_active == db.true(),
+            AlertRule.scope == scope,
+            db.or_(AlertRule.project_site.is_(None), AlertRule.project_site == (project_site or ''))
+        ).order_by(AlertRule.threshold_pct)
+    ).scalars().all()
+
+def _limit(planned, rule):
+    return to_decimal(planned) * to_decimal(rule.threshold_pct) / 100
+
+def _percent(actual, planned):
+    return f'{(to_decimal(actual) * 100 / to_decimal(planned)).quantize(Decimal("1"))}%' if planned else 'n/a'
+
+def raise_alert(project_site, title, message, request_id=None):
+    """Notify global admins and the project site's account, like request decisions do (caller commits)"""
+    db.session.add(Notification(notification_type='alert', title=title, message=message,
+                                user_id=None, request_id=request_id))
+    if project_site:
+        site_code = AccessCode.query.filter_by(code_type='project_site', project_site=project_site).first()
+        if site_code:
+            db.session.add(Notification(notification_type='alert', title=title, message=message,
+                                        user_id=site_code.id, request_id=request_id))
+
+def check_spend(key, label, planned_before, actual_before, planned_after, actual_after, rules=None):
+    """Raise an alert for every rule whose limit the change crossed (at or below it before, above it after)"""
+    site, scope, scope_key = key
+    for rule in rules if rules is not None else active_rules(site, scope):
+        if rule.scope_key not in (None, scope_key):
+            continue
+        if actual_before <= _limit(planned_before, rule) and actual_after > _limit(planned_after, rule):
+            raise_alert(site, 'Overspend Alert', (
+                f'{label} ({site or "No Site"}): actual cost {format_currency(actual_after)} is '
+                f'{_percent(actual_after, planned_after)} of planned {format_currency(planned_after)} '
+                f'(alert above {to_decimal(rule.threshold_pct).normalize():f}%).'
+            ))
+
+def _label(scope, scope_key, item=None):
+    if scope == 'item':
+        return f'Item "{item.name if item is not None else "#" + scope_key}"'
+    if scope == 'budget':
+        return scope_key or 'No budget'
+    return f'Group "{scope_key}"'
+
+def record_actual_spend(actual, item):
+    """Add a new Actual to its item, budget and group totals and raise the alerts it triggers (caller commits)"""
+    cost = to_decimal(actual.actual_cost)
+    qty = to_decimal(actual.actual_qty)
+    keys = spend_total_keys(item, actual.project_site)
+    totals = add_spend_totals({key: {'actual_cost': cost, 'actual_qty': qty} for key in keys})
+    for key in keys:
+        total = totals[key]
+        planned = item.amount if key[1] == 'item' else to_decimal(total.planned)
+        actual_cost = to_decimal(total.actual_cost)
+        check_spend(key, _label(key[1], key[2], item), planned, actual_cost - cost, planned, actual_cost)
+
+def record_planned_changes(changes):
+    """Add planned amount changes [(project site, budget, grp, delta)] to the budget and group totals
+    and raise the alerts they trigger (caller commits)"""
+    deltas = {}
+    for site, budget, grp, delta in changes:
+        delta = to_decimal(delta)
+        for key in ((site or '', 'budget', budget_key(budget)), (site or '', 'grp', grp or 'Materials')):
+            deltas[key] = deltas.get(key, 0) + delta
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    totals = add_spend_totals({key: {'planned': delta} for key, delta in deltas.items()})
+    for key, delta in deltas.items():
+        # Only a lower planned amount can push spend over a limit
+        if delta < 0:
+            total = totals[key]
+            actual = to_decimal(total.actual_cost)
+            check_spend(key, _label(key[1], key[2]), to_decimal(total.planned) - delta, actual,
+                        to_decimal(total.planned), actual)
+
+def check_item_planned(rows):
+    """Item rules after planned amount changes, for rows of (item id, name, project site, old amount, new amount)"""
+    rows = [row for row in rows if to_decimal(row[4]) < to_decimal(row[3])]
+    if not rows:
+        return
+    spent = dict(db.session.execute(
+        db.select(SpendTotal.scope_key, SpendTotal.actual_cost).where(
+            SpendTotal.scope == 'item',
+            SpendTotal.scope_key.in_([str(row[0]) for row in rows]),
+            SpendTotal.actual_cost > 0
+        )
+    ).all())
+    rules = {}
+    for item_id, name, site, old_amount, new_amount in rows:
+        actual = spent.get(str(item_id))
+        if actual is None:
+            continue
+        site = site or ''
+        if site not in rules:
+            rules[site] = active_rules(site, 'item')
+        actual = to_decimal(actual)
+        check_spend((site, 'item', str(item_id)), f'Item "{name}"', to_decimal(old_amount), actual,
+                    to_decimal(new_amount), actual, rules[site])
+
+def record_item_planned_change(item, old_amount, new_amount):
+    """Planned totals and alerts after one item's amount changed from old_amount to new_amount (caller commits)"""
+    record_planned_changes([(item.project_site, item.budget, item.grp, to_decimal(new_amount) - to_decimal(old_amount))])
+    if item.id is not None:
+        check_item_planned([(item.id, item.name, item.project_site, old_amount, new_amount)])
+
+def record_bulk_planned_change(where, new_amount):
+    """Planned totals and alerts for a set-based change of the amount of the items matching where
+
+    Run before the UPDATE, with new_amount the SQL expression of each item's revised amount
+    (caller commits, or rolls back with the UPDATE).
+    """
+    new_amount = db.func.round(new_amount, 2)
+    record_planned_changes(db.session.execute(
+        db.select(
+            Item.project_site, Item.budget, Item.grp, db.func.sum(new_amount) - db.func.sum(Item.amount)
+        ).where(*where).group_by(Item.project_site, Item.budget, Item.grp)
+    ).all())
+    # Only items with spend against them can cross an item rule
+    check_item_planned(db.session.execute(
+        db.select(Item.id, Item.name, Item.project_site, Item.amount, new_amount).join(
+            SpendTotal, db.and_(
+                SpendTotal.project_site == db.func.coalesce(Item.project_site, ''),
+                SpendTotal.scope == 'item',
+                SpendTotal.scope_key == db.cast(Item.id, db.String),
+                SpendTotal.actual_cost > 0
+            )
+        ).where(*where, new_amount < Item.amount)
+    ).all())
+
+def check_request(req, item):
+    """Alert when a request asks for more than a rule's share of the item's remaining planned quantity"""
+    rules = [rule for rule in active_rules(req.project_site, 'request') if rule.scope_key in (None, str(item.id))]
+    if not rules:
+        return
+    issued = db.session.execute(
+        db.select(SpendTotal.actual_qty).where(
+            SpendTotal.project_site == (req.project_site or ''),
+            SpendTotal.scope == 'item',
+            SpendTotal.scope_key == str(item.id)
+        )
+    ).scalar()
+    remaining = max(to_decimal(item.qty) - to_decimal(issued), Decimal('0'))
+    for rule in rules:
+        if to_decimal(req.qty) > _limit(remaining, rule):
+            raise_alert(req.project_site, 'Request Quantity Alert', (
+                f'Request #{req.id} for {to_decimal(req.qty).quantize(CENTS)} {item.unit or "units"} of "{item.name}" '
+                f'({req.project_site or "No Site"}) exceeds {to_decimal(rule.threshold_pct).normalize():f}% of the '
+                f'remaining planned quantity ({remaining.quantize(CENTS)} of {to_decimal(item.qty).quantize(CENTS)}).'
+            ), request_id=req.id)
+            # One alert per request: the strictest rule it breaks
+            break
@@ -0,0 +1,596 @@
+"""Read-only JSON API over items, requests, actuals and their change feed"""
+from flask import request, session, jsonify, send_file
+from datetime import datetime, date, timedelta
+import csv
+import io
+import json
+import os
+from decimal import Decimal
+from functools import wraps
+from database import db
+from models import Item, Request, Actual, DailySpend, ArchiveBatch, ArchivedRow, StockMovement, ItemBalance, ChangeEvent
+from routes import project_site_clause, budget_filter_clause, is_admin, get_site_overview, sharded_all_sites
+from search import search_terms, search_statement
+from replica import use_replica
+from shard import shards
+from profiling import template_profiler
+from archive import HOT_MODELS
+from stock import stock_as_of, STOCK_TOTALS
+from changes import change_feed, make_cursor, parse_cursor, CHANGE_MODELS
+from utils import extract_budget_number
+
+API_DEFAULT_LIMIT = 100
+API_MAX_LIMIT = 500
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Fields exposed by each endpoint (name -> column); ?fields= selects a subset
+ITEM_FIELDS = {
+    'id': Item.id,
+    'code': Item.code,
+    'name': Item.name,
+    'category': Item.category,
+    'unit': Item.unit,
+    'qty': Item.qty,
+    'unit_cost': Item.unit_cost,
+    'budget': Item.budget,
+    'section': Item.section,
+    'grp': Item.grp,
+    'building_type': Item.building_type,
+    'project_site': Item.project_site,
+    'created_at': Item.created_at,
+}
+
+REQUEST_FIELDS = {
+    'id': Request.id,
+    'ts': Request.ts,
+    'section': Request.section,
+    'item_id': Request.item_id,
+    'qty': Request.qty,
+    'requested_by': Request.requested_by,
+    'note': Request.note,
+    'status': Request.status,
+    'approved_by': Request.approved_by,
+    'current_price': Request.current_price,
+    'building_type': Request.building_type,
+    'budget': Request.budget,
+    'project_site': Request.project_site,
+    'created_at': Request.created_at,
+    'updated_at': Request.updated_at,
+}
+
+ARCHIVED_ROW_FIELDS = {
+    'id': ArchivedRow.id,
+    'batch_id': ArchivedRow.batch_id,
+    'source_table': ArchivedRow.source_table,
+    'project_site': ArchivedRow.project_site,
+    'row_id': ArchivedRow.row_id,
+    'data': ArchivedRow.data,
+}
+
+ACTUAL_FIELDS = {
+    'id': Actual.id,
+    'item_id': Actual.item_id,
+    'actual_qty': Actual.actual_qty,
+    'actual_cost': Actual.actual_cost,
+    'actual_date': Actual.actual_date,
+    'recorded_by': Actual.recorded_by,
+    'notes': Actual.notes,
+    'project_site': Actual.project_site,
+    'created_at': Actual.created_at,
+}
+
+STOCK_MOVEMENT_FIELDS = {
+    'id': StockMovement.id,
+    'item_id': StockMovement.item_id,
+    'kind': StockMovement.kind,
+    'qty': StockMovement.qty,
+    'request_id': StockMovement.request_id,
+    'note': StockMovement.note,
+    'recorded_by': StockMovement.recorded_by,
+    'project_site': StockMovement.project_site,
+    'created_at': StockMovement.created_at,
+}
+
+# Tables whose archived rows /api/archive can list
+ARCHIVABLE_TABLES = tuple(model.__tablename__ for model in HOT_MODELS)
+
+class ApiError(Exception):
+    """Invalid API parameters (reported as a 400 JSON error)"""
+
+def _serialize_value(value):
+    """Convert column values to JSON-friendly types"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _select_fields(available):
+    """Resolve ?fields=a,b,c into (names, columns), always including id for the cursor"""
+    requested = request.args.get('fields', '').strip()
+    if not requested:
+        names = list(available)
+    else:
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise ApiError(f'Unknown field(s): {", ".join(unknown)}')
+        if 'id' not in names:
+            names.insert(0, 'id')
+    return names, [available[name] for name in names]
+
+def _parse_date(name):
+    """Parse an optional YYYY-MM-DD query argument"""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ApiError(f'Invalid {name}: expected YYYY-MM-DD')
+
+def _apply_date_range(stmt, column):
+    """Apply ?date_from=/?date_to= (inclusive) to a datetime column"""
+    date_from = _parse_date('date_from')
+    date_to = _parse_date('date_to')
+    if date_from:
+        stmt = stmt.where(column >= date_from)
+    if date_to:
+        stmt = stmt.where(column < date_to + timedelta(days=1))
+    return stmt
+
+def _parse_limit():
+    """?limit= clamped to 1..API_MAX_LIMIT"""
+    try:
+        return min(max(int(request.args.get('limit', API_DEFAULT_LIMIT)), 1), API_MAX_LIMIT)
+    except ValueError:
+        raise ApiError('Invalid limit')
+
+def _paginate(stmt, id_column, names, decoders=None):
+    """Keyset pagination (newest first) and row serialization without ORM hydration"""
+    limit = _parse_limit()
+    cursor = request.args.get('cursor', '').strip()
+    if cursor:
+        try:
+            stmt = stmt.where(id_column < int(cursor))
+        except ValueError:
+            raise ApiError('Invalid cursor')
+
+    # Fetch one extra row to know whether another page exists
+    rows = db.session.execute(stmt.order_by(id_column.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    data = [{name: _serialize_value(value) for name, value in zip(names, row)} for row in rows]
+    for name, decode in (decoders or {}).items():
+        for record in data:
+            record[name] = decode(record[name])
+    next_cursor = str(rows[-1][names.index('id')]) if has_more else None
+    return jsonify({'data': data, 'count': len(data), 'next_cursor': next_cursor})
+
+def json_api(f):
+    """Decorator for JSON endpoints: require login and report ApiError as a 400"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        try:
+            return f(*args, **kwargs)
+        except ApiError as e:
+            return jsonify({'error': str(e)}), 400
+    return decorated_function
+
+def sharded_site_required(f):
+    """Decorator for endpoints reading sharded tables: refuse "All Sites" with sharding on (the main database has none of their rows)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if sharded_all_sites():
+            raise ApiError('Select a project site: with sharding on, each site\'s data is kept in its own shard')
+        return f(*args, **kwargs)
+    return decorated_function
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_items():
+    """List items for the current project site"""
+    names, columns = _select_fields(ITEM_FIELDS)
+    stmt = db.select(*columns).where(project_site_clause(Item.project_site))
+
+    budget = request.args.get('budget', '').strip()
+    if budget and budget != 'All':
+        stmt = stmt.where(budget_filter_clause(budget))
+    for arg in ('section', 'building_type', 'grp', 'category'):
+        value = request.args.get(arg, '').strip()
+        if value and value != 'All':
+            stmt = stmt.where(ITEM_FIELDS[arg] == value)
+    stmt = _apply_date_range(stmt, Item.created_at)
+
+    return _paginate(stmt, Item.id, names)
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_requests():
+    """List requests for the current project site"""
+    names, columns = _select_fields(REQUEST_FIELDS)
+    stmt = db.select(*columns).where(project_site_clause(Request.project_site))
+
+    budget = request.args.get('budget', '').strip()
+    if budget and budget != 'All':
+        stmt = stmt.where(budget_filter_clause(budget, Request.budget))
+    for arg in ('status', 'section', 'building_type'):
+        value = request.args.get(arg, '').strip()
+        if value and value != 'All':
+            stmt = stmt.where(REQUEST_FIELDS[arg] == value)
+    stmt = _apply_date_range(stmt, Request.created_at)
+
+    return _paginate(stmt, Request.id, names)
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_actuals():
+    """List actuals for the current project site (budget/section/building type filters use the item)"""
+    names, columns = _select_fields(ACTUAL_FIELDS)
+    stmt = db.select(*columns).select_from(Actual).where(project_site_clause(Actual.project_site))
+
+    budget = request.args.get('budget', '').strip()
+    section = request.args.get('section', '').strip()
+    building_type = request.args.get('building_type', '').strip()
+    if any(value and value != 'All' for value in (budget, section, building_type)):
+        stmt = stmt.join(Item, Item.id == Actual.item_id)
+        if budget and budget != 'All':
+            stmt = stmt.where(budget_filter_clause(budget))
+        if section and section != 'All':
+            stmt = stmt.where(Item.section == section)
+        if building_type and building_type != 'All':
+            stmt = stmt.where(Item.building_type == building_type)
+
+    date_from = _parse_date('date_from')
+    date_to = _parse_date('date_to')
+    if date_from:
+        stmt = stmt.where(Actual.actual_date >= date_from.date())
+    if date_to:
+        stmt = stmt.where(Actual.actual_date <= date_to.date())
+
+    return _paginate(stmt, Actual.id, names)
+
+VARIANCE_COLUMNS = ['budget', 'building_type', 'grp', 'planned', 'actual', 'variance', 'pct_consumed']
+
+def compute_variance_matrix():
+    """Planned vs actual for every budget x building type x grp cell of the current site
+
+    Runs one grouped query over items and one over actuals, then works on the
+    resulting columns instead of per-item queries like actuals() does.
+    """
+    planned_rows = db.session.execute(
+        db.select(
+            Item.budget, Item.building_type, Item.grp,
+            db.func.sum(Item.amount)
+        ).where(project_site_clause(Item.project_site),
+                Item.budget.isnot(None), Item.building_type.isnot(None))
+        .group_by(Item.budget, Item.building_type, Item.grp)
+    ).all()
+    actual_rows = db.session.execute(
+        db.select(
+            Item.budget, Item.building_type, Item.grp, db.func.sum(Actual.actual_cost)
+        ).select_from(Actual).join(Item, Item.id == Actual.item_id)
+        .where(project_site_clause(Actual.project_site),
+               Item.budget.isnot(None), Item.building_type.isnot(None))
+        .group_by(Item.budget, Item.building_type, Item.grp)
+    ).all()
+
+    # Cell key per group: (budget number, building type, grp) as in the actuals tab
+    cells = {}
+    budgets, building_types, grps, planned, actual = [], [], [], [], []
+    for rows, target in ((planned_rows, planned), (actual_rows, actual)):
+        for budget, building_type, grp, total in rows:
+            key = (extract_budget_number(budget), building_type.strip(), grp or 'Materials')
+            index = cells.get(key)
+            if index is None:
+                index = cells[key] = len(budgets)
+                budgets.append(key[0])
+                building_types.append(key[1])
+                grps.append(key[2])
+                planned.append(0.0)
+                actual.append(0.0)
+            target[index] += float(total or 0)
+
+    variance = [p - a for p, a in zip(planned, actual)]
+    pct_consumed = [round(a / p * 100, 2) if p else None for p, a in zip(planned, actual)]
+
+    order = sorted(range(len(budgets)), key=lambda i: (budgets[i], building_types[i], grps[i]))
+    columns = (budgets, building_types, grps, planned, actual, variance, pct_consumed)
+    return [[column[i] for column in columns] for i in order]
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_variance_matrix():
+    """Budget-vs-actual variance for all budgets of the current site (JSON or ?format=csv)"""
+    rows = compute_variance_matrix()
+
+    if request.args.get('format') == 'csv':
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(VARIANCE_COLUMNS)
+        writer.writerows(rows)
+        return send_file(
+            io.BytesIO(output.getvalue().encode('utf-8')),
+            mimetype='text/csv',
+            as_attachment=True,
+            download_name='variance_matrix.csv'
+        )
+
+    total_planned = sum(row[3] for row in rows)
+    total_actual = sum(row[4] for row in rows)
+    return jsonify({
+        'columns': VARIANCE_COLUMNS,
+        'rows': rows,
+        'totals': {
+            'planned': total_planned,
+            'actual': total_actual,
+            'variance': total_planned - total_actual,
+            'pct_consumed': round(total_actual / total_planned * 100, 2) if total_planned else None
+        }
+    })
+
+SPEND_BUCKETS = ('day', 'week', 'month')
+
+def _bucket_start(day, bucket):
+    """First day of the day/week (Monday)/month bucket containing day"""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_spend_timeseries():
+    """Actual spend over time for the current site, read from the daily spend rollup only"""
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in SPEND_BUCKETS:
+        raise ApiError(f'Invalid bucket: expected one of {", ".join(SPEND_BUCKETS)}')
+
+    stmt = db.select(
+        DailySpend.day, db.func.sum(DailySpend.actual_qty), db.func.sum(DailySpend.actual_cost)
+    ).where(project_site_clause(DailySpend.project_site)).group_by(DailySpend.day).order_by(DailySpend.day)
+
+    for arg in ('grp', 'building_type'):
+        value = request.args.get(arg, '').strip()
+        if value and value != 'All':
+            stmt = stmt.where(getattr(DailySpend, arg) == value)
+    date_from = _parse_date('date_from')
+    date_to = _parse_date('date_to')
+    if date_from:
+        stmt = stmt.where(DailySpend.day >= date_from.date())
+    if date_to:
+        stmt = stmt.where(DailySpend.day <= date_to.date())
+
+    # Daily rows are already ordered, so week/month buckets are consecutive runs
+    series = []
+    for day, qty, cost in db.session.execute(stmt):
+        period = _bucket_start(day, bucket).isoformat()
+        if not series or series[-1]['period'] != period:
+            series.append({'period': period, 'actual_qty': 0.0, 'actual_cost': 0.0})
+        series[-1]['actual_qty'] += float(qty or 0)
+        series[-1]['actual_cost'] += float(cost or 0)
+
+    return jsonify({
+        'bucket': bucket,
+        'series': series,
+        'total_cost': sum(point['actual_cost'] for point in series)
+    })
+
+def _search_results(terms, kind, limit, item_where, request_where):
+    """Search result rows per table from the current database (or shard), best match first"""
+    results = {}
+    if kind in ('all', 'items'):
+        stmt = search_statement('items', terms, item_where, limit)
+        results['items'] = [
+            dict({name: _serialize_value(getattr(item, name)) for name in ITEM_FIELDS}, rank=float(rank))
+            for item, rank in db.session.execute(stmt)
+        ]
+    if kind in ('all', 'requests'):
+        stmt = search_statement('requests', terms, request_where, limit)
+        results['requests'] = [
+            dict({name: _serialize_value(getattr(req, name)) for name in REQUEST_FIELDS}, rank=float(rank))
+            for req, rank in db.session.execute(stmt)
+        ]
+    return results
+
+@json_api
+@use_replica
+def api_search():
+    """Ranked full-text search over the current site's items and requests"""
+    terms = search_terms(request.args.get('q', ''))
+    if not terms:
+        raise ApiError('Missing search query (q)')
+    kind = request.args.get('type', 'all')
+    if kind not in ('all', 'items', 'requests'):
+        raise ApiError('Invalid type: expected all, items or requests')
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        raise ApiError('Invalid limit')
+
+    item_where = [project_site_clause(Item.project_site)]
+    request_where = [project_site_clause(Request.project_site)]
+    if not is_admin():
+        # Same visibility as Review & History: site accounts only see their own requests
+        request_where.append(Request.requested_by == session.get('user_name', ''))
+
+    results = _search_results(terms, kind, limit, item_where, request_where)
+    if shards.enabled and session.get('is_global_admin') and not session.get('project_site'):
+        # "All Sites": search every site's shard in parallel and keep the best matches overall
+        search_shard = lambda site: _search_results(terms, kind, limit, item_where, request_where)
+        for shard_results in shards.fan_out(search_shard):
+            for name, rows in shard_results.items():
+                results[name] = sorted(results[name] + rows, key=lambda row: row['rank'], reverse=True)[:limit]
+
+    return jsonify({'query': ' '.join(terms), **results})
+
+@json_api
+def api_site_overview():
+    """Per-site totals across every project site (global admins only)"""
+    if not session.get('is_global_admin'):
+        return jsonify({'error': 'Global admin privileges required'}), 403
+    overview = get_site_overview()
+    return jsonify({
+        'sites': [{name: _serialize_value(value) for name, value in site.items()} for site in overview['sites']],
+        'totals': overview['totals']
+    })
+
+@json_api
+def api_template_stats():
+    """Render time per template in this worker process, slowest total first (global admins only)"""
+    if not session.get('is_global_admin'):
+        return jsonify({'error': 'Global admin privileges required'}), 403
+    return jsonify({'pid': os.getpid(), 'templates': template_profiler.stats()})
+
+@json_api
+def api_archive():
+    """Read-only list of archived rows of one table for the current project site (admins only)"""
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    table = request.args.get('table', '').strip()
+    if table not in ARCHIVABLE_TABLES:
+        raise ApiError(f'Invalid table: expected one of {", ".join(ARCHIVABLE_TABLES)}')
+    names, columns = _select_fields(ARCHIVED_ROW_FIELDS)
+    stmt = db.select(*columns).where(ArchivedRow.source_table == table, project_site_clause(ArchivedRow.project_site))
+    batch = request.args.get('batch_id', '').strip()
+    if batch:
+        try:
+            stmt = stmt.where(ArchivedRow.batch_id == int(batch))
+        except ValueError:
+            raise ApiError('Invalid batch_id')
+    return _paginate(stmt, ArchivedRow.id, names, decoders={'data': json.loads} if 'data' in names else None)
+
+@json_api
+def api_archive_batches():
+    """Archive runs, newest first (global admins only)"""
+    if not session.get('is_global_admin'):
+        return jsonify({'error': 'Global admin privileges required'}), 403
+    names = ['id', 'kind', 'project_site', 'cutoff', 'row_count', 'archived_by', 'archived_at', 'restored_at']
+    stmt = db.select(*[getattr(ArchiveBatch, name) for name in names])
+    return _paginate(stmt, ArchiveBatch.id, names)
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_stock():
+    """Stock on hand per item of the current project site (?as_of=YYYY-MM-DD reads the daily snapshots)"""
+    as_of = _parse_date('as_of')
+    # One row per item either way: the live balance, or its latest snapshot on or before as_of
+    if as_of:
+        totals, onclause = stock_as_of(as_of.date(), Item.id)
+    else:
+        totals = ItemBalance.__table__
+        onclause = totals.c.item_id == Item.id
+    available = {
+        'id': Item.id,
+        'code': Item.code,
+        'name': Item.name,
+        'unit': Item.unit,
+        'planned_qty': Item.qty,
+        **{name: db.func.coalesce(totals.c[name], 0).label(name) for name in STOCK_TOTALS},
+    }
+    names, columns = _select_fields(available)
+    stmt = db.select(*columns).select_from(Item).outerjoin(totals, onclause).where(
+        project_site_clause(Item.project_site)
+    )
+
+    budget = request.args.get('budget', '').strip()
+    if budget and budget != 'All':
+        stmt = stmt.where(budget_filter_clause(budget))
+    return _paginate(stmt, Item.id, names)
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_stock_movements():
+    """Stock ledger of the current project site, newest first (?item_id= for one item)"""
+    names, columns = _select_fields(STOCK_MOVEMENT_FIELDS)
+    stmt = db.select(*columns).where(project_site_clause(StockMovement.project_site))
+    item_id = request.args.get('item_id', '').strip()
+    if item_id:
+        try:
+            stmt = stmt.where(StockMovement.item_id == int(item_id))
+        except ValueError:
+            raise ApiError('Invalid item_id')
+    kind = request.args.get('kind', '').strip()
+    if kind and kind != 'All':
+        stmt = stmt.where(StockMovement.kind == kind)
+    stmt = _apply_date_range(stmt, StockMovement.created_at)
+    return _paginate(stmt, StockMovement.id, names)
+
+@json_api
+@use_replica
+@sharded_site_required
+def api_changes():
+    """Inserts, updates and deletes visible to the current user after ?since=<cursor>, oldest first
+
+    since=latest returns no changes, only the current cursor (take it before a full fetch);
+    no since replays the compacted feed from the start.
+    """
+    config = change_feed.app.config
+    settled = datetime.utcnow() - timedelta(seconds=config['CHANGE_FEED_SETTLE_SECONDS'])
+    user_id = session.get('user_id')
+    if session.get('is_global_admin'):
+        recipients = db.or_(ChangeEvent.recipient_id.is_(None), ChangeEvent.recipient_id == user_id)
+    else:
+        recipients = ChangeEvent.recipient_id == user_id
+    # Notifications follow their recipient like the Notifications tab; other rows their project site
+    stmt = db.select(ChangeEvent.id, ChangeEvent.table_name, ChangeEvent.row_id, ChangeEvent.op,
+                     ChangeEvent.data, ChangeEvent.created_at).where(
+        ChangeEvent.created_at <= settled,
+        db.or_(
+            db.and_(ChangeEvent.table_name != 'notifications', project_site_clause(ChangeEvent.project_site)),
+            db.and_(ChangeEvent.table_name == 'notifications', recipients)
+        )
+    )
+
+    since = request.args.get('since', '').strip()
+    if since == 'latest':
+        last_id = db.session.execute(
+            db.select(db.func.max(ChangeEvent.id)).where(ChangeEvent.created_at <= settled)
+        ).scalar()
+        return jsonify({'data': [], 'count': 0, 'cursor': make_cursor(last_id or 0, settled), 'has_more': False})
+    since_id = 0
+    if since and since != '0':
+        try:
+            since_id, synced_at = parse_cursor(since)
+        except ValueError:
+            raise ApiError('Invalid cursor')
+        if synced_at < datetime.utcnow() - timedelta(days=config['CHANGE_FEED_RETENTION_DAYS']):
+            # Deletes older than the retention window may have been compacted away
+            return jsonify({'error': f'Cursor is older than the {config["CHANGE_FEED_RETENTION_DAYS"]}-day retention '
+                                     'window: fetch the data again and continue from since=latest'}), 410
+    stmt = stmt.where(ChangeEvent.id > since_id)
+
+    tables = [name.strip() for name in request.args.get('tables', '').split(',') if name.strip()]
+    unknown = [name for name in tables if name not in CHANGE_MODELS]
+    if unknown:
+        raise ApiError(f'Unknown table(s): {", ".join(unknown)}')
+    if tables:
+        stmt = stmt.where(ChangeEvent.table_name.in_(tables))
+
+    limit = _parse_limit()
+    rows = db.session.execute(stmt.order_by(ChangeEvent.id).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    data = []
+    for event_id, table_name, row_id, op, values, created_at in rows:
+        change = {'seq': event_id, 'table': table_name, 'row_id': row_id, 'op': op}
+        if values is not None:
+            change['data'] = json.loads(values)
+        data.append(change)
+    if has_more:
+        cursor = make_cursor(rows[-1].id, rows[-1].created_at)
+    else:
+        cursor = make_cursor(rows[-1].id if rows else since_id, settled)
+    return jsonify({'data': data, 'count': len(data), 'cursor': cursor, 'has_more': has_more})
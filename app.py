@@ -6,21 +6,46 @@ from flask import Flask, render_template, request, redirect, url_for, session, j
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime, timedelta
 import os
+import math
+import time
+import click
 import csv
 import io
 import uuid
 from functools import wraps
-from database import db, init_db
+from sqlalchemy.exc import SQLAlchemyError
+from database import db, init_db, REPLICA_BIND, ARCHIVE_BIND
+from replica import replica_router, replica_url_from_env
+from shard import shards, ShardMigrationError
+from archive import (
+    archive_url_from_env, archive_site, archive_before, restore_batch, hot_table_stats, ArchiveError
+)
+from access_log import access_log_writer
+from throttle import login_throttle
+from assets import assets
+from compression import compress
+from cache import cache
+from profiling import template_profiler
+from summaries import summaries
+from changes import change_feed
 from models import (
     Item, Request, Notification, Actual, ProjectSite, 
     AccessCode, AccessLog, User
 )
 from routes import (
-    manual_entry, download_budget_view, inventory, edit_item, delete_item, delete_all_inventory,
-    make_request, review_history, approve_request, reject_request, delete_request, approve_reject_by_id,
+    manual_entry, manual_entry_items, clone_items, download_budget_view, inventory, edit_item, bulk_edit_items, record_stock_movement, delete_item, delete_all_inventory,
+    make_request, item_search, review_history, approve_request, reject_request, delete_request, approve_reject_by_id,
+    claim_requests,
     budget_summary, save_building_config, actuals, admin_settings, update_global_admin_code, update_project_site_code,
     add_project_site, edit_project_site, delete_project_site, switch_project_site, access_logs, clear_access_logs,
-    notifications, mark_notification_read, delete_notification, check_notifications
+    add_alert_rule, delete_alert_rule,
+    notifications, mark_notification_read, delete_notification, check_notifications,
+    get_project_sites, get_site_overview, get_login_code_count
+)
+from api import (
+    api_items, api_requests, api_actuals, api_variance_matrix, api_spend_timeseries, api_search,
+    api_site_overview, api_archive, api_archive_batches, api_stock, api_stock_movements, api_template_stats,
+    api_changes
 )
 
 app = Flask(__name__)
@@ -38,20 +63,32 @@ else:
     # Default to SQLite for local development
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
 
+# Optional read replica for report views and the read API (see replica.py)
+replica_url = replica_url_from_env()
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: replica_url}
+
+# Optional separate database for archived rows (see archive.py); default is the main database
+archive_url = archive_url_from_env()
+if archive_url:
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[ARCHIVE_BIND] = archive_url
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
+access_log_writer.init_app(app)
+login_throttle.init_app(app)
+assets.init_app(app)
+compress.init_app(app)
+cache.init_app(app)
+replica_router.init_app(app)
+shards.init_app(app)
+template_profiler.init_app(app)
+summaries.init_app(app)
+change_feed.init_app(app)
 
-# Initialize database tables on app startup (works with gunicorn)
-# This ensures tables exist before any requests are processed
-with app.app_context():
-    try:
-        db.create_all()
-        init_db()
-    except Exception as e:
-        # Don't crash if database connection fails during startup
-        # Will retry on first request
-        print(f"Initial database setup: {e}")
+# Schema setup is not done at import: run `flask --app app bootstrap` once per deploy
+# (see bootstrap_command below) so workers start without touching the database
 
 # Template filters
 @app.template_filter('format_currency')
@@ -69,10 +106,9 @@ def format_number_filter(num):
 # Context processor to make project sites available to all templates
 @app.context_processor
 def inject_project_sites():
-    from models import ProjectSite
     try:
         # Only query if database is initialized and tables exist
-        return dict(project_sites=ProjectSite.query.all())
+        return dict(project_sites=get_project_sites())
     except Exception:
         # Return empty list if database isn't ready yet (during startup)
         return dict(project_sites=[])
@@ -143,12 +179,28 @@ def login():
         if not access_code:
             return render_template('login.html', error='Access code is required', existing_session=existing_session)
         
+        # Each candidate code costs one password hash check; refuse cheaply, before any code lookup, when over budget
+        retry_after = login_throttle.check(
+            login_throttle.client_ip(request), get_login_code_count(), trusted=login_throttle.is_trusted(request)
+        )
+        if retry_after:
+            return ('Too many login attempts. Please wait and try again.', 429,
+                    {'Retry-After': str(math.ceil(retry_after)), 'Content-Type': 'text/plain; charset=utf-8'})
+        
         # Check global admin code
         global_admin = AccessCode.query.filter_by(
             code_type='global_admin',
             project_site=None
         ).first()
         
+        # Project site codes (single access code per site), fetched in one query
+        site_codes = db.session.query(ProjectSite, AccessCode).join(
+            AccessCode, db.and_(
+                AccessCode.code_type == 'project_site',
+                AccessCode.project_site == ProjectSite.name
+            )
+        ).order_by(ProjectSite.id).all()
+        
         if global_admin and check_password_hash(global_admin.code_hash, access_code):
             # If there's an existing session and user hasn't confirmed override, warn them
             if existing_session and not override_session:
@@ -169,26 +221,18 @@ def login():
             session['session_token'] = str(uuid.uuid4())
             
             # Log access
-            log = AccessLog(
+            access_log_writer.log(
                 user=session['user_name'],
                 role='admin',
                 access_code=access_code[:4] + '****',
                 status='Success'
             )
-            db.session.add(log)
-            db.session.commit()
             
-            return redirect(url_for('dashboard'))
+            return login_throttle.trust(redirect(url_for('dashboard')))
         
-        # Check project site codes (single access code per site)
-        project_sites = ProjectSite.query.all()
-        for site in project_sites:
-            site_code = AccessCode.query.filter_by(
-                code_type='project_site',
-                project_site=site.name
-            ).first()
-            
-            if site_code and check_password_hash(site_code.code_hash, access_code):
+        # Check project site codes
+        for site, site_code in site_codes:
+            if check_password_hash(site_code.code_hash, access_code):
                 # If there's an existing session and user hasn't confirmed override, warn them
                 if existing_session and not override_session:
                     return render_template('login.html', 
@@ -208,26 +252,22 @@ def login():
                 # Generate unique session token for tab detection
                 session['session_token'] = str(uuid.uuid4())
                 
-                log = AccessLog(
+                access_log_writer.log(
                     user=session['user_name'],
                     role='admin',
                     access_code=access_code[:4] + '****',
                     status='Success'
                 )
-                db.session.add(log)
-                db.session.commit()
                 
-                return redirect(url_for('dashboard'))
+                return login_throttle.trust(redirect(url_for('dashboard')))
         
         # Failed login
-        log = AccessLog(
+        access_log_writer.log(
             user='Unknown',
             role='unknown',
             access_code=access_code[:4] + '****',
             status='Failed'
         )
-        db.session.add(log)
-        db.session.commit()
         
         return render_template('login.html', error='Invalid access code', existing_session=existing_session)
     
@@ -253,6 +293,13 @@ def session_info():
         'project_site': session.get('project_site')
     })
 
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once this process has finished warm_up() (no database access)"""
+    if not warm_up_state['done']:
+        return jsonify({'ready': False}), 503
+    return jsonify({'ready': True, **warm_up_state})
+
 @app.route('/dashboard')
 @require_login
 def dashboard():
@@ -262,17 +309,23 @@ def dashboard():
 
 # Register all routes
 app.add_url_rule('/manual_entry', 'manual_entry', manual_entry, methods=['GET', 'POST'])
+app.add_url_rule('/manual_entry/items', 'manual_entry_items', manual_entry_items)
+app.add_url_rule('/clone_items', 'clone_items', clone_items, methods=['POST'])
 app.add_url_rule('/download_budget_view', 'download_budget_view', download_budget_view)
 app.add_url_rule('/inventory', 'inventory', inventory)
 app.add_url_rule('/edit_item/<int:item_id>', 'edit_item', edit_item, methods=['GET', 'POST'])
+app.add_url_rule('/bulk_edit_items', 'bulk_edit_items', bulk_edit_items, methods=['POST'])
+app.add_url_rule('/record_stock_movement', 'record_stock_movement', record_stock_movement, methods=['POST'])
 app.add_url_rule('/delete_item/<int:item_id>', 'delete_item', delete_item, methods=['GET', 'POST'])
 app.add_url_rule('/delete_all_inventory', 'delete_all_inventory', delete_all_inventory, methods=['POST'])
 app.add_url_rule('/make_request', 'make_request', make_request, methods=['GET', 'POST'])
+app.add_url_rule('/make_request/items', 'item_search', item_search)
 app.add_url_rule('/review_history', 'review_history', review_history)
-app.add_url_rule('/approve_request/<int:request_id>', 'approve_request', approve_request)
-app.add_url_rule('/reject_request/<int:request_id>', 'reject_request', reject_request)
+app.add_url_rule('/approve_request/<int:request_id>', 'approve_request', approve_request, methods=['GET', 'POST'])
+app.add_url_rule('/reject_request/<int:request_id>', 'reject_request', reject_request, methods=['GET', 'POST'])
 app.add_url_rule('/delete_request/<int:request_id>', 'delete_request', delete_request)
 app.add_url_rule('/approve_reject_by_id', 'approve_reject_by_id', approve_reject_by_id, methods=['POST'])
+app.add_url_rule('/claim_requests', 'claim_requests', claim_requests, methods=['POST'])
 app.add_url_rule('/budget_summary', 'budget_summary', budget_summary, methods=['GET'])
 app.add_url_rule('/save_building_config', 'save_building_config', save_building_config, methods=['POST'])
 app.add_url_rule('/actuals', 'actuals', actuals)
@@ -282,6 +335,8 @@ app.add_url_rule('/update_project_site_code', 'update_project_site_code', update
 app.add_url_rule('/add_project_site', 'add_project_site', add_project_site, methods=['POST'])
 app.add_url_rule('/edit_project_site', 'edit_project_site', edit_project_site, methods=['POST'])
 app.add_url_rule('/delete_project_site', 'delete_project_site', delete_project_site, methods=['GET', 'POST'])
+app.add_url_rule('/add_alert_rule', 'add_alert_rule', add_alert_rule, methods=['POST'])
+app.add_url_rule('/delete_alert_rule/<int:rule_id>', 'delete_alert_rule', delete_alert_rule, methods=['POST'])
 app.add_url_rule('/switch_project_site', 'switch_project_site', switch_project_site, methods=['POST'])
 app.add_url_rule('/access_logs', 'access_logs', access_logs)
 app.add_url_rule('/clear_access_logs', 'clear_access_logs', clear_access_logs, methods=['POST'])
@@ -289,10 +344,124 @@ app.add_url_rule('/notifications', 'notifications', notifications)
 app.add_url_rule('/mark_notification_read/<int:notification_id>', 'mark_notification_read', mark_notification_read, methods=['POST'])
 app.add_url_rule('/delete_notification/<int:notification_id>', 'delete_notification', delete_notification, methods=['GET', 'POST'])
 app.add_url_rule('/api/check_notifications', 'check_notifications', check_notifications)
+app.add_url_rule('/api/items', 'api_items', api_items)
+app.add_url_rule('/api/requests', 'api_requests', api_requests)
+app.add_url_rule('/api/actuals', 'api_actuals', api_actuals)
+app.add_url_rule('/api/variance_matrix', 'api_variance_matrix', api_variance_matrix)
+app.add_url_rule('/api/spend_timeseries', 'api_spend_timeseries', api_spend_timeseries)
+app.add_url_rule('/api/search', 'api_search', api_search)
+app.add_url_rule('/api/site_overview', 'api_site_overview', api_site_overview)
+app.add_url_rule('/api/template_stats', 'api_template_stats', api_template_stats)
+app.add_url_rule('/api/archive', 'api_archive', api_archive)
+app.add_url_rule('/api/archive/batches', 'api_archive_batches', api_archive_batches)
+app.add_url_rule('/api/stock', 'api_stock', api_stock)
+app.add_url_rule('/api/stock/movements', 'api_stock_movements', api_stock_movements)
+app.add_url_rule('/api/changes', 'api_changes', api_changes)
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Create or upgrade tables, indexes and search indexes, and seed the default admin code"""
+    started = time.perf_counter()
+    try:
+        moved = init_db()
+    except ShardMigrationError as e:
+        raise click.ClickException(str(e))
+    for site, rows in moved.items():
+        click.echo(f'Moved {rows} rows of project site "{site}" into its shard')
+    click.echo(f'Database bootstrapped in {time.perf_counter() - started:.2f}s')
+
+def print_hot_table_stats(label, site):
+    """Row counts and full-scan times of the hot tables, for comparing before and after an archive run"""
+    with shards.use_site(site):
+        stats = hot_table_stats()
+    click.echo(label)
+    for table, (rows, ms) in stats.items():
+        click.echo(f'  {table:<22} {rows:>10} rows  {ms:8.1f} ms')
+
+@app.cli.command('archive-site')
+@click.argument('site')
+@click.option('--force', is_flag=True, help='Archive even if the site has pending requests')
+def archive_site_command(site, force):
+    """Move a closed project site's data out of the hot tables"""
+    print_hot_table_stats('Before:', site)
+    try:
+        batch = archive_site(site, archived_by='cli', force=force)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    print_hot_table_stats('After:', site)
+    click.echo(f'Archived {batch.row_count} rows as batch {batch.id}')
+
+@app.cli.command('archive-before')
+@click.argument('cutoff', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--site', default=None, help='Only this project site (access logs are then kept)')
+def archive_before_command(cutoff, site):
+    """Move approved/rejected requests and access logs created before CUTOFF (YYYY-MM-DD) to the archive"""
+    print_hot_table_stats('Before:', site)
+    batch = archive_before(cutoff, site=site, archived_by='cli')
+    print_hot_table_stats('After:', site)
+    click.echo(f'Archived {batch.row_count} rows as batch {batch.id}')
+
+@app.cli.command('restore-archive')
+@click.argument('batch_id', type=int)
+def restore_archive_command(batch_id):
+    """Move an archive batch back into the hot tables"""
+    try:
+        restored = restore_batch(batch_id)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Restored {restored} rows from batch {batch_id}')
+
+@app.cli.command('compact-changes')
+def compact_changes_command():
+    """Compact change feed events older than CHANGE_FEED_RETENTION_DAYS (run daily, e.g. from a cron job)"""
+    started = time.perf_counter()
+    dropped, merged = change_feed.compact()
+    click.echo(f'Dropped {dropped} events of deleted rows and merged away {merged} in {time.perf_counter() - started:.2f}s')
+
+# Filled in by warm_up() (gunicorn master or worker, or the development server); /ready answers 503 until then
+warm_up_state = {'done': False, 'templates': 0, 'caches_primed': False, 'seconds': None}
+
+def warm_up(prime_caches=False):
+    """Compile every template and optionally fill the site caches (see gunicorn.conf.py)
+
+    With preload_app this runs once in the gunicorn master, so forked workers start warm.
+    """
+    started = time.perf_counter()
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    primed = warm_up_state['caches_primed']
+    if prime_caches:
+        with app.app_context():
+            try:
+                get_project_sites()
+                get_site_overview()
+                primed = True
+            except SQLAlchemyError as e:
+                # Workers fill the caches on first use instead
+                app.logger.warning('Cache warm-up skipped: %s', e)
+            finally:
+                db.session.remove()
+        # The master keeps no connections; workers open their own
+        dispose_engines()
+    warm_up_state.update(done=True, templates=len(names), caches_primed=primed,
+                         seconds=round(time.perf_counter() - started, 3))
+
+def dispose_engines(close=True):
+    """Drop pooled database connections (close=False in a forked worker: the master's sockets are left alone)"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+    shards.dispose(close=close)
+
+# No warm-up at import: CLI commands (bootstrap, archive, ...) and scripts never render a template.
+# gunicorn warms the master in when_ready, or each worker in post_worker_init without preload
+# (gunicorn.conf.py); the development server warms up below.
 
 if __name__ == '__main__':
     with app.app_context():
         init_db()
+    warm_up()
     # Only run development server locally
     # Production uses gunicorn (see DEPLOYMENT.md for Render setup)
     port = int(os.environ.get('PORT', 5001))
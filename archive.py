@@ -0,0 +1,285 @@
+"""Archive tier: move closed project sites and old requests out of the hot tables, and restore them"""
+import functools
+import json
+import os
+import time
+from datetime import datetime, date
+from decimal import Decimal
+from database import db
+from models import (
+    Item, Request, Notification, Actual, DailySpend, BuildingTypeConfig, AccessLog, ProjectSite,
+    StockMovement, ItemBalance, StockSnapshot, SpendTotal, ArchiveBatch, ArchivedRow
+)
+from shard import shards
+
+# Rows moved per transaction
+ARCHIVE_BATCH_SIZE = 500
+
+# Hot tables that can be archived, in restore order (parents before children)
+HOT_MODELS = (
+    Item, BuildingTypeConfig, DailySpend, SpendTotal, Actual, Request, StockMovement, ItemBalance, StockSnapshot,
+    Notification, AccessLog
+)
+
+def archive_url_from_env():
+    """ARCHIVE_DATABASE_URL normalized like DATABASE_URL (postgres:// -> postgresql://)"""
+    url = os.environ.get('ARCHIVE_DATABASE_URL')
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+class ArchiveError(Exception):
+    """Archive or restore refused; the message says what, if anything, was moved"""
+
+def _hot(stmt, model):
+    """Execute a Core statement on the database (or shard) holding model's table"""
+    return db.session.execute(stmt, bind_arguments={'mapper': model.__mapper__})
+
+def _scopes(site=None):
+    """Sites whose shard must be visited (None = the main database)"""
+    if not shards.enabled:
+        return [None]
+    if site:
+        return [None, site]
+    return [None] + list(db.session.execute(db.select(ProjectSite.name).order_by(ProjectSite.name)).scalars())
+
+def _dump(model, row):
+    """JSON document of a hot row's column values"""
+    values = {}
+    for column in model.__table__.columns:
+        value = row[column.name]
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        values[column.name] = value
+    return json.dumps(values, separators=(',', ':'))
+
+@functools.lru_cache(maxsize=None)
+def _converters(model):
+    """Column name -> function turning an archived JSON value back into the column's type"""
+    converters = {}
+    for column in model.__table__.columns:
+        if isinstance(column.type, db.DateTime):
+            converters[column.name] = datetime.fromisoformat
+        elif isinstance(column.type, db.Date):
+            converters[column.name] = date.fromisoformat
+        elif isinstance(column.type, db.Numeric):
+            converters[column.name] = Decimal
+    return converters
+
+def _load(model, data):
+    """Column values of an archived row, converted back to the column types"""
+    values = json.loads(data)
+    for name, convert in _converters(model).items():
+        value = values.get(name)
+        if value is not None:
+            values[name] = convert(value)
+    return values
+
+def _same_database(model):
+    """Whether archived_rows and model's hot table are on one connection (one transaction can cover both)"""
+    return db.session.get_bind(mapper=ArchivedRow.__mapper__) is db.session.get_bind(mapper=model.__mapper__)
+
+def _same_values(model, row, data):
+    """Whether a hot row holds exactly the values of an archived copy"""
+    return json.loads(_dump(model, row)) == json.loads(data)
+
+def _move_rows(batch, model, where, site, batch_size):
+    """Copy matching hot rows into archived_rows and delete them, batch_size rows per transaction
+
+    When archived_rows is in the same database as the hot table, copy and delete commit together.
+    Otherwise (separate archive database, site shards) the copy commits first, so a crash in between
+    leaves a row in both places, never in neither: rerunning the archive finishes the move, and
+    restore_batch() skips hot rows that already match their archived copy.
+    """
+    table = model.__table__
+    atomic = _same_database(model)
+    moved = 0
+    last_id = 0
+    while True:
+        # Keyset paging: rows up to last_id were moved or do not match, and are not scanned again
+        rows = _hot(db.select(table).where(table.c.id > last_id, *where).order_by(table.c.id).limit(batch_size),
+                    model).mappings().all()
+        if not rows:
+            return moved
+        last_id = rows[-1]['id']
+        records = [{
+            'batch_id': batch.id,
+            'source_table': table.name,
+            # Rows without a site column (notifications, access logs) are filed under the archived site
+            'project_site': row.get('project_site') or site or '',
+            'row_id': row['id'],
+            'data': _dump(model, row),
+        } for row in rows]
+        # Rows copied by an earlier run that stopped before deleting them are not copied twice
+        done = set(db.session.execute(
+            db.select(ArchivedRow.project_site, ArchivedRow.row_id).where(
+                ArchivedRow.source_table == table.name,
+                # Every column of uq_archived_rows_source, so this is an index lookup
+                ArchivedRow.project_site.in_({record['project_site'] for record in records}),
+                ArchivedRow.row_id.in_([row['id'] for row in rows])
+            )
+        ).tuples())
+        records = [record for record in records if (record['project_site'], record['row_id']) not in done]
+        if records:
+            db.session.execute(db.insert(ArchivedRow), records)
+        if not atomic:
+            db.session.commit()
+        db.session.execute(db.delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+        db.session.commit()
+        moved += len(rows)
+
+def _start_batch(**fields):
+    batch = ArchiveBatch(**fields)
+    db.session.add(batch)
+    db.session.commit()
+    return batch
+
+def archive_site(site, archived_by=None, force=False, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move every item, request, actual, notification, stock row, rollup and building config of a site to the archive"""
+    if not force:
+        for scope in _scopes(site):
+            with shards.use_site(scope):
+                pending = _hot(db.select(db.func.count()).select_from(Request.__table__).where(
+                    Request.project_site == site, Request.status == 'Pending'
+                ), Request).scalar()
+            if pending:
+                raise ArchiveError(f'Project site "{site}" still has {pending} pending request(s)')
+
+    batch = _start_batch(kind='site', project_site=site, archived_by=archived_by)
+    # Correlated: a primary key lookup per notification instead of listing the site's requests every batch
+    site_requests = db.select(Request.__table__.c.id).where(
+        Request.__table__.c.id == Notification.request_id, Request.project_site == site
+    ).exists()
+    site_items = db.select(Item.__table__.c.id).where(Item.project_site == site)
+    moved = 0
+    for scope in _scopes(site):
+        with shards.use_site(scope):
+            # Children before parents
+            moved += _move_rows(batch, Notification, [site_requests], site, batch_size)
+            for model in (ItemBalance, StockSnapshot):
+                moved += _move_rows(batch, model, [model.item_id.in_(site_items)], site, batch_size)
+            for model in (StockMovement, Request, Actual, DailySpend, SpendTotal, BuildingTypeConfig, Item):
+                moved += _move_rows(batch, model, [model.project_site == site], site, batch_size)
+    batch.row_count = moved
+    db.session.commit()
+    return batch
+
+def archive_before(cutoff, site=None, archived_by=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move decided requests (with their notifications) and access logs older than cutoff to the archive"""
+    batch = _start_batch(kind='before', project_site=site, cutoff=cutoff, archived_by=archived_by)
+    where = [Request.status != 'Pending', Request.created_at < cutoff]
+    if site:
+        where.append(Request.project_site == site)
+    old_requests = db.select(Request.__table__.c.id).where(
+        Request.__table__.c.id == Notification.request_id, *where
+    ).exists()
+    moved = 0
+    for scope in _scopes(site):
+        with shards.use_site(scope):
+            moved += _move_rows(batch, Notification, [old_requests], scope, batch_size)
+            moved += _move_rows(batch, Request, where, scope, batch_size)
+    if not site:
+        # Access logs are not per site; they are only archived with a site-wide cutoff
+        moved += _move_rows(batch, AccessLog, [AccessLog.created_at < cutoff], None, batch_size)
+    batch.row_count = moved
+    db.session.commit()
+    return batch
+
+def _archived_pages(batch, model, batch_size):
+    """Pages of a batch's archived rows of model with the hot rows holding their ids, in each row's shard"""
+    table = model.__table__
+    sites = db.session.execute(
+        db.select(ArchivedRow.project_site).where(
+            ArchivedRow.batch_id == batch.id, ArchivedRow.source_table == table.name
+        ).distinct()
+    ).scalars().all()
+    for site in sites:
+        scope = site if table.name != 'access_logs' else None
+        with shards.use_site(scope):
+            last_id = 0
+            while True:
+                # In row id order along uq_archived_rows_source, keyset paged
+                archived = db.session.execute(
+                    db.select(ArchivedRow.id, ArchivedRow.row_id, ArchivedRow.data).where(
+                        ArchivedRow.source_table == table.name,
+                        ArchivedRow.project_site == site,
+                        ArchivedRow.row_id > last_id,
+                        ArchivedRow.batch_id == batch.id
+                    ).order_by(ArchivedRow.row_id).limit(batch_size)
+                ).all()
+                if not archived:
+                    break
+                last_id = archived[-1].row_id
+                hot_rows = {row['id']: row for row in _hot(
+                    db.select(table).where(table.c.id.in_([row.row_id for row in archived])), model
+                ).mappings()}
+                yield archived, hot_rows
+
+def _taken(model, archived, hot_rows):
+    """Row ids of archived rows whose id is held by a different hot row
+
+    A row already back with the same values was left behind by an interrupted archive or restore;
+    any other row holding the id is a newer one.
+    """
+    return [row.row_id for row in archived
+            if row.row_id in hot_rows and not _same_values(model, hot_rows[row.row_id], row.data)]
+
+def restore_batch(batch_id, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move an archive batch's rows back into the hot tables (with their original ids)
+
+    Every archived row of every table is checked for an id in use before any row is moved, so a
+    conflict refuses the whole restore. The move then commits page by page: if it stops part way
+    (a crash, or a row taking an id after the check), the rows moved so far stay restored and
+    rerunning restore_batch() moves the rest.
+    """
+    batch = db.session.get(ArchiveBatch, batch_id)
+    if batch is None:
+        raise ArchiveError(f'Archive batch {batch_id} not found')
+    if batch.restored_at is not None:
+        raise ArchiveError(f'Archive batch {batch_id} was already restored')
+
+    for model in HOT_MODELS:
+        taken = []
+        for archived, hot_rows in _archived_pages(batch, model, batch_size):
+            taken += _taken(model, archived, hot_rows)
+        if taken:
+            db.session.rollback()
+            raise ArchiveError(
+                f'Cannot restore {model.__tablename__} rows {sorted(taken)[:10]}: their ids are in use again '
+                '(nothing was restored)'
+            )
+
+    restored = 0
+    for model in HOT_MODELS:
+        table = model.__table__
+        for archived, hot_rows in _archived_pages(batch, model, batch_size):
+            taken = _taken(model, archived, hot_rows)
+            if taken:
+                db.session.rollback()
+                raise ArchiveError(
+                    f'Cannot restore {table.name} rows {sorted(taken)[:10]}: their ids were taken during the '
+                    f'restore ({restored} rows were restored; rerun it once they are freed to restore the rest)'
+                )
+            missing = [_load(model, row.data) for row in archived if row.row_id not in hot_rows]
+            if missing:
+                db.session.execute(db.insert(table), missing)
+            if not _same_database(model):
+                # Hot copy is committed first, as when archiving
+                db.session.commit()
+            db.session.execute(db.delete(ArchivedRow).where(ArchivedRow.id.in_([row.id for row in archived])))
+            db.session.commit()
+            restored += len(archived)
+    batch.restored_at = datetime.utcnow()
+    db.session.commit()
+    return restored
+
+def hot_table_stats():
+    """Row count and full-scan time (ms) of each archivable hot table in the current database or shard"""
+    stats = {}
+    for model in HOT_MODELS:
+        started = time.perf_counter()
+        rows = _hot(db.select(db.func.count()).select_from(model.__table__), model).scalar()
+        stats[model.__tablename__] = (rows, (time.perf_counter() - started) * 1000)
+    return stats
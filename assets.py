@@ -0,0 +1,61 @@
+"""Serve fingerprinted static assets built by build_assets.py with long-lived caching"""
+import json
+import mimetypes
+import os
+from flask import url_for, send_from_directory, request, abort
+from werkzeug.security import safe_join
+
+# Fingerprinted names never change content, so browsers may cache them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class Assets:
+    """asset_url() template helper plus the /assets/ route for static/dist"""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.dist_dir = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.dist_dir = os.path.join(app.static_folder, 'dist')
+        self.manifest = self._load_manifest()
+        app.add_url_rule('/assets/<path:filename>', 'hashed_asset', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+
+    def _load_manifest(self):
+        # Without a build (local development) asset_url() falls back to plain /static URLs
+        try:
+            with open(os.path.join(self.dist_dir, 'manifest.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def url(self, filename):
+        """URL for a file under static/, fingerprinted when a build exists"""
+        hashed = self.manifest.get(filename)
+        if hashed:
+            return url_for('hashed_asset', filename=hashed)
+        return url_for('static', filename=filename)
+
+    def serve(self, filename):
+        """Serve a fingerprinted file, preferring the precompressed variant the client accepts"""
+        path = safe_join(self.dist_dir, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+                response = send_from_directory(self.dist_dir, filename + suffix, max_age=31536000)
+                response.headers['Content-Encoding'] = encoding
+                # Keep the original file's type rather than application/gzip
+                response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                break
+        else:
+            response = send_from_directory(self.dist_dir, filename, max_age=31536000)
+
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+assets = Assets()
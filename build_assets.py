@@ -0,0 +1,76 @@
+"""Build fingerprinted, precompressed static assets
+
+Usage: python build_assets.py
+
+Copies every file under static/ (except static/dist) to static/dist/ with a content hash in
+its name, writes .gz (and .br when the optional `brotli` package is installed) variants, and
+records the mapping in static/dist/manifest.json. Templates link assets through asset_url(),
+which reads the manifest, so no template files are rewritten on disk.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:  # Optional: only gzip variants are produced without it
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+
+# Already-compressed formats gain nothing from gzip/brotli
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+
+def fingerprint(path):
+    """Short content hash used in the output file name"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def build():
+    """Rebuild static/dist and return the manifest"""
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+
+    manifest = {}
+    for root, dirs, files in os.walk(STATIC_DIR):
+        if os.path.abspath(root).startswith(DIST_DIR):
+            continue
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != DIST_DIR]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, STATIC_DIR).replace(os.sep, '/')
+            stem, ext = os.path.splitext(logical)
+            hashed = f'{stem}.{fingerprint(source)}{ext}'
+
+            target = os.path.join(DIST_DIR, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+
+            if ext in COMPRESSIBLE_EXTENSIONS:
+                with open(source, 'rb') as f:
+                    data = f.read()
+                # mtime=0 keeps the .gz byte-identical across builds
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+
+            manifest[logical] = hashed
+
+    with open(os.path.join(DIST_DIR, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+if __name__ == '__main__':
+    built = build()
+    for logical, hashed in sorted(built.items()):
+        print(f'{logical} -> dist/{hashed}')
+    if brotli is None:
+        print('brotli not installed: only gzip variants were written (pip install brotli)')
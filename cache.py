@@ -0,0 +1,55 @@
+"""Small in-process TTL cache for expensive, slowly changing aggregates"""
+import os
+import threading
+import time
+
+class TTLCache:
+    """Per-process key/value cache whose entries expire after CACHE_TTL seconds
+
+    Each gunicorn worker has its own copy, so a value may be up to CACHE_TTL seconds stale
+    in other workers after delete() is called in one of them.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TTL', float(os.environ.get('CACHE_TTL', 60)))  # seconds
+        app.config.setdefault('CACHE_MAX_ENTRIES', 1000)
+        self.app = app
+
+    def get_or_set(self, key, compute, ttl=None):
+        """Cached value for key, calling compute() to fill it when missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        # Computed outside the lock; concurrent misses may both compute, last one wins
+        value = compute()
+        ttl = self.app.config['CACHE_TTL'] if ttl is None else ttl
+        with self._lock:
+            if len(self._entries) >= self.app.config['CACHE_MAX_ENTRIES']:
+                self._entries = {k: e for k, e in self._entries.items() if e[0] > now}
+                if len(self._entries) >= self.app.config['CACHE_MAX_ENTRIES']:
+                    # Still full of live entries: drop the one expiring soonest
+                    self._entries.pop(min(self._entries, key=lambda k: self._entries[k][0]))
+            self._entries[key] = (now + ttl, value)
+        return value
+
+    def delete(self, key):
+        """Drop a cached value (call after writes that change it)"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every cached value"""
+        with self._lock:
+            self._entries.clear()
+
+cache = TTLCache()
@@ -0,0 +1,204 @@
+"""Per-site change feed: insert, update and delete events of items, requests, actuals and notifications"""
+import json
+import os
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from sqlalchemy import event
+from database import db, RoutingSession
+from models import Item, Request, Actual, Notification, ProjectSite, ChangeEvent
+from shard import shards
+
+# Models whose writes are recorded, by table name
+CHANGE_MODELS = {model.__tablename__: model for model in (Item, Request, Actual, Notification)}
+COMPACT_BATCH_SIZE = 500
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _dump(values):
+    return json.dumps({key: _json_value(value) for key, value in values.items()}, separators=(',', ':'))
+
+def _audience(model, values):
+    """(project site, recipient) of an event: notifications go to a user, other rows belong to a site"""
+    if model is Notification:
+        return None, values.get('user_id')
+    return values.get('project_site'), None
+
+def make_cursor(event_id, synced_at):
+    """Opaque cursor: the last event id seen and the time the feed was complete up to"""
+    return f'{event_id}.{int((synced_at - datetime(1970, 1, 1)).total_seconds())}'
+
+def parse_cursor(cursor):
+    """(event id, synced at) of a cursor made by make_cursor(); raises ValueError"""
+    event_id, _, seconds = cursor.partition('.')
+    return int(event_id), datetime(1970, 1, 1) + timedelta(seconds=int(seconds))
+
+class ChangeFeed:
+    """Records every ORM write of CHANGE_MODELS as a ChangeEvent in the same transaction
+
+    Inserts carry the row's values, updates only the changed columns and deletes no values,
+    so /api/changes can hand out compact deltas after a cursor. Set-based writes (one UPDATE
+    or INSERT ... SELECT for many rows) bypass the ORM and call record() instead. Events live
+    with the rows they describe (in the site's shard when sharding is on).
+
+    compact() bounds the feed: events older than CHANGE_FEED_RETENTION_DAYS are folded into
+    one per row, and rows deleted before then lose their events altogether.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CHANGE_FEED_ENABLED', os.environ.get('CHANGE_FEED_ENABLED', '1') != '0')
+        app.config.setdefault('CHANGE_FEED_RETENTION_DAYS', int(os.environ.get('CHANGE_FEED_RETENTION_DAYS', 7)))
+        # Events younger than this are not served yet, so a transaction still committing a lower id is not skipped
+        app.config.setdefault('CHANGE_FEED_SETTLE_SECONDS', float(os.environ.get('CHANGE_FEED_SETTLE_SECONDS', 2)))
+        event.listen(RoutingSession, 'after_flush', self._after_flush)
+        self.app = app
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config['CHANGE_FEED_ENABLED']
+
+    def _after_flush(self, db_session, flush_context):
+        if not self.enabled:
+            return
+        rows = []
+        for op, objects in (('insert', db_session.new), ('update', db_session.dirty), ('delete', db_session.deleted)):
+            for obj in objects:
+                model = type(obj)
+                if model not in CHANGE_MODELS.values():
+                    continue
+                state = db.inspect(obj)
+                # Loaded values only: expired attributes are not reloaded mid-flush
+                values = {attr.key: state.dict.get(attr.key) for attr in state.mapper.column_attrs}
+                data = None
+                if op == 'insert':
+                    data = {key: value for key, value in values.items() if value is not None}
+                elif op == 'update':
+                    data = {}
+                    for attr in state.mapper.column_attrs:
+                        added = state.attrs[attr.key].history.added
+                        if added:
+                            data[attr.key] = added[0]
+                    if not data:
+                        continue
+                site, recipient = _audience(model, values)
+                rows.append({
+                    'table_name': model.__tablename__, 'op': op,
+                    # New rows are not in the identity map until the flush is finalized
+                    'row_id': values['id'] if op == 'insert' else state.identity[0],
+                    'project_site': site, 'recipient_id': recipient,
+                    'data': _dump(data) if data is not None else None,
+                })
+        if rows:
+            # Flushed with the writes themselves: rolled back and committed together
+            db_session.execute(db.insert(ChangeEvent), rows)
+
+    def record(self, model, op, where, columns=None):
+        """Events for a set-based write of the model rows matching where (caller commits)
+
+        Call it before a DELETE, and after an INSERT or UPDATE with the columns it set
+        (every column for inserts).
+        """
+        if not self.enabled:
+            return
+        table = model.__table__
+        if model is Notification:
+            site, recipient = db.null(), table.c.user_id
+        else:
+            site, recipient = table.c.project_site, db.null()
+        if op == 'delete':
+            # No values to carry: one INSERT ... SELECT
+            db.session.execute(db.insert(ChangeEvent).from_select(
+                ['table_name', 'row_id', 'op', 'project_site', 'recipient_id', 'created_at'],
+                db.select(db.literal(table.name), table.c.id, db.literal('delete'), site, recipient,
+                          db.literal(datetime.utcnow())).where(*where)
+            ))
+            return
+        columns = list(table.c) if columns is None else [table.c[column.key] for column in columns]
+        rows = db.session.execute(
+            db.select(table.c.id, site.label('event_site'), recipient.label('event_recipient'), *columns).where(*where)
+        ).mappings().all()
+        if rows:
+            db.session.execute(db.insert(ChangeEvent), [{
+                'table_name': table.name, 'row_id': row['id'], 'op': op,
+                'project_site': row['event_site'], 'recipient_id': row['event_recipient'],
+                'data': _dump({column.key: row[column.key] for column in columns
+                               if op == 'update' or row[column.key] is not None}),
+            } for row in rows])
+
+    def compact(self, now=None, batch_size=COMPACT_BATCH_SIZE):
+        """Fold events older than the retention window into one per row and drop those of deleted rows
+
+        Runs in the main database and every site shard; returns (events dropped, events merged away).
+        """
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.app.config['CHANGE_FEED_RETENTION_DAYS'])
+        scopes = [None]
+        if shards.enabled:
+            scopes += db.session.execute(db.select(ProjectSite.name).order_by(ProjectSite.name)).scalars().all()
+        dropped = merged = 0
+        for scope in scopes:
+            with shards.use_site(scope):
+                dropped += self._drop_deleted(cutoff)
+                merged += self._merge(cutoff, batch_size)
+        return dropped, merged
+
+    def _drop_deleted(self, cutoff):
+        # A delete and every earlier event of its row (ids may be reused by a later row)
+        tombstone = db.aliased(ChangeEvent)
+        result = db.session.execute(db.delete(ChangeEvent).where(
+            ChangeEvent.created_at < cutoff,
+            db.select(tombstone.id).where(
+                tombstone.table_name == ChangeEvent.table_name,
+                tombstone.row_id == ChangeEvent.row_id,
+                tombstone.op == 'delete',
+                tombstone.created_at < cutoff,
+                tombstone.id >= ChangeEvent.id
+            ).exists()
+        ).execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
+
+    def _merge(self, cutoff, batch_size):
+        merged = 0
+        while True:
+            keys = db.session.execute(
+                db.select(ChangeEvent.table_name, ChangeEvent.row_id).where(ChangeEvent.created_at < cutoff).group_by(
+                    ChangeEvent.table_name, ChangeEvent.row_id
+                ).having(db.func.count() > 1).limit(batch_size)
+            ).all()
+            if not keys:
+                return merged
+            events = db.session.execute(
+                db.select(ChangeEvent.id, ChangeEvent.table_name, ChangeEvent.row_id, ChangeEvent.op, ChangeEvent.data).where(
+                    ChangeEvent.created_at < cutoff,
+                    db.tuple_(ChangeEvent.table_name, ChangeEvent.row_id).in_([tuple(key) for key in keys])
+                ).order_by(ChangeEvent.id)
+            ).all()
+            folded = {}
+            for event_id, table_name, row_id, op, data in events:
+                key = (table_name, row_id)
+                if key not in folded:
+                    folded[key] = {'op': op, 'data': {}, 'ids': []}
+                folded[key]['data'].update(json.loads(data) if data else {})
+                folded[key]['ids'].append(event_id)
+            # The latest event of each row keeps its position and takes the merged values
+            older = []
+            for entry in folded.values():
+                older += entry['ids'][:-1]
+                db.session.execute(db.update(ChangeEvent.__table__).where(ChangeEvent.id == entry['ids'][-1]).values(
+                    op='insert' if entry['op'] == 'insert' else 'update',
+                    data=json.dumps(entry['data'], separators=(',', ':'))
+                ))
+            db.session.execute(db.delete(ChangeEvent.__table__).where(ChangeEvent.id.in_(older)))
+            db.session.commit()
+            merged += len(older)
+
+change_feed = ChangeFeed()
@@ -1,16 +1,68 @@
 """Database configuration and initialization"""
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 
-db = SQLAlchemy()
+# Bind key of the optional read replica (SQLALCHEMY_BINDS, see replica.py)
+REPLICA_BIND = 'replica'
+
+# Bind key of the optional separate archive database, and the tables that live there (see archive.py)
+ARCHIVE_BIND = 'archive'
+ARCHIVE_TABLES = ('archive_batches', 'archived_rows')
+
+# Per-site tables that move to the site's shard when sharding is enabled (see shard.py)
+SHARDED_TABLES = (
+    'items', 'requests', 'notifications', 'actuals', 'daily_spend', 'building_type_configs',
+    'stock_movements', 'item_balances', 'stock_snapshots', 'spend_totals', 'change_events',
+)
+
+class RoutingSession(Session):
+    """Session that reads from the replica bind while a view has opted in, and writes to the primary
+
+    Sharded tables go to the current site's shard instead, when one is selected, and archive
+    tables to the archive bind when one is configured.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        table = mapper.local_table if mapper is not None else getattr(clause, 'table', None)
+        table_name = getattr(table, 'name', None)
+        if bind is None and table_name in SHARDED_TABLES and has_app_context() and g.get('shard_engine') is not None:
+            return g.shard_engine
+        if bind is None and table_name in ARCHIVE_TABLES and ARCHIVE_BIND in self._db.engines:
+            return self._db.engines[ARCHIVE_BIND]
+        # Writes (flushes and INSERT/UPDATE/DELETE statements) always go to the primary
+        writing = self._flushing or getattr(clause, 'is_dml', False)
+        if bind is None and not writing and has_app_context() and g.get('use_replica'):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 def init_db():
-    """Initialize database with tables and default data"""
+    """Initialize database with tables and default data; returns rows moved into each site's shard"""
     from models import (
         Item, Request, Notification, Actual, ProjectSite,
         AccessCode, AccessLog, BuildingTypeConfig
     )
     
+    from search import ensure_search_index
+    from shard import shards
+    
+    moved = {}
     db.create_all()
+    migrate_db()
+    ensure_indexes()
+    ensure_search_index()
+    if ARCHIVE_BIND in db.engines:
+        db.metadata.create_all(db.engines[ARCHIVE_BIND], tables=[db.metadata.tables[name] for name in ARCHIVE_TABLES])
+    if shards.enabled:
+        # Shards of sites created before sharding was turned on (new sites are provisioned on creation)
+        for site_id in db.session.execute(db.select(ProjectSite.id)).scalars():
+            shards.provision(site_id)
+        # ... and the rows those sites still have in the main database, which requests would no longer see
+        moved = shards.migrate_primary_rows()
     
     # Create default global admin code if none exists
     # This is the ONLY default access code - project sites must be created manually
@@ -28,4 +80,61 @@ def init_db():
     
     # Note: Project sites and their access codes are created manually through Admin Settings
     # No default project sites or access codes are created automatically
+    return moved
+
+def migrate_db():
+    """Bring tables created by older versions up to date with the models"""
+    from models import DailySpend, Actual, StockMovement, Request, SpendTotal, Item
+    from rollups import rebuild_daily_spend, rebuild_spend_totals
+    from stock import backfill_request_issues
+    
+    # actuals.actual_date used to be a String(50) holding 'YYYY-MM-DD'
+    if db.engine.dialect.name == 'postgresql':
+        columns = {c['name']: c for c in db.inspect(db.engine).get_columns('actuals')}
+        if not isinstance(columns['actual_date']['type'], db.Date):
+            with db.engine.begin() as conn:
+                conn.execute(db.text(
+                    "ALTER TABLE actuals ALTER COLUMN actual_date TYPE DATE "
+                    "USING NULLIF(actual_date, '')::date"
+                ))
+    else:
+        # SQLite stores Date as 'YYYY-MM-DD' text already; only blanks need fixing
+        with db.engine.begin() as conn:
+            conn.execute(db.text("UPDATE actuals SET actual_date = NULL WHERE actual_date = ''"))
+    
+    # Approval queue columns on requests
+    add_missing_columns('requests', {
+        'claimed_by': 'VARCHAR(150)',
+        'claimed_at': 'TIMESTAMP',
+        'version': 'INTEGER NOT NULL DEFAULT 1',
+    })
+    
+    # Backfill the daily spend rollup the first time it exists
+    if DailySpend.query.first() is None and Actual.query.first() is not None:
+        rebuild_daily_spend()
+    
+    # Backfill the running totals checked by alert rules
+    if SpendTotal.query.first() is None and Item.query.first() is not None:
+        rebuild_spend_totals()
+    
+    # Start the stock ledger with the issues of requests approved before it existed
+    if StockMovement.query.first() is None and Request.query.filter_by(status='Approved').first() is not None:
+        backfill_request_issues()
+
+def add_missing_columns(table, columns):
+    """ALTER TABLE ... ADD COLUMN for each column (name -> SQL type) the table does not have yet"""
+    existing = {c['name'] for c in db.inspect(db.engine).get_columns(table)}
+    with db.engine.begin() as conn:
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
 
+def ensure_indexes():
+    """Create indexes declared on the models that are missing from existing tables"""
+    # create_all() only creates indexes together with new tables. IF NOT EXISTS rather than
+    # checkfirst, because reflection cannot see expression indexes like ix_items_site_amount
+    from sqlalchemy.schema import CreateIndex
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
@@ -0,0 +1,38 @@
+"""Production gunicorn profile, read automatically by `gunicorn app:app` from the project directory"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Requests mostly wait on the database, so each process serves several at once on threads
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import the app, compile templates and fill caches once in the master; workers are forked warm
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then (jittered so they do not all restart together)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+def when_ready(server):
+    """Runs in the master after the preloaded app is imported and before any worker is forked"""
+    from app import warm_up, warm_up_state
+    warm_up(prime_caches=True)
+    server.log.info('Warm-up done: %(templates)s templates, caches primed: %(caches_primed)s, %(seconds)ss',
+                    warm_up_state)
+
+def post_fork(server, worker):
+    """Pooled database connections must not be shared with the master or other workers"""
+    from app import dispose_engines
+    dispose_engines(close=False)
+
+def post_worker_init(worker):
+    """Workers not forked from a warmed master (--no-preload) warm up themselves before serving /ready"""
+    from app import warm_up, warm_up_state
+    if not warm_up_state['done']:
+        warm_up()
@@ -1,10 +1,30 @@
 """Database models for Inventory Management System"""
 from database import db
 from datetime import datetime
+from decimal import Decimal
+from sqlalchemy.ext.hybrid import hybrid_property
+
+CENTS = Decimal('0.01')
+
+def to_decimal(value):
+    """Convert a Numeric column value (or a float/str assigned by a form) to Decimal"""
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
 
 class Item(db.Model):
     """Inventory items"""
     __tablename__ = 'items'
+    __table_args__ = (
+        db.Index('ix_items_site_budget', 'project_site', 'budget'),
+        db.Index('ix_items_site_section', 'project_site', 'section'),
+        db.Index('ix_items_site_building_type', 'project_site', 'building_type'),
+        db.Index('ix_items_site_created', 'project_site', 'created_at'),
+        # Covers the variance matrix's planned query: read in group order, no table lookups
+        db.Index('ix_items_site_cells', 'project_site', 'budget', 'building_type', 'grp', 'qty', 'unit_cost'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(100), nullable=True)
@@ -20,16 +40,39 @@ class Item(db.Model):
     project_site = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    @property
+    @hybrid_property
     def amount(self):
-        """Calculate total amount"""
+        """Calculate total amount (qty x unit cost) as an exact Decimal"""
         if self.qty and self.unit_cost:
-            return float(self.qty) * float(self.unit_cost)
-        return 0.0
+            return (to_decimal(self.qty) * to_decimal(self.unit_cost)).quantize(CENTS)
+        return Decimal('0.00')
+    
+    @amount.inplace.expression
+    @classmethod
+    def _amount_expression(cls):
+        """SQL form of amount, usable in ORDER BY, SUM and range filters"""
+        return db.type_coerce(item_amount_sql(cls), db.Numeric(14, 2))
+
+def item_amount_sql(item):
+    """qty * unit_cost expression shared by Item.amount and its index"""
+    # Literal 0 (not a bound parameter) so SQLite can match the expression index
+    return item.qty * db.func.coalesce(item.unit_cost, db.literal_column('0'))
+
+# Server-side sorting by amount and unit cost in the inventory tab
+db.Index('ix_items_site_amount', Item.project_site, item_amount_sql(Item))
+db.Index('ix_items_site_unit_cost', Item.project_site, Item.unit_cost)
+
+# Typeahead prefix search on item name and code (see item_search in routes.py)
+db.Index('ix_items_site_name_lower', Item.project_site, db.func.lower(Item.name))
+db.Index('ix_items_site_code_lower', Item.project_site, db.func.lower(Item.code))
 
 class Request(db.Model):
     """Item requests"""
     __tablename__ = 'requests'
+    __table_args__ = (
+        db.Index('ix_requests_site_status', 'project_site', 'status', 'created_at'),
+        db.Index('ix_requests_site_created', 'project_site', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     ts = db.Column(db.DateTime, default=datetime.utcnow)
@@ -46,8 +89,15 @@ class Request(db.Model):
     project_site = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Approval queue: who is working on the request, and an optimistic-locking version
+    claimed_by = db.Column(db.String(150), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     item = db.relationship('Item', backref='requests')
+    
+    # Every ORM UPDATE/DELETE checks the version it loaded, so concurrent decisions cannot both win
+    __mapper_args__ = {'version_id_col': version}
 
 class Notification(db.Model):
     """System notifications"""
@@ -67,12 +117,18 @@ class Notification(db.Model):
 class Actual(db.Model):
     """Actual costs and quantities"""
     __tablename__ = 'actuals'
+    __table_args__ = (
+        db.Index('ix_actuals_site_date', 'project_site', 'actual_date'),
+        db.Index('ix_actuals_item', 'item_id'),
+        # Covers the variance matrix's actual cost query
+        db.Index('ix_actuals_site_item_cost', 'project_site', 'item_id', 'actual_cost'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
     actual_qty = db.Column(db.Numeric(10, 2), nullable=False)
     actual_cost = db.Column(db.Numeric(10, 2), nullable=False)
-    actual_date = db.Column(db.String(50), nullable=True)
+    actual_date = db.Column(db.Date, nullable=True)
     recorded_by = db.Column(db.String(100), nullable=True)
     notes = db.Column(db.Text, nullable=True)
     project_site = db.Column(db.String(100), nullable=True)
@@ -80,6 +136,119 @@ class Actual(db.Model):
     
     item = db.relationship('Item', backref='actuals')
 
+class DailySpend(db.Model):
+    """Daily actual spend rollup per (project site, grp, building type), updated as actuals are recorded"""
+    __tablename__ = 'daily_spend'
+    __table_args__ = (
+        db.UniqueConstraint('project_site', 'grp', 'building_type', 'day', name='uq_daily_spend_key'),
+        db.Index('ix_daily_spend_site_day', 'project_site', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Key columns use '' instead of NULL so the unique constraint (and upserts) cover them
+    project_site = db.Column(db.String(100), nullable=False, default='')
+    grp = db.Column(db.String(100), nullable=False, default='')
+    building_type = db.Column(db.String(50), nullable=False, default='')
+    day = db.Column(db.Date, nullable=False)
+    actual_qty = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    actual_cost = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+class StockMovement(db.Model):
+    """Append-only stock ledger: receipts, issues for approved requests and adjustments (see stock.py)"""
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_item', 'item_id', 'id'),
+        db.Index('ix_stock_movements_site_created', 'project_site', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'receipt', 'issue' or 'adjustment'
+    qty = db.Column(db.Numeric(14, 2), nullable=False)  # Signed change in stock on hand (issues are negative)
+    request_id = db.Column(db.Integer, nullable=True)  # No foreign key: the ledger outlives archived requests
+    note = db.Column(db.Text, nullable=True)
+    recorded_by = db.Column(db.String(100), nullable=True)
+    project_site = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    item = db.relationship('Item', backref='stock_movements')
+
+class ItemBalance(db.Model):
+    """Running stock totals per item, updated with every StockMovement"""
+    __tablename__ = 'item_balances'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False, unique=True)
+    received = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    issued = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    adjusted = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    on_hand = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    movements = db.Column(db.Integer, nullable=False, default=0)
+    last_movement_at = db.Column(db.DateTime, nullable=True)
+
+class StockSnapshot(db.Model):
+    """Stock totals per item at the end of each day with movements, for one-row as-of queries"""
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('item_id', 'day', name='uq_stock_snapshots_item_day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    received = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    issued = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    adjusted = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    on_hand = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+class SpendTotal(db.Model):
+    """Running planned and actual totals per item, budget and group of a site, checked by alert rules"""
+    __tablename__ = 'spend_totals'
+    __table_args__ = (
+        db.UniqueConstraint('project_site', 'scope', 'scope_key', name='uq_spend_totals_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_site = db.Column(db.String(100), nullable=False, default='')
+    scope = db.Column(db.String(20), nullable=False)  # 'item', 'budget' or 'grp'
+    scope_key = db.Column(db.String(200), nullable=False)  # Item id, main budget or group name
+    # Budgets and groups only: an item's planned amount is Item.amount itself
+    planned = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    actual_cost = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    actual_qty = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+class AlertRule(db.Model):
+    """Overspend / threshold rule raising a Notification when a spend total or request crosses it (see alerts.py)"""
+    __tablename__ = 'alert_rules'
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_site = db.Column(db.String(100), nullable=True)  # None = every project site
+    scope = db.Column(db.String(20), nullable=False)  # 'item', 'budget', 'grp' or 'request'
+    scope_key = db.Column(db.String(200), nullable=True)  # Item id, budget or group; None = every one
+    threshold_pct = db.Column(db.Numeric(7, 2), nullable=False)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_by = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ChangeEvent(db.Model):
+    """Append-only change feed entry: an insert, update or delete of an item, request, actual or notification (see changes.py)"""
+    __tablename__ = 'change_events'
+    __table_args__ = (
+        db.Index('ix_change_events_site', 'project_site', 'id'),
+        db.Index('ix_change_events_recipient', 'recipient_id', 'id'),
+        db.Index('ix_change_events_row', 'table_name', 'row_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)  # Feed position (the cursor)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # 'insert', 'update' or 'delete'
+    project_site = db.Column(db.String(100), nullable=True)
+    recipient_id = db.Column(db.Integer, nullable=True)  # Notifications only: their user_id (None = global admins)
+    data = db.Column(db.Text, nullable=True)  # JSON of the new column values (changed ones only for updates)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class ProjectSite(db.Model):
     """Project sites"""
     __tablename__ = 'project_sites'
@@ -104,6 +273,10 @@ class AccessCode(db.Model):
 class AccessLog(db.Model):
     """Access log for audit trail"""
     __tablename__ = 'access_logs'
+    __table_args__ = (
+        db.Index('ix_access_logs_created', 'created_at'),
+        db.Index('ix_access_logs_role_created', 'role', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user = db.Column(db.String(100), nullable=True)
@@ -135,3 +308,31 @@ class BuildingTypeConfig(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class ArchiveBatch(db.Model):
+    """One archive run: a closed project site, or decided requests older than a cutoff (see archive.py)"""
+    __tablename__ = 'archive_batches'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'site' or 'before'
+    project_site = db.Column(db.String(100), nullable=True)
+    cutoff = db.Column(db.DateTime, nullable=True)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_by = db.Column(db.String(100), nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    restored_at = db.Column(db.DateTime, nullable=True)
+
+class ArchivedRow(db.Model):
+    """A row moved out of a hot table, kept as a JSON document of its column values"""
+    __tablename__ = 'archived_rows'
+    __table_args__ = (
+        db.UniqueConstraint('source_table', 'project_site', 'row_id', name='uq_archived_rows_source'),
+        db.Index('ix_archived_rows_batch', 'batch_id', 'source_table'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('archive_batches.id'), nullable=False)
+    source_table = db.Column(db.String(50), nullable=False)
+    # '' instead of NULL so the unique constraint covers rows without a site (as in daily_spend)
+    project_site = db.Column(db.String(100), nullable=False, default='')
+    row_id = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.Text, nullable=False)
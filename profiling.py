@@ -0,0 +1,82 @@
+"""Jinja bytecode cache shared by workers, and per-template render timing"""
+import os
+import threading
+import time
+from flask import g, has_request_context, before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache
+
+class TemplateProfiler:
+    """Caches compiled templates on disk and times every render_template() call
+
+    Compiled bytecode is written to JINJA_BYTECODE_CACHE_DIR, so a template is compiled once per
+    deploy instead of once per worker and restart (entries are keyed on the template source, so
+    edited templates are recompiled). Render times are summed per template in each process,
+    reported in a Server-Timing header and listed by /api/template_stats.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._stats = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # '' disables the bytecode cache
+        app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', os.environ.get(
+            'JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache')
+        ))
+        app.config.setdefault('TEMPLATE_TIMING_ENABLED', os.environ.get('TEMPLATE_TIMING_ENABLED', '1') != '0')
+        # Renders slower than this (ms) are logged as warnings; 0 turns the log off
+        app.config.setdefault('TEMPLATE_SLOW_MS', float(os.environ.get('TEMPLATE_SLOW_MS', 0)))
+        self.app = app
+
+        directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+        if app.config['TEMPLATE_TIMING_ENABLED']:
+            before_render_template.connect(self._started, app)
+            template_rendered.connect(self._rendered, app)
+            app.after_request(self.after_request)
+
+    def _started(self, sender, template, context, **extra):
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def _rendered(self, sender, template, context, **extra):
+        starts = g.get('template_starts')
+        if not starts:
+            return
+        ms = (time.perf_counter() - starts.pop()) * 1000
+        name = template.name or '<string>'
+        with self._lock:
+            stats = self._stats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += ms
+            stats[2] = max(stats[2], ms)
+        if has_request_context():
+            g.setdefault('template_timings', []).append((name, ms))
+        slow = self.app.config['TEMPLATE_SLOW_MS']
+        if slow and ms >= slow:
+            self.app.logger.warning(f'Slow template render: {name} took {ms:.1f} ms')
+
+    def after_request(self, response):
+        timings = g.pop('template_timings', None)
+        if timings:
+            response.headers.add('Server-Timing', ', '.join(
+                f'tpl{i};desc="{name}";dur={ms:.1f}' for i, (name, ms) in enumerate(timings)
+            ))
+        return response
+
+    def stats(self):
+        """Renders, total/average/max ms per template in this process, slowest total first"""
+        with self._lock:
+            items = [(name, list(values)) for name, values in self._stats.items()]
+        return sorted((
+            {'template': name, 'renders': count, 'total_ms': round(total, 1),
+             'avg_ms': round(total / count, 2), 'max_ms': round(worst, 1)}
+            for name, (count, total, worst) in items
+        ), key=lambda row: row['total_ms'], reverse=True)
+
+template_profiler = TemplateProfiler()
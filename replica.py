@@ -0,0 +1,74 @@
+"""Route read-only report views to an optional read replica, with read-your-writes stickiness"""
+import os
+import time
+from functools import wraps
+from flask import g, request, session, has_request_context
+from sqlalchemy import event
+from database import db, RoutingSession, REPLICA_BIND
+
+def replica_url_from_env():
+    """REPLICA_DATABASE_URL normalized like DATABASE_URL (postgres:// -> postgresql://)"""
+    url = os.environ.get('REPLICA_DATABASE_URL')
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+class ReplicaRouter:
+    """Decides per request whether RoutingSession may read from the replica bind
+
+    Views decorated with use_replica read from the replica for GET requests, except for
+    REPLICA_STICKY_SECONDS after the same browser session wrote something, so users always
+    see their own changes despite replication lag.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Seconds after a write during which the writer's reads stay on the primary
+        app.config.setdefault('REPLICA_STICKY_SECONDS', float(os.environ.get('REPLICA_STICKY_SECONDS', 5)))
+        app.after_request(self.after_request)
+        event.listen(RoutingSession, 'after_flush', self._mark_write)
+        event.listen(RoutingSession, 'do_orm_execute', self._mark_dml)
+        self.app = app
+
+    @property
+    def enabled(self):
+        return REPLICA_BIND in self.app.config.get('SQLALCHEMY_BINDS', {})
+
+    def should_use_replica(self):
+        """True when the current request may read from the replica"""
+        if not self.enabled or request.method not in ('GET', 'HEAD'):
+            return False
+        last_write = session.get('last_write_at')
+        return not last_write or time.time() - last_write > self.app.config['REPLICA_STICKY_SECONDS']
+
+    def after_request(self, response):
+        if g.get('db_write'):
+            session['last_write_at'] = time.time()
+        return response
+
+    def _mark_write(self, db_session, flush_context):
+        self._record_write()
+
+    def _mark_dml(self, orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            self._record_write()
+
+    def _record_write(self):
+        if has_request_context():
+            g.db_write = True
+            # Later reads in the same request must see the write too
+            g.use_replica = False
+
+replica_router = ReplicaRouter()
+
+def use_replica(f):
+    """Decorator for read-only views: run their queries against the read replica when configured"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_replica = replica_router.should_use_replica()
+        return f(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,147 @@
+"""Incrementally maintained rollup tables used by the reporting endpoints"""
+from datetime import date, datetime
+from database import db
+from models import Item, Actual, DailySpend, SpendTotal, to_decimal
+
+def to_date(value):
+    """date() on SQLite returns text; normalize grouped day values to datetime.date"""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+def upsert(model, key, increments=None, values=None):
+    """Insert a rollup row, or add increments to / overwrite values of the existing one, in a single statement"""
+    increments = increments or {}
+    values = values or {}
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is None:
+        # Portable fallback: read-modify-write inside the caller's transaction
+        row = model.query.filter_by(**key).with_for_update().first()
+        if row is None:
+            db.session.add(model(**key, **increments, **values))
+        else:
+            for column, value in increments.items():
+                setattr(row, column, getattr(row, column) + value)
+            for column, value in values.items():
+                setattr(row, column, value)
+        return
+
+    stmt = insert(model).values(**key, **increments, **values)
+    set_ = {column: getattr(model, column) + stmt.excluded[column] for column in increments}
+    set_.update({column: stmt.excluded[column] for column in values})
+    stmt = stmt.on_conflict_do_update(index_elements=list(key), set_=set_)
+    db.session.execute(stmt)
+
+def daily_spend_key(actual, item):
+    """Rollup key for an actual (grp defaults to Materials, as in the actuals tab)"""
+    return {
+        'project_site': actual.project_site or '',
+        'grp': item.grp or 'Materials',
+        'building_type': item.building_type or '',
+        'day': actual.actual_date or (actual.created_at or datetime.utcnow()).date(),
+    }
+
+def record_daily_spend(actual, item):
+    """Add a newly created Actual to the daily spend rollup (same transaction as the insert)"""
+    upsert(DailySpend, daily_spend_key(actual, item), {
+        'actual_qty': to_decimal(actual.actual_qty),
+        'actual_cost': to_decimal(actual.actual_cost),
+        'entries': 1,
+    })
+
+def rebuild_daily_spend():
+    """Recompute the daily spend rollup from the actuals table"""
+    day = db.func.coalesce(Actual.actual_date, db.func.date(Actual.created_at))
+    rows = db.session.execute(
+        db.select(
+            db.func.coalesce(Actual.project_site, ''),
+            db.func.coalesce(Item.grp, 'Materials'),
+            db.func.coalesce(Item.building_type, ''),
+            day,
+            db.func.sum(Actual.actual_qty),
+            db.func.sum(Actual.actual_cost),
+            db.func.count(Actual.id)
+        ).join(Item, Item.id == Actual.item_id).group_by(
+            Actual.project_site, Item.grp, Item.building_type, day
+        )
+    ).all()
+
+    DailySpend.query.delete()
+    # NULL and '' keys collapse into the same rollup row, so merge before inserting
+    merged = {}
+    for project_site, grp, building_type, row_day, qty, cost, entries in rows:
+        key = (project_site, grp, building_type, to_date(row_day))
+        totals = merged.setdefault(key, [0, 0, 0])
+        totals[0] += to_decimal(qty)
+        totals[1] += to_decimal(cost)
+        totals[2] += entries
+    db.session.add_all([
+        DailySpend(project_site=project_site, grp=grp, building_type=building_type, day=row_day,
+                   actual_qty=qty, actual_cost=cost, entries=entries)
+        for (project_site, grp, building_type, row_day), (qty, cost, entries) in merged.items()
+    ])
+    db.session.commit()
+
+def budget_key(budget):
+    """Main budget of an item ("Budget 1 - Flats(Woods)" -> "Budget 1 - Flats"), as in the actuals tab"""
+    return (budget or '').split('(')[0].strip()
+
+def spend_total_keys(item, project_site=None):
+    """(project site, scope, scope key) of the item, budget and group totals an item counts towards"""
+    site = (project_site if project_site is not None else item.project_site) or ''
+    return [(site, 'item', str(item.id)), (site, 'budget', budget_key(item.budget)), (site, 'grp', item.grp or 'Materials')]
+
+def add_spend_totals(increments):
+    """Add {(project site, scope, scope key): {column: increment}} to the spend totals and return the updated rows"""
+    for (site, scope, scope_key), values in increments.items():
+        upsert(SpendTotal, {'project_site': site, 'scope': scope, 'scope_key': scope_key}, values)
+    if not increments:
+        return {}
+    rows = db.session.execute(
+        db.select(SpendTotal).where(
+            db.tuple_(SpendTotal.project_site, SpendTotal.scope, SpendTotal.scope_key).in_(list(increments))
+        ).execution_options(populate_existing=True)
+    ).scalars()
+    return {(row.project_site, row.scope, row.scope_key): row for row in rows}
+
+def rebuild_spend_totals(project_site=None):
+    """Recompute the spend totals of one project site (or every site) from the items and actuals tables"""
+    item_where = [db.func.coalesce(Item.project_site, '') == project_site] if project_site is not None else []
+    totals = {}
+    for site, budget, grp, planned in db.session.execute(
+        db.select(
+            db.func.coalesce(Item.project_site, ''), Item.budget, Item.grp, db.func.sum(Item.amount)
+        ).where(*item_where).group_by(Item.project_site, Item.budget, Item.grp)
+    ):
+        for key in ((site, 'budget', budget_key(budget)), (site, 'grp', grp or 'Materials')):
+            totals.setdefault(key, [0, 0, 0])[0] += to_decimal(planned)
+
+    actual_where = [db.func.coalesce(Actual.project_site, '') == project_site] if project_site is not None else []
+    for site, item_id, budget, grp, cost, qty in db.session.execute(
+        db.select(
+            db.func.coalesce(Actual.project_site, ''), Item.id, Item.budget, Item.grp,
+            db.func.sum(Actual.actual_cost), db.func.sum(Actual.actual_qty)
+        ).join(Item, Item.id == Actual.item_id).where(*actual_where).group_by(Actual.project_site, Item.id)
+    ):
+        for key in ((site, 'item', str(item_id)), (site, 'budget', budget_key(budget)), (site, 'grp', grp or 'Materials')):
+            entry = totals.setdefault(key, [0, 0, 0])
+            entry[1] += to_decimal(cost)
+            entry[2] += to_decimal(qty)
+
+    delete = db.delete(SpendTotal)
+    if project_site is not None:
+        delete = delete.where(SpendTotal.project_site == project_site)
+    db.session.execute(delete)
+    db.session.add_all([
+        SpendTotal(project_site=site, scope=scope, scope_key=scope_key, planned=planned,
+                   actual_cost=actual_cost, actual_qty=actual_qty)
+        for (site, scope, scope_key), (planned, actual_cost, actual_qty) in totals.items()
+    ])
+    db.session.commit()
@@ -2,18 +2,33 @@
 from flask import render_template, request, redirect, url_for, session, jsonify, send_file, flash
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime, timedelta
+from decimal import Decimal
 import csv
 import io
+import time
 from functools import wraps
 from database import db
 from models import (
     Item, Request, Notification, Actual, ProjectSite,
-    AccessCode, AccessLog, BuildingTypeConfig
+    AccessCode, AccessLog, BuildingTypeConfig, DailySpend, ItemBalance, AlertRule, to_decimal, CENTS,
+    StockMovement, StockSnapshot
 )
+from rollups import record_daily_spend, rebuild_spend_totals, to_date
+from stock import record_movement, record_request_issue, MOVEMENT_KINDS
+from alerts import (
+    ALERT_SCOPES, record_actual_spend, record_planned_changes, record_item_planned_change,
+    record_bulk_planned_change, check_request
+)
+from access_log import access_log_writer
+from cache import cache
+from replica import use_replica
+from shard import shards, SHARD_SITES_CACHE_KEY
+from summaries import summaries
+from changes import change_feed
 from utils import (
     generate_budget_options, normalize_budget, match_budget_filter,
     format_currency, calculate_line_amount, determine_group_from_category_and_budget,
-    extract_budget_parts, PROPERTY_TYPES
+    extract_budget_parts, extract_budget_number, PROPERTY_TYPES
 )
 
 CONSTRUCTION_SECTIONS = [
@@ -81,6 +96,65 @@ def filter_by_project_site(query):
     # Global admin with no site selected = see all sites (return unfiltered query)
     return query
 
+def project_site_clause(column):
+    """filter_by_project_site() as a column condition, for statements spanning several tables"""
+    if not session.get('is_global_admin'):
+        # Project site admins: assigned site only (None matches nothing, as above)
+        return column == get_assigned_project_site()
+    project_site = session.get('project_site')
+    if project_site:
+        return column == project_site
+    return db.true()
+
+def sharded_all_sites():
+    """Whether a global admin is on "All Sites" while each site's rows live in its own shard"""
+    return shards.enabled and session.get('is_global_admin') and not session.get('project_site')
+
+def require_site_when_sharded(f):
+    """Decorator for pages reading sharded tables: with sharding on, "All Sites" would only show the main database"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if sharded_all_sites():
+            flash('Select a project site: with sharding on, each site\'s data is kept in its own shard.', 'warning')
+            return redirect(url_for('admin_settings'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def budget_filter_clause(budget_filter, column=Item.budget, project_site=None):
+    """SQL equivalent of match_budget_filter() so budget filters can use an index
+
+    Matches among the budgets of project_site (default: the session's sites), read from the current shard.
+    """
+    # The site's distinct budgets are few: match them with match_budget_filter() itself (case and
+    # spaces ignored) and look the matches up by equality, instead of normalizing every row in SQL
+    site_column = column.class_.project_site
+    site_clause = site_column == project_site if project_site else project_site_clause(site_column)
+    budgets = db.session.execute(db.select(column).where(site_clause).distinct()).scalars()
+    return column.in_([budget for budget in budgets if budget and match_budget_filter(budget, budget_filter)])
+
+# Rows per lazily loaded page of the Manual Entry Budget View
+BUDGET_VIEW_PAGE_SIZE = 50
+
+def budget_view_query(budget_filter, section_filter):
+    """Items shown in the Manual Entry Budget View for the given filters"""
+    query = filter_by_project_site(Item.query)
+    if budget_filter and budget_filter != 'All':
+        query = query.filter(budget_filter_clause(budget_filter))
+    if section_filter:
+        query = query.filter(Item.section == section_filter)
+    return query
+
+def budget_view_page(query, cursor=None):
+    """One page of Budget View items, newest first, and the cursor for the next page"""
+    if cursor:
+        query = query.filter(Item.id < cursor)
+    # id follows insertion order, so this is the created_at order without an offset scan
+    items = query.order_by(Item.id.desc()).limit(BUDGET_VIEW_PAGE_SIZE + 1).all()
+    if len(items) > BUDGET_VIEW_PAGE_SIZE:
+        items = items[:BUDGET_VIEW_PAGE_SIZE]
+        return items, items[-1].id
+    return items, None
+
 def can_edit():
     """Check if user can edit items"""
     return is_admin()
@@ -142,7 +216,10 @@ def manual_entry():
                     project_site=get_user_project_site()
                 )
                 db.session.add(item)
+                db.session.flush()
+                record_item_planned_change(item, 0, item.amount)
                 db.session.commit()
+                summaries.mark_dirty(item.project_site or '')
                 
                 flash(f'Item "{name}" added successfully! This item will now appear in the Budget Summary tab.', 'success')
                 
@@ -155,57 +232,184 @@ def manual_entry():
     budget_filter = request.args.get('budget_filter', 'All')
     section_filter = request.args.get('section_filter', '')
     
-    # Query items - filter by project site if one is selected
-    query = filter_by_project_site(Item.query)
-    
-    if budget_filter and budget_filter != 'All':
-        # Filter by budget (hierarchical matching)
-        all_items = query.all()
-        filtered_items = [item for item in all_items if match_budget_filter(item.budget, budget_filter)]
-        query = query.filter(Item.id.in_([item.id for item in filtered_items]))
-    
-    if section_filter:
-        query = query.filter_by(section=section_filter)
+    query = budget_view_query(budget_filter, section_filter)
     
-    items = query.order_by(Item.created_at.desc()).all()
+    # Only the first page is rendered; the rest is fetched from manual_entry_items on scroll
+    items, next_cursor = budget_view_page(query)
     
-    # Calculate totals
-    total_amount = sum(item.amount for item in items)
+    # Totals cover every matching item, not just the loaded page
+    total_count, total_amount = query.with_entities(
+        db.func.count(Item.id),
+        db.func.coalesce(db.func.sum(Item.amount), 0)
+    ).one()
     
     # Get unique sections for filter - filtered by project site
     sections_query = filter_by_project_site(Item.query) if get_user_project_site() else Item.query
     unique_sections = sorted(set([item.section for item in sections_query.distinct(Item.section).all() if item.section] + CONSTRUCTION_SECTIONS))
     
+    # Budgets that can be cloned: whole budgets ("Budget 2 - Terraces") and their subgroup budgets
+    clone_budgets = sorted(
+        set(existing_budgets) | {budget.split('(')[0].strip() for budget in existing_budgets},
+        key=lambda budget: (extract_budget_number(budget), budget)
+    )
+    
     return render_template('manual_entry.html',
                          building_type=building_type,
+                         clone_budgets=clone_budgets,
                          selected_section=selected_section,
                          selected_budget=selected_budget,
                          all_budgets=all_budgets,
                          budget_filter=budget_filter,
                          section_filter=section_filter,
                          items=items,
+                         next_cursor=next_cursor,
+                         total_count=total_count,
                          total_amount=total_amount,
                          unique_sections=unique_sections,
                          construction_sections=CONSTRUCTION_SECTIONS,
                          property_types=PROPERTY_TYPES,
                          can_edit=can_edit())
 
+def manual_entry_items():
+    """Next page of Budget View rows for the Manual Entry table (lazy loading)"""
+    query = budget_view_query(request.args.get('budget_filter', 'All'), request.args.get('section_filter', ''))
+    items, next_cursor = budget_view_page(query, request.args.get('cursor', type=int))
+    return jsonify({
+        'html': render_template('manual_entry_rows.html', items=items),
+        'next_cursor': next_cursor
+    })
+
+# Route: Clone items into another budget, building type or project site
+def clone_item_columns(source_budget, target_budget, source_type, target_type, target_site):
+    """Column values (name -> SQL expression over the source item) of the cloned items"""
+    budget, grp, building_type = Item.budget, Item.grp, Item.building_type
+    if target_budget:
+        if source_budget == 'All':
+            raise ValueError('Choose the budget to clone from')
+        if '(' in source_budget:
+            if '(' not in target_budget:
+                # "Budget 2 - Flats(Woods)" -> "Budget 3 - Flats" keeps the subgroup
+                target_budget += source_budget[source_budget.index('('):]
+            budget = db.literal(target_budget)
+            _, source_subgroup = extract_budget_parts(source_budget)
+            _, target_subgroup = extract_budget_parts(target_budget)
+            if target_subgroup != source_subgroup:
+                grp = db.literal(determine_group_from_category_and_budget(None, target_budget))
+        elif '(' in target_budget:
+            raise ValueError('A whole budget can only be cloned into another whole budget')
+        else:
+            # "Budget 2 - Terraces(X)" -> "Budget 3 - Terraces(X)" for every subgroup X
+            budget = db.literal(target_budget) + db.func.substr(Item.budget, len(source_budget) + 1)
+        parsed_type, _ = extract_budget_parts(target_budget if '(' in target_budget else target_budget + '()')
+        if parsed_type:
+            building_type = db.literal(parsed_type)
+    elif target_type:
+        if source_type == 'All':
+            raise ValueError('Choose the building type to clone from')
+        budget = db.func.replace(Item.budget, f' - {source_type}(', f' - {target_type}(')
+        building_type = db.literal(target_type)
+    
+    return {
+        'code': Item.code,
+        'name': Item.name,
+        'category': Item.category,
+        'unit': Item.unit,
+        'qty': Item.qty,
+        'unit_cost': Item.unit_cost,
+        'budget': budget,
+        'section': Item.section,
+        'grp': grp,
+        'building_type': building_type,
+        'project_site': db.literal(target_site),
+        'created_at': db.literal(datetime.utcnow(), db.DateTime),
+    }
+
+def clone_items():
+    """Copy every item of a budget, building type or whole site into another budget or site"""
+    if not can_edit():
+        flash('Permission denied', 'error')
+        return redirect(url_for('manual_entry'))
+    
+    if session.get('is_global_admin'):
+        source_site = request.form.get('source_site', '').strip() or get_user_project_site()
+        target_site = request.form.get('target_site', '').strip() or source_site
+    else:
+        # Project site admins clone within their own site only
+        source_site = target_site = get_assigned_project_site()
+    source_budget = request.form.get('source_budget', 'All').strip() or 'All'
+    target_budget = request.form.get('target_budget', '').strip()
+    source_type = request.form.get('source_building_type', 'All').strip() or 'All'
+    target_type = request.form.get('target_building_type', '').strip()
+    
+    if not source_site:
+        flash('Select the project site to clone from', 'error')
+        return redirect(url_for('manual_entry'))
+    known_sites = set(db.session.execute(
+        db.select(ProjectSite.name).where(ProjectSite.name.in_({source_site, target_site}))
+    ).scalars())
+    if {source_site, target_site} - known_sites:
+        flash('Unknown project site', 'error')
+        return redirect(url_for('manual_entry'))
+    if source_site == target_site and not target_budget and not target_type:
+        flash('Choose a target budget, building type or project site to clone into', 'error')
+        return redirect(url_for('manual_entry'))
+    try:
+        columns = clone_item_columns(source_budget, target_budget, source_type, target_type, target_site)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('manual_entry'))
+    
+    where = [Item.project_site == source_site]
+    if source_budget != 'All':
+        with shards.use_site(source_site):
+            where.append(budget_filter_clause(source_budget, project_site=source_site))
+    if source_type != 'All':
+        where.append(Item.building_type == source_type)
+    source = db.select(*[expression.label(name) for name, expression in columns.items()]).where(*where)
+    
+    started = time.perf_counter()
+    if shards.enabled and source_site != target_site:
+        # Different shards are different databases: read the lines, then insert them in one executemany
+        with shards.use_site(source_site):
+            rows = [dict(row) for row in db.session.execute(source).mappings()]
+        with shards.use_site(target_site):
+            if rows:
+                last_id = db.session.execute(db.select(db.func.max(Item.id))).scalar() or 0
+                db.session.execute(db.insert(Item), rows)
+                change_feed.record(Item, 'insert', [Item.id > last_id, Item.project_site == target_site])
+                record_planned_changes([
+                    (row['project_site'], row['budget'], row['grp'], to_decimal(row['qty']) * to_decimal(row['unit_cost']))
+                    for row in rows
+                ])
+            db.session.commit()
+        cloned = len(rows)
+    else:
+        # One INSERT ... SELECT: the lines never leave the database
+        cloned_rows = source.subquery()
+        with shards.use_site(source_site):
+            # Planned totals of the copies' budgets and groups, grouped in the database as well
+            planned = db.session.execute(db.select(
+                cloned_rows.c.project_site, cloned_rows.c.budget, cloned_rows.c.grp,
+                db.func.sum(cloned_rows.c.qty * db.func.coalesce(cloned_rows.c.unit_cost, db.literal_column('0')))
+            ).group_by(cloned_rows.c.project_site, cloned_rows.c.budget, cloned_rows.c.grp)).all()
+            last_id = db.session.execute(db.select(db.func.max(Item.id))).scalar() or 0
+            result = db.session.execute(db.insert(Item).from_select(list(columns), source))
+            change_feed.record(Item, 'insert', [Item.id > last_id, Item.project_site == target_site])
+            record_planned_changes(planned)
+            db.session.commit()
+        cloned = result.rowcount
+    cache.delete(SITE_OVERVIEW_CACHE_KEY)
+    summaries.mark_dirty(target_site or '')
+    
+    flash(f'Cloned {cloned} items in {(time.perf_counter() - started) * 1000:.0f} ms.', 'success' if cloned else 'warning')
+    return redirect(url_for('manual_entry'))
+
 def download_budget_view():
     """Download budget view as CSV"""
     budget_filter = request.args.get('budget_filter', 'All')
     section_filter = request.args.get('section_filter', '')
     
-    query = filter_by_project_site(Item.query)
-    
-    if budget_filter and budget_filter != 'All':
-        all_items = query.all()
-        filtered_items = [item for item in all_items if match_budget_filter(item.budget, budget_filter)]
-        query = query.filter(Item.id.in_([item.id for item in filtered_items]))
-    
-    if section_filter:
-        query = query.filter_by(section=section_filter)
-    
-    items = query.all()
+    items = budget_view_query(budget_filter, section_filter).all()
     
     output = io.StringIO()
     writer = csv.writer(output)
@@ -232,12 +436,26 @@ def download_budget_view():
         download_name='budget_view.csv'
     )
 
+# Inventory sort options (backed by the project_site + amount/unit_cost indexes)
+INVENTORY_SORTS = {
+    'newest': (Item.created_at.desc(),),
+    'amount_desc': (Item.amount.desc(), Item.id.desc()),
+    'amount_asc': (Item.amount.asc(), Item.id.asc()),
+    'unit_cost_desc': (Item.unit_cost.desc(), Item.id.desc()),
+    'unit_cost_asc': (Item.unit_cost.asc(), Item.id.asc()),
+}
+
 # Route: Inventory
+@use_replica
+@require_site_when_sharded
 def inventory():
     """Inventory tab"""
     budget_filter = request.args.get('budget_filter', 'All')
     section_filter = request.args.get('section_filter', 'All')
     building_type_filter = request.args.get('building_type_filter', 'All')
+    sort = request.args.get('sort', 'newest')
+    if sort not in INVENTORY_SORTS:
+        sort = 'newest'
     page = int(request.args.get('page', 1))
     per_page = 50
     
@@ -252,13 +470,7 @@ def inventory():
     
     # Budget filter (hierarchical matching)
     if budget_filter and budget_filter != 'All':
-        all_items = query.all()
-        filtered_items = [item for item in all_items if match_budget_filter(item.budget, budget_filter)]
-        if filtered_items:
-            query = query.filter(Item.id.in_([item.id for item in filtered_items]))
-        else:
-            # No items match, return empty query
-            query = query.filter(Item.id.in_([]))
+        query = query.filter(budget_filter_clause(budget_filter))
     
     # Section filter
     if section_filter and section_filter != 'All':
@@ -269,21 +481,24 @@ def inventory():
         query = query.filter_by(building_type=building_type_filter)
     
     total_items = query.count()
-    items = query.order_by(Item.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    items = query.order_by(*INVENTORY_SORTS[sort]).paginate(page=page, per_page=per_page, error_out=False)
     
     # Statistics - use the base query (before applying filters)
-    all_items_list = base_query.all()
-    
-    total_value = sum(item.amount for item in all_items_list)
-    materials_count = len([i for i in all_items_list if i.category == 'materials'])
-    labour_count = len([i for i in all_items_list if i.category == 'labour'])
+    total_value, materials_count, labour_count = base_query.with_entities(
+        db.func.coalesce(db.func.sum(Item.amount), 0),
+        db.func.count(db.case((Item.category == 'materials', 1))),
+        db.func.count(db.case((Item.category == 'labour', 1)))
+    ).one()
     
     # Get unique values for filters - filtered by project site
     sections_query = filter_by_project_site(Item.query) if get_user_project_site() else Item.query
-    unique_sections = sorted(set([item.section for item in sections_query.distinct(Item.section).all() if item.section] + CONSTRUCTION_SECTIONS))
+    unique_sections = sorted(set([section for section, in sections_query.with_entities(Item.section).distinct() if section] + CONSTRUCTION_SECTIONS))
     budgets_query = filter_by_project_site(Item.query) if get_user_project_site() else Item.query
-    existing_budgets = [item.budget for item in budgets_query.distinct(Item.budget).all() if item.budget]
+    existing_budgets = [budget for budget, in budgets_query.with_entities(Item.budget).distinct() if budget]
     all_budgets = ['All'] + generate_budget_options(MAX_BUDGET_NUM, None, existing_budgets)
+    unique_groups = sorted(db.session.execute(
+        db.select(Item.grp).where(project_site_clause(Item.project_site), Item.grp.isnot(None)).distinct()
+    ).scalars())
     
     return render_template('inventory.html',
                          items=items,
@@ -295,8 +510,10 @@ def inventory():
                          budget_filter=budget_filter,
                          section_filter=section_filter,
                          building_type_filter=building_type_filter,
+                         sort=sort,
                          unique_sections=unique_sections,
                          all_budgets=all_budgets,
+                         unique_groups=unique_groups,
                          property_types=PROPERTY_TYPES,
                          can_edit=can_edit())
 
@@ -330,7 +547,9 @@ def edit_item(item_id):
             old_amount = item.amount
             item.qty = new_qty
             item.unit_cost = new_unit_cost
+            record_item_planned_change(item, old_amount, item.amount)
             db.session.commit()
+            summaries.mark_dirty(item.project_site or '')
             
             new_amount = item.amount
             change = new_amount - old_amount
@@ -339,9 +558,9 @@ def edit_item(item_id):
             return jsonify({
                 'success': True,
                 'message': f'Item "{item.name}" updated successfully!',
-                'old_amount': old_amount,
-                'new_amount': new_amount,
-                'change': change
+                'old_amount': float(old_amount),
+                'new_amount': float(new_amount),
+                'change': float(change)
             })
         except ValueError:
             return jsonify({'error': 'Invalid values provided'}), 400
@@ -349,6 +568,125 @@ def edit_item(item_id):
     # GET request - redirect to inventory
     return redirect(url_for('inventory'))
 
+# Bulk edit: columns that can be revised, and how the change is applied
+BULK_EDIT_FIELDS = {'unit_cost': Item.unit_cost, 'qty': Item.qty}
+BULK_EDIT_MODES = ('percent', 'absolute')
+
+def bulk_edit_selection(values):
+    """Item conditions for the budget/section/building type/group selection of a bulk edit"""
+    where = []
+    budget_filter = values.get('budget_filter', 'All').strip()
+    if budget_filter and budget_filter != 'All':
+        where.append(budget_filter_clause(budget_filter))
+    for arg, column in (('section_filter', Item.section), ('building_type_filter', Item.building_type),
+                        ('grp_filter', Item.grp)):
+        value = values.get(arg, 'All').strip()
+        if value and value != 'All':
+            where.append(column == value)
+    return where
+
+def bulk_edit_items():
+    """Change unit cost or quantity of every selected item in one UPDATE (AJAX endpoint)"""
+    if not can_edit():
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    selection = bulk_edit_selection(request.form)
+    if not selection:
+        return jsonify({'error': 'Select a budget, section, building type or group to edit'}), 400
+    field = request.form.get('field')
+    mode = request.form.get('mode')
+    if field not in BULK_EDIT_FIELDS or mode not in BULK_EDIT_MODES:
+        return jsonify({'error': 'Invalid field or change type'}), 400
+    try:
+        change = Decimal(request.form.get('value', ''))
+    except ArithmeticError:
+        return jsonify({'error': 'Invalid change value'}), 400
+    if not change.is_finite():
+        return jsonify({'error': 'Invalid change value'}), 400
+    
+    where = [project_site_clause(Item.project_site)] + selection
+    column = BULK_EDIT_FIELDS[field]
+    current = db.func.coalesce(column, db.literal_column('0'))
+    if mode == 'percent':
+        revised = current * (1 + change / 100)
+    else:
+        revised = current + change
+    # Rounded to cents and never negative
+    revised = db.func.round(revised, 2)
+    revised = db.case((revised < 0, 0), else_=revised)
+    
+    other = Item.qty if field == 'unit_cost' else db.func.coalesce(Item.unit_cost, db.literal_column('0'))
+    count, old_amount, new_amount = db.session.execute(
+        db.select(
+            db.func.count(Item.id),
+            db.func.coalesce(db.func.sum(Item.amount), 0),
+            db.func.coalesce(db.func.sum(revised * other), 0)
+        ).where(*where)
+    ).one()
+    old_amount = to_decimal(old_amount).quantize(CENTS)
+    new_amount = to_decimal(new_amount).quantize(CENTS)
+    preview = {
+        'count': count,
+        'old_amount': float(old_amount),
+        'new_amount': float(new_amount),
+        'change': float(new_amount - old_amount),
+    }
+    if request.form.get('preview'):
+        return jsonify(dict(preview, preview=True))
+    
+    # Budget and group planned totals (and the alerts a lower plan triggers) before the amounts change
+    record_bulk_planned_change(where, revised * other)
+    result = db.session.execute(
+        db.update(Item).where(*where).values({column: revised}).execution_options(synchronize_session=False)
+    )
+    expected = request.form.get('expected_count', type=int)
+    if expected is not None and result.rowcount != expected:
+        # Items were added or removed since the preview: change nothing, ask for a new preview
+        db.session.rollback()
+        return jsonify({'error': f'The selection now has {result.rowcount} items instead of {expected}. '
+                                 'Preview again before applying.'}), 409
+    change_feed.record(Item, 'update', where, [column])
+    db.session.commit()
+    # Unit cost and quantity only feed the planned value (actuals and the daily spend rollup are unchanged)
+    cache.delete(SITE_OVERVIEW_CACHE_KEY)
+    summaries.mark_dirty(summary_site())
+    
+    return jsonify(dict(preview, success=True,
+                        message=f'Updated {field.replace("_", " ")} of {result.rowcount} items.'))
+
+def record_stock_movement():
+    """Record a stock receipt or adjustment for an item (AJAX endpoint)"""
+    if not can_edit():
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    item = db.session.execute(
+        db.select(Item).where(Item.id == request.form.get('item_id', type=int), project_site_clause(Item.project_site))
+    ).scalar()
+    if not item:
+        return jsonify({'error': 'Item not found'}), 404
+    kind = request.form.get('kind')
+    if kind not in MOVEMENT_KINDS or kind == 'issue':
+        # Issues are recorded automatically when requests are approved
+        return jsonify({'error': 'Invalid movement type: expected receipt or adjustment'}), 400
+    try:
+        qty = Decimal(request.form.get('qty', ''))
+        if not qty.is_finite():
+            raise ArithmeticError
+        movement = record_movement(item, kind, qty, note=request.form.get('note', '').strip() or None,
+                                   recorded_by=session.get('user_name', 'Unknown'))
+    except ArithmeticError:
+        return jsonify({'error': 'Invalid quantity'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    
+    balance = db.session.execute(db.select(ItemBalance.on_hand).where(ItemBalance.item_id == item.id)).scalar()
+    return jsonify({
+        'success': True,
+        'message': f'Recorded {kind} of {movement.qty} for "{item.name}".',
+        'on_hand': float(balance)
+    })
+
 def delete_item(item_id):
     """Delete item (supports both GET redirects and POST AJAX)"""
     # Always return JSON for POST requests to avoid HTML error pages
@@ -370,6 +708,7 @@ def delete_item(item_id):
             return redirect(url_for('inventory'))
         
         item_name = item.name
+        item_site = item.project_site
         
         # Security check: Ensure item belongs to current project site
         # For project site admins, use assigned_project_site (strict check)
@@ -389,8 +728,18 @@ def delete_item(item_id):
                 flash('Permission denied: Item belongs to different project site', 'error')
                 return redirect(url_for('inventory'))
         
+        # The stock ledger is append-only: an item with receipts, issues or adjustments stays
+        if db.session.execute(db.select(StockMovement.id).where(StockMovement.item_id == item.id).limit(1)).first():
+            message = f'Item "{item_name}" has stock history (receipts, issues or adjustments) and cannot be deleted'
+            if is_post:
+                return jsonify({'error': message}), 409
+            flash(message, 'error')
+            return redirect(url_for('inventory'))
+        
+        record_planned_changes([(item.project_site, item.budget, item.grp, -item.amount)])
         db.session.delete(item)
         db.session.commit()
+        summaries.mark_dirty(item_site or '')
         
         if is_post:
             return jsonify({'success': True, 'message': f'Item "{item_name}" deleted successfully!'})
@@ -404,6 +753,23 @@ def delete_item(item_id):
         flash(f'Error deleting item: {str(e)}', 'error')
         return redirect(url_for('inventory'))
 
+def delete_stock_history(project_site):
+    """Stock ledger, balances and snapshots of the items delete_all_inventory() removes (project_site None = every site)"""
+    item_ids = db.select(Item.id).where(*([Item.project_site == project_site] if project_site else []))
+    for model in (StockSnapshot, ItemBalance, StockMovement):
+        db.session.execute(db.delete(model).where(model.item_id.in_(item_ids)).execution_options(synchronize_session=False))
+
+def record_inventory_deletes(project_site, clear_requests):
+    """Change feed deletes for delete_all_inventory() (project_site None = every site)"""
+    change_feed.record(Item, 'delete', [Item.project_site == project_site] if project_site else [])
+    if clear_requests:
+        request_where = [Request.project_site == project_site] if project_site else []
+        # Their notifications go with them (ON DELETE CASCADE)
+        change_feed.record(Notification, 'delete', [
+            Notification.request_id.in_(db.select(Request.id).where(*request_where))
+        ])
+        change_feed.record(Request, 'delete', request_where)
+
 def delete_all_inventory():
     """Delete all inventory and optionally requests"""
     if not can_edit():
@@ -417,6 +783,8 @@ def delete_all_inventory():
         if not session.get('is_global_admin'):
             assigned_site = get_assigned_project_site()
             if assigned_site:
+                record_inventory_deletes(assigned_site, clear_requests)
+                delete_stock_history(assigned_site)
                 Item.query.filter_by(project_site=assigned_site).delete()
                 if clear_requests:
                     Request.query.filter_by(project_site=assigned_site).delete()
@@ -427,26 +795,87 @@ def delete_all_inventory():
             # Global admins: delete based on selected project site (if any)
             project_site = get_user_project_site()
             if project_site:
+                record_inventory_deletes(project_site, clear_requests)
+                delete_stock_history(project_site)
                 Item.query.filter_by(project_site=project_site).delete()
                 if clear_requests:
                     Request.query.filter_by(project_site=project_site).delete()
             else:
                 # If no project site selected and user is global admin, delete all
+                record_inventory_deletes(None, clear_requests)
+                delete_stock_history(None)
                 Item.query.delete()
                 if clear_requests:
                     Request.query.delete()
         db.session.commit()
+        # Recompute the spend totals of what was deleted (every site when none is selected)
+        rebuild_spend_totals(get_user_project_site())
+        summaries.mark_dirty(summary_site())
         
         flash('All inventory items deleted successfully!', 'success')
     
     return redirect(url_for('inventory'))
 
 # Route: Make Request
+# Typeahead results returned by item_search
+ITEM_SEARCH_DEFAULT_LIMIT = 10
+ITEM_SEARCH_MAX_LIMIT = 25
+
+def prefix_range_clause(expression, prefix):
+    """expression starts with prefix, as a range an index on expression can serve"""
+    # LIKE 'abc%' cannot use an expression index on SQLite; >= 'abc' AND < 'abd' can
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return db.and_(expression >= prefix, expression < upper, expression.startswith(prefix, autoescape=True))
+
+def serialize_search_item(item):
+    """Fields the make_request form needs for a selected item"""
+    return {
+        'id': item.id,
+        'name': item.name,
+        'code': item.code,
+        'unit': item.unit,
+        'qty': float(item.qty or 0),
+        'unit_cost': float(item.unit_cost or 0),
+        'category': item.category,
+        'budget': item.budget,
+        'building_type': item.building_type,
+    }
+
+def item_search():
+    """Typeahead search over the site's items by name or code (prefix matches first)"""
+    term = request.args.get('q', '').strip().lower()
+    limit = min(max(request.args.get('limit', ITEM_SEARCH_DEFAULT_LIMIT, type=int), 1), ITEM_SEARCH_MAX_LIMIT)
+    if not term:
+        return jsonify({'items': []})
+    
+    query = filter_by_project_site(Item.query)
+    name_lower = db.func.lower(Item.name)
+    code_lower = db.func.lower(Item.code)
+    
+    items = query.filter(db.or_(
+        prefix_range_clause(name_lower, term),
+        prefix_range_clause(code_lower, term)
+    )).order_by(name_lower, Item.id).limit(limit).all()
+    
+    # Fill up with substring matches; these scan the site's rows, so only for 2+ characters
+    if len(items) < limit and len(term) >= 2:
+        seen = [item.id for item in items]
+        items += query.filter(
+            db.or_(name_lower.contains(term, autoescape=True), code_lower.contains(term, autoescape=True)),
+            Item.id.notin_(seen)
+        ).order_by(name_lower, Item.id).limit(limit - len(items)).all()
+    
+    return jsonify({'items': [serialize_search_item(item) for item in items]})
+
 def make_request():
     """Make Request tab"""
-    # Get items for current project site
+    # Items are searched via item_search; only the selected one is loaded here
     query = filter_by_project_site(Item.query)
-    items = query.order_by(Item.name).all()
+    has_items = db.session.query(query.exists()).scalar()
+    selected_item = None
+    selected_id = request.values.get('item_id', type=int)
+    if selected_id:
+        selected_item = query.filter(Item.id == selected_id).first()
     
     if request.method == 'POST':
         item_id = request.form.get('item_id')
@@ -470,7 +899,7 @@ def make_request():
             flash('Budget is required', 'error')
         else:
             try:
-                item = Item.query.get(int(item_id))
+                item = selected_item
                 if not item:
                     flash('Selected item not found', 'error')
                 else:
@@ -490,6 +919,7 @@ def make_request():
                     )
                     db.session.add(req)
                     db.session.commit()
+                    check_request(req, item)
                     
                     # Create notifications
                     # Note: No notification to requester on submit - they can see it in Review & History tab
@@ -518,12 +948,15 @@ def make_request():
     all_budgets = generate_budget_options(MAX_BUDGET_NUM, None, existing_budgets)
     
     return render_template('make_request.html',
-                         items=items,
+                         has_items=has_items,
+                         selected_item=serialize_search_item(selected_item) if selected_item else None,
                          all_budgets=all_budgets,
                          construction_sections=['materials', 'labour'],
                          property_types=PROPERTY_TYPES)
 
 # Route: Review & History
+@use_replica
+@require_site_when_sharded
 def review_history():
     """Review & History tab"""
     status_filter = request.args.get('status_filter', 'Pending')
@@ -562,8 +995,20 @@ def review_history():
     approved_count = len([r for r in all_requests if r.status == 'Approved'])
     rejected_count = len([r for r in all_requests if r.status == 'Rejected'])
     
+    # Approval queue: pending requests this admin has claimed and not yet decided
+    my_claims = []
+    if is_admin():
+        my_claims = filter_by_project_site(Request.query).filter(
+            Request.status == 'Pending',
+            Request.claimed_by == claim_owner(),
+            Request.claimed_at >= datetime.utcnow() - CLAIM_TIMEOUT
+        ).order_by(Request.created_at, Request.id).all()
+    
     return render_template('review_history.html',
                          requests=requests,
+                         my_claims=my_claims,
+                         claim_batch=APPROVAL_CLAIM_BATCH,
+                         claim_minutes=int(CLAIM_TIMEOUT.total_seconds() // 60),
                          status_filter=status_filter,
                          active_tab=active_tab,
                          approved_requests=approved_requests,
@@ -575,6 +1020,135 @@ def review_history():
                          is_admin=is_admin(),
                          can_delete_own=not is_admin())
 
+def create_actual_for_request(req, approved_by):
+    """Record the Actual for an approved request, add it to the spend rollups and alerts and issue it from stock (caller commits)"""
+    # Check if Actual record already exists for this request (to avoid duplicates)
+    existing_actual = Actual.query.filter_by(item_id=req.item_id).filter_by(notes=f'Request #{req.id}').first()
+    if existing_actual:
+        return None
+    
+    # Calculate actual cost: quantity * current price (or fall back to item unit cost)
+    current_price = to_decimal(req.current_price) if req.current_price else to_decimal(req.item.unit_cost)
+    actual_cost = (to_decimal(req.qty) * current_price).quantize(CENTS)
+    
+    actual = Actual(
+        item_id=req.item_id,
+        actual_qty=req.qty,
+        actual_cost=actual_cost,
+        actual_date=req.created_at.date(),
+        recorded_by=approved_by,
+        notes=f'Request #{req.id}',
+        project_site=req.project_site
+    )
+    db.session.add(actual)
+    record_daily_spend(actual, req.item)
+    record_actual_spend(actual, req.item)
+    if to_decimal(req.qty) > 0:
+        record_request_issue(req, recorded_by=approved_by)
+    return actual
+
+# Approval queue: admins claim pending requests in batches; claims lapse after CLAIM_TIMEOUT
+APPROVAL_CLAIM_BATCH = 10
+CLAIM_TIMEOUT = timedelta(minutes=15)
+
+def claim_owner():
+    """Identifies this admin's login session (several admins can share a user_name)"""
+    return f"{session.get('user_name', 'Unknown')} ({session.get('session_token', '')[:8]})"
+
+def claim_available_clause(owner, now):
+    """Request is unclaimed, claimed by owner, or its claim has lapsed"""
+    return db.or_(
+        Request.claimed_by.is_(None),
+        Request.claimed_by == owner,
+        Request.claimed_at < now - CLAIM_TIMEOUT
+    )
+
+def claim_pending_requests(owner, limit=APPROVAL_CLAIM_BATCH):
+    """Claim up to limit of the oldest available pending requests for owner; returns their ids"""
+    # Without SKIP LOCKED two admins can pick the same candidates; the one who loses looks again
+    # (each lost race means the candidates were claimed, so the loop ends once none are left)
+    while True:
+        now = datetime.utcnow()
+        candidates = filter_by_project_site(Request.query).filter(
+            Request.status == 'Pending',
+            claim_available_clause(owner, now)
+        ).order_by(Request.created_at, Request.id).limit(limit).with_entities(Request.id)
+        if db.session.get_bind(mapper=Request.__mapper__).dialect.name == 'postgresql':
+            # Rows another admin is claiming right now are skipped instead of waited for
+            candidates = candidates.with_for_update(skip_locked=True)
+        ids = [row.id for row in candidates]
+        if not ids:
+            return []
+        
+        # The conditions are re-checked in the UPDATE itself, which makes the claim atomic where
+        # SKIP LOCKED is unavailable (SQLite serializes writers)
+        db.session.execute(
+            db.update(Request).where(
+                Request.id.in_(ids),
+                Request.status == 'Pending',
+                claim_available_clause(owner, now)
+            ).values(claimed_by=owner, claimed_at=now, version=Request.version + 1),
+            execution_options={'synchronize_session': False}
+        )
+        change_feed.record(Request, 'update', [Request.id.in_(ids), Request.claimed_by == owner, Request.claimed_at == now],
+                           [Request.claimed_by, Request.claimed_at, Request.version])
+        db.session.commit()
+        claimed = [
+            row.id for row in Request.query.filter(
+                Request.id.in_(ids), Request.claimed_by == owner, Request.claimed_at == now
+            ).with_entities(Request.id)
+        ]
+        if claimed:
+            return claimed
+
+def decide_request(req, status, actor, version=None):
+    """Approve or reject req and commit; returns an error message if it was decided or changed meanwhile
+
+    version is the one the admin's page showed (defaults to the one loaded here), so a decision
+    made from a stale page is refused as well as two decisions at the same moment.
+    """
+    if req.status != 'Pending':
+        return f'Request #{req.id} is already {req.status.lower()}.'
+    if version is None:
+        version = req.version
+    elif version != req.version:
+        return f'Request #{req.id} was changed since you loaded the page. Reload and try again.'
+    owner = claim_owner()
+    now = datetime.utcnow()
+    if req.claimed_by and req.claimed_by != owner and req.claimed_at and req.claimed_at >= now - CLAIM_TIMEOUT:
+        return f'Request #{req.id} is claimed by {req.claimed_by}.'
+    
+    # Every condition is re-checked in the UPDATE itself: only one decision can match a pending row
+    # at a given version, whoever made it and from whichever page
+    decided = db.session.execute(
+        db.update(Request).where(
+            Request.id == req.id,
+            Request.status == 'Pending',
+            Request.version == version,
+            claim_available_clause(owner, now)
+        ).values(status=status, approved_by=actor, updated_at=now, claimed_by=None, claimed_at=None,
+                 version=Request.version + 1),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not decided:
+        db.session.rollback()
+        return f'Request #{req.id} was changed by another admin. Reload and try again.'
+    change_feed.record(Request, 'update', [Request.id == req.id],
+                       [Request.status, Request.approved_by, Request.updated_at, Request.claimed_by,
+                        Request.claimed_at, Request.version])
+    db.session.refresh(req)
+    if status == 'Approved':
+        # Create Actual record from approved request (same transaction as the decision)
+        create_actual_for_request(req, actor)
+    db.session.commit()
+    if status == 'Approved':
+        summaries.mark_dirty(req.project_site or '')
+    return None
+
+def decision_version():
+    """Request version the review page rendered the approve/reject button with (None if not sent)"""
+    return request.values.get('version', type=int)
+
 def approve_request(request_id):
     """Approve a request"""
     if not is_admin():
@@ -589,31 +1163,11 @@ def approve_request(request_id):
         if req.project_site != assigned_site:
             flash('Permission denied. You can only approve requests from your assigned project site.', 'error')
             return redirect(url_for('review_history'))
-    req.status = 'Approved'
-    req.approved_by = session.get('user_name', 'Unknown')
-    req.updated_at = datetime.utcnow()
     
-    # Create Actual record from approved request
-    # Calculate actual cost: quantity * current price (or fall back to item unit cost)
-    current_price = float(req.current_price) if req.current_price else (float(req.item.unit_cost) if req.item.unit_cost else 0)
-    actual_cost = float(req.qty) * current_price
-    
-    # Check if Actual record already exists for this request (to avoid duplicates)
-    existing_actual = Actual.query.filter_by(item_id=req.item_id).filter_by(notes=f'Request #{req.id}').first()
-    
-    if not existing_actual:
-        actual = Actual(
-            item_id=req.item_id,
-            actual_qty=req.qty,
-            actual_cost=actual_cost,
-            actual_date=req.created_at.strftime('%Y-%m-%d'),
-            recorded_by=req.approved_by,
-            notes=f'Request #{req.id}',
-            project_site=req.project_site
-        )
-        db.session.add(actual)
-    
-    db.session.commit()
+    error = decide_request(req, 'Approved', session.get('user_name', 'Unknown'), decision_version())
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('review_history'))
     
     # Find the requester's user_id by matching requested_by name with access codes
     # This notification will trigger popup for project site accounts
@@ -656,10 +1210,11 @@ def reject_request(request_id):
         if req.project_site != assigned_site:
             flash('Permission denied. You can only reject requests from your assigned project site.', 'error')
             return redirect(url_for('review_history'))
-    req.status = 'Rejected'
-    req.approved_by = session.get('user_name', 'Unknown')
-    req.updated_at = datetime.utcnow()
-    db.session.commit()
+    
+    error = decide_request(req, 'Rejected', session.get('user_name', 'Unknown'), decision_version())
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('review_history'))
     
     # Find the requester's user_id by matching project site
     # This notification will trigger popup for project site accounts
@@ -748,33 +1303,13 @@ def approve_reject_by_id():
                 flash('Permission denied. You can only approve/reject requests from your assigned project site.', 'error')
                 return redirect(url_for('review_history'))
         
+        if action in ('approve', 'reject'):
+            error = decide_request(req, 'Approved' if action == 'approve' else 'Rejected', approved_by)
+            if error:
+                flash(error, 'error')
+                return redirect(url_for('review_history'))
+        
         if action == 'approve':
-            req.status = 'Approved'
-            req.approved_by = approved_by
-            req.updated_at = datetime.utcnow()
-            
-            # Create Actual record from approved request
-            # Calculate actual cost: quantity * current price (or fall back to item unit cost)
-            current_price = float(req.current_price) if req.current_price else (float(req.item.unit_cost) if req.item.unit_cost else 0)
-            actual_cost = float(req.qty) * current_price
-            
-            # Check if Actual record already exists for this request (to avoid duplicates)
-            existing_actual = Actual.query.filter_by(item_id=req.item_id).filter_by(notes=f'Request #{req.id}').first()
-            
-            if not existing_actual:
-                actual = Actual(
-                    item_id=req.item_id,
-                    actual_qty=req.qty,
-                    actual_cost=actual_cost,
-                    actual_date=req.created_at.strftime('%Y-%m-%d'),
-                    recorded_by=approved_by,
-                    notes=f'Request #{req.id}',
-                    project_site=req.project_site
-                )
-                db.session.add(actual)
-            
-            db.session.commit()
-            
             # Create notification for requester
             requester_user_id = None
             if req.project_site:
@@ -798,11 +1333,6 @@ def approve_reject_by_id():
             
             flash(f'Request #{request_id} approved successfully! It has been added to Actuals.', 'success')
         elif action == 'reject':
-            req.status = 'Rejected'
-            req.approved_by = approved_by
-            req.updated_at = datetime.utcnow()
-            db.session.commit()
-            
             # Create notification for requester
             requester_user_id = None
             if req.project_site:
@@ -834,40 +1364,104 @@ def approve_reject_by_id():
     
     return redirect(url_for('review_history'))
 
+def claim_requests():
+    """Claim the next batch of pending requests for this admin (approval queue)"""
+    if not is_admin():
+        flash('Permission denied', 'error')
+        return redirect(url_for('review_history'))
+    
+    claimed = claim_pending_requests(claim_owner())
+    if claimed:
+        flash(f'Claimed {len(claimed)} pending request(s): #' + ', #'.join(str(i) for i in claimed), 'success')
+    else:
+        flash('No unclaimed pending requests left.', 'info')
+    return redirect(url_for('review_history'))
+
+# Site summaries recomputed in the background after writes (see summaries.py)
+def summary_site():
+    """The project site project_site_clause() restricts to, as a site summaries key (None = every site)"""
+    if not session.get('is_global_admin'):
+        # '' = items without a site, which is what an account with no assigned site sees
+        return get_assigned_project_site() or ''
+    return session.get('project_site') or None
+
+def summary_site_clause(column, site):
+    return db.true() if site is None else column == (site or None)
+
+def compute_budget_summary(site):
+    """Item statistics and planned totals per (budget, building type) of a site"""
+    site_clause = summary_site_clause(Item.project_site, site)
+    total_items, total_amount, unique_budgets, unique_building_types = db.session.execute(
+        db.select(
+            db.func.count(Item.id),
+            db.func.coalesce(db.func.sum(Item.amount), 0),
+            db.func.count(db.distinct(Item.budget)),
+            db.func.count(db.distinct(Item.building_type))
+        ).where(site_clause)
+    ).one()
+    budget_totals = db.session.execute(
+        db.select(Item.budget, Item.building_type, db.func.sum(Item.amount)).where(
+            site_clause, Item.budget.isnot(None), Item.building_type.isnot(None)
+        ).group_by(Item.budget, Item.building_type)
+    ).all()
+    return {
+        'total_items': total_items,
+        'total_amount': total_amount,
+        'unique_budgets': unique_budgets,
+        'unique_building_types': unique_building_types,
+        'budget_totals': [tuple(row) for row in budget_totals],
+    }
+
+def compute_actual_totals(site):
+    """{item id: (actual qty, actual cost)} of a site's actuals, summed in one query"""
+    return {
+        item_id: (float(qty), float(cost))
+        for item_id, qty, cost in db.session.execute(
+            db.select(Actual.item_id, db.func.sum(Actual.actual_qty), db.func.sum(Actual.actual_cost)).where(
+                summary_site_clause(Actual.project_site, site)
+            ).group_by(Actual.item_id)
+        ).all()
+    }
+
+summaries.register('budget_summary', compute_budget_summary)
+summaries.register('actual_totals', compute_actual_totals)
+
 # Route: Budget Summary
+@use_replica
+@require_site_when_sharded
 def budget_summary():
     """Budget Summary tab"""
     # Filter items by project site if one is selected
     query = filter_by_project_site(Item.query)
-    items = query.all()
     
-    # Statistics
-    total_items = len(items)
-    total_amount = sum(item.amount for item in items)
-    unique_budgets = len(set([item.budget for item in items if item.budget]))
-    unique_building_types = len(set([item.building_type for item in items if item.building_type]))
+    # Statistics and totals per (budget, building type), refreshed in the background after writes
+    summary = summaries.get('budget_summary', summary_site())
+    total_items = summary['total_items']
+    total_amount = summary['total_amount']
+    unique_budgets = summary['unique_budgets']
+    unique_building_types = summary['unique_building_types']
+    budget_totals = summary['budget_totals']
     
     # Recent items
-    recent_items = sorted(items, key=lambda x: x.created_at, reverse=True)[:10]
+    recent_items = query.order_by(Item.created_at.desc()).limit(10).all()
     
     # Summary by budget and building type
     summary_data = {}
-    for item in items:
-        if item.budget and item.building_type:
+    for budget, building_type, amount in budget_totals:
+        if budget and building_type:
             # Extract budget number
             try:
-                budget_num = item.budget.split(' ')[1].split(' ')[0]  # "Budget 1 - Flats(...)"
+                budget_num = budget.split(' ')[1].split(' ')[0]  # "Budget 1 - Flats(...)"
             except:
                 budget_num = 'Unknown'
             
             if budget_num not in summary_data:
                 summary_data[budget_num] = {}
             
-            building_type = item.building_type
             if building_type not in summary_data[budget_num]:
-                summary_data[budget_num][building_type] = 0.0
+                summary_data[budget_num][building_type] = Decimal('0.00')
             
-            summary_data[budget_num][building_type] += item.amount
+            summary_data[budget_num][building_type] += amount
     
     # Get selected budget for Manual Budget Summary view
     selected_budget_num = request.args.get('budget', '1')
@@ -903,11 +1497,10 @@ def budget_summary():
     # Get the amount per block from database (first block's total)
     amount_per_block_data = {}
     for building_type in PROPERTY_TYPES:
-        building_items = [item for item in items if item.building_type == building_type and 
-                         item.budget and f'Budget {selected_budget_num}' in item.budget]
-        if building_items:
-            total_amount = sum(item.amount for item in building_items)
-            amount_per_block_data[building_type] = total_amount
+        building_totals = [amount for budget, item_building_type, amount in budget_totals
+                           if item_building_type == building_type and f'Budget {selected_budget_num}' in budget]
+        if building_totals:
+            amount_per_block_data[building_type] = sum(building_totals)
     
     if request.args.get('download') == 'csv':
         output = io.StringIO()
@@ -942,7 +1535,6 @@ def budget_summary():
                          summary_data=summary_data,
                          property_types=PROPERTY_TYPES,
                          max_budget_num=MAX_BUDGET_NUM,
-                         items=items,
                          selected_budget_num=selected_budget_num,
                          selected_budget_total=selected_budget_total,
                          selected_budget_breakdown=selected_budget_breakdown,
@@ -990,6 +1582,8 @@ def save_building_config():
     return redirect(url_for('budget_summary'))
 
 # Route: Actuals
+@use_replica
+@require_site_when_sharded
 def actuals():
     """Actuals tab"""
     selected_budget = request.args.get('budget', '')
@@ -1001,17 +1595,6 @@ def actuals():
             budget_options.append(f"Budget {budget_num} - {building_type}")
     
     # Sort numerically by budget number, not alphabetically
-    def extract_budget_number(budget_str):
-        """Extract budget number from string like 'Budget 1 - Flats'"""
-        try:
-            parts = budget_str.split("Budget ", 1)
-            if len(parts) > 1:
-                num_str = parts[1].split(" -")[0].strip()
-                return int(num_str)
-        except (ValueError, IndexError):
-            pass
-        return 999
-    
     budget_options = sorted(budget_options, key=lambda x: (extract_budget_number(x), x))
     
     if not selected_budget:
@@ -1032,36 +1615,13 @@ def actuals():
     building_type = parts[1].strip()
     
     # Get planned budget items - filtered by project site
-    query = filter_by_project_site(Item.query)
-    
-    # Filter items that match this budget pattern
-    # Items can have budget like "Budget 1 - Flats(General Materials)"
-    # We need to match items where:
-    # 1. Budget starts with "Budget {budget_num} - {building_type}"
-    # 2. Building type matches exactly
-    all_items = query.all()
-    planned_items = []
+    # Budget starts with "Budget {budget_num} - {building_type}" (so "Budget 1 - Flats" matches
+    # "Budget 1 - Flats(General Materials)") and the building type matches case-insensitively
     budget_pattern = f"Budget {budget_num} - {building_type}"
-    
-    for item in all_items:
-        # Match budget pattern (can include subgroup like "(General Materials)")
-        budget_matches = False
-        if item.budget:
-            # Check if budget starts with the pattern we're looking for
-            # e.g., "Budget 1 - Flats" should match "Budget 1 - Flats(General Materials)"
-            if item.budget.startswith(budget_pattern):
-                budget_matches = True
-        
-        # Building type must match exactly (case-insensitive)
-        building_matches = False
-        if item.building_type:
-            building_matches = item.building_type.strip().lower() == building_type.strip().lower()
-        elif building_type and not item.building_type:
-            # If building_type is required but item doesn't have one, don't match
-            building_matches = False
-        
-        if budget_matches and building_matches:
-            planned_items.append(item)
+    planned_items = filter_by_project_site(Item.query).filter(
+        Item.budget.startswith(budget_pattern, autoescape=True),
+        db.func.lower(db.func.trim(Item.building_type)) == building_type.strip().lower()
+    ).order_by(Item.id).all()
     
     # Group by category (grp)
     planned_by_category = {}
@@ -1071,11 +1631,8 @@ def actuals():
             planned_by_category[grp] = []
         planned_by_category[grp].append(item)
     
-    # Get actuals - filtered by project site
-    actual_query = Actual.query
-    project_site = get_user_project_site()
-    if project_site:
-        actual_query = actual_query.filter_by(project_site=project_site)
+    # Actual qty and cost per item - filtered by project site, refreshed in the background after approvals
+    actual_totals = summaries.get('actual_totals', summary_site())
     
     # Build actual_by_category with ALL planned items (show 0 if no actuals yet)
     actual_by_category = {}
@@ -1084,17 +1641,8 @@ def actuals():
         if grp not in actual_by_category:
             actual_by_category[grp] = []
         
-        # Get actuals for this item
-        item_actuals = actual_query.filter_by(item_id=item.id).all()
-        
-        if item_actuals:
-            # Sum up all actuals for this item
-            total_qty = sum(float(a.actual_qty) for a in item_actuals)
-            total_cost = sum(float(a.actual_cost) for a in item_actuals)
-        else:
-            # No approved requests yet - show 0
-            total_qty = 0.0
-            total_cost = 0.0
+        # No approved requests yet - show 0
+        total_qty, total_cost = actual_totals.get(item.id, (0.0, 0.0))
         
         # Always add the item to actuals (even if 0, until approved)
         actual_by_category[grp].append({
@@ -1110,6 +1658,123 @@ def actuals():
                          actual_data=actual_by_category,
                          can_edit=can_edit())
 
+# Cross-site overview for global admins (cached, see cache.py)
+SITE_OVERVIEW_CACHE_KEY = 'site_overview'
+
+# Built once: the same statements run against the primary database and every shard
+SITE_ITEM_STATS = db.select(
+    Item.project_site,
+    db.func.count(Item.id),
+    db.func.coalesce(db.func.sum(Item.amount), 0),
+    db.func.max(Item.created_at)
+).group_by(Item.project_site)
+SITE_REQUEST_STATS = db.select(
+    Request.project_site,
+    db.func.count(Request.id),
+    db.func.sum(db.case((Request.status == 'Pending', 1), else_=0)),
+    db.func.max(Request.updated_at)
+).group_by(Request.project_site)
+SITE_SPEND_STATS = db.select(
+    DailySpend.project_site,
+    db.func.coalesce(db.func.sum(DailySpend.actual_cost), 0),
+    db.func.max(DailySpend.day)
+).group_by(DailySpend.project_site)
+
+def site_overview_stats():
+    """Per-site (item, request, spend) stats dicts from the current database or shard"""
+    # One grouped query per table (plus the daily spend rollup), however many sites there are
+    item_stats = {
+        site: (count, planned, last)
+        for site, count, planned, last in db.session.execute(SITE_ITEM_STATS)
+    }
+    request_stats = {
+        site: (count, pending or 0, last)
+        for site, count, pending, last in db.session.execute(SITE_REQUEST_STATS)
+    }
+    spend_stats = {
+        site: (spend, to_date(last))
+        for site, spend, last in db.session.execute(SITE_SPEND_STATS)
+    }
+    return item_stats, request_stats, spend_stats
+
+def merge_site_stats(merged, stats):
+    """Add another shard's per-site stats into merged (leading values summed, last activity maxed)"""
+    for site, values in stats.items():
+        if site in merged:
+            *sums, last = merged[site]
+            *more, other_last = values
+            values = (*(a + b for a, b in zip(sums, more)), max((d for d in (last, other_last) if d), default=None))
+        merged[site] = values
+
+def compute_site_overview():
+    """Per-site item count, planned value, actual spend, requests and last activity for every site"""
+    with shards.primary():
+        item_stats, request_stats, spend_stats = site_overview_stats()
+    if shards.enabled:
+        # Every site's shard in parallel, on top of any rows still in the primary database
+        for shard_stats in shards.fan_out(lambda site: site_overview_stats()):
+            for merged, stats in zip((item_stats, request_stats, spend_stats), shard_stats):
+                merge_site_stats(merged, stats)
+    
+    sites = []
+    for site in db.session.execute(db.select(ProjectSite.name).order_by(ProjectSite.name)).scalars():
+        item_count, planned, item_last = item_stats.get(site, (0, 0, None))
+        request_count, pending, request_last = request_stats.get(site, (0, 0, None))
+        spend, spend_last = spend_stats.get(site, (0, None))
+        activity = [item_last, request_last]
+        if spend_last:
+            activity.append(datetime.combine(spend_last, datetime.min.time()))
+        sites.append({
+            'project_site': site,
+            'items': item_count,
+            'planned_value': float(planned or 0),
+            'actual_spend': float(spend or 0),
+            'requests': request_count,
+            'pending_requests': pending,
+            'last_activity': max((a for a in activity if a), default=None),
+        })
+    
+    # Totals cover every row, including ones whose site has been deleted or is unset
+    totals = {
+        'items': sum(stats[0] for stats in item_stats.values()),
+        'planned_value': float(sum(stats[1] or 0 for stats in item_stats.values())),
+        'actual_spend': float(sum(stats[0] or 0 for stats in spend_stats.values())),
+        'requests': sum(stats[0] for stats in request_stats.values()),
+        'pending_requests': sum(stats[1] for stats in request_stats.values()),
+    }
+    return {'sites': sites, 'totals': totals}
+
+def get_site_overview():
+    """compute_site_overview(), cached for CACHE_TTL seconds"""
+    return cache.get_or_set(SITE_OVERVIEW_CACHE_KEY, compute_site_overview)
+
+# Project sites listed in the site selector of every page (cached, see cache.py)
+PROJECT_SITES_CACHE_KEY = 'project_sites'
+
+def get_project_sites():
+    """(id, name) rows of every project site, cached for CACHE_TTL seconds"""
+    return cache.get_or_set(PROJECT_SITES_CACHE_KEY, lambda: db.session.execute(
+        db.select(ProjectSite.id, ProjectSite.name).order_by(ProjectSite.id)
+    ).all())
+
+# Number of access codes a login attempt is checked against (cached, see throttle.py)
+LOGIN_CODE_COUNT_CACHE_KEY = 'login_code_count'
+
+def get_login_code_count():
+    """Password hash checks one failed login costs (global admin code + site codes), cached for CACHE_TTL seconds"""
+    def count():
+        admin_codes, site_codes = db.session.execute(db.select(
+            db.select(db.func.count()).select_from(AccessCode).where(
+                AccessCode.code_type == 'global_admin', AccessCode.project_site.is_(None)
+            ).scalar_subquery(),
+            db.select(db.func.count()).select_from(ProjectSite).join(AccessCode, db.and_(
+                AccessCode.code_type == 'project_site', AccessCode.project_site == ProjectSite.name
+            )).scalar_subquery()
+        )).one()
+        # login() checks only the first global admin code
+        return min(admin_codes, 1) + site_codes
+    return cache.get_or_set(LOGIN_CODE_COUNT_CACHE_KEY, count)
+
 # Route: Admin Settings
 def admin_settings():
     """Admin Settings tab (Global Admin only)"""
@@ -1118,15 +1783,13 @@ def admin_settings():
         return redirect(url_for('manual_entry'))
     
     # Statistics
-    project_sites_count = ProjectSite.query.count()
-    total_items = Item.query.count()
-    total_requests = Request.query.count()
+    site_overview = get_site_overview()
+    project_sites_count = len(site_overview['sites'])
+    total_items = site_overview['totals']['items']
+    total_requests = site_overview['totals']['requests']
     
     # Today's access logs
-    today = datetime.utcnow().date()
-    today_logs = AccessLog.query.filter(
-        db.func.date(AccessLog.created_at) == today
-    ).count()
+    today_logs = count_access_logs_today()
     
     # Notification statistics
     unread_admin_notifications = Notification.query.filter_by(
@@ -1147,14 +1810,15 @@ def admin_settings():
     ).first()
     current_admin_code = admin_code_obj.display_code if admin_code_obj and admin_code_obj.display_code else None
     
-    # Get project sites with their access codes
+    # Get project sites with their access codes (one query for all codes)
     project_sites = ProjectSite.query.all()
+    site_codes = {
+        code.project_site: code
+        for code in AccessCode.query.filter_by(code_type='project_site').order_by(AccessCode.id.desc())
+    }
     project_sites_with_codes = []
     for site in project_sites:
-        access_code = AccessCode.query.filter_by(
-            code_type='project_site',
-            project_site=site.name
-        ).first()
+        access_code = site_codes.get(site.name)
         site_data = {
             'site': site,
             'access_code': access_code.display_code if access_code and access_code.display_code else None,
@@ -1163,18 +1827,70 @@ def admin_settings():
         }
         project_sites_with_codes.append(site_data)
     
+    alert_rules = AlertRule.query.order_by(AlertRule.project_site, AlertRule.scope, AlertRule.threshold_pct).all()
+    
     return render_template('admin_settings.html',
                          project_sites_count=project_sites_count,
                          total_items=total_items,
                          total_requests=total_requests,
                          today_access=today_logs,
-                         project_sites=ProjectSite.query.all(),
+                         site_overview=site_overview,
+                         project_sites=project_sites,
                          project_sites_with_codes=project_sites_with_codes,
                          current_project_site=get_user_project_site(),
                          current_admin_code=current_admin_code,
                          unread_admin_notifications=unread_admin_notifications,
                          total_admin_notifications=total_admin_notifications,
-                         recent_notifications=recent_notifications)
+                         recent_notifications=recent_notifications,
+                         alert_rules=alert_rules,
+                         alert_scopes=ALERT_SCOPES)
+
+def add_alert_rule():
+    """Add an overspend / threshold alert rule (Global Admin only)"""
+    if not session.get('is_global_admin'):
+        flash('Permission denied. Global admin privileges required.', 'error')
+        return redirect(url_for('admin_settings'))
+    
+    project_site = request.form.get('project_site', '').strip() or None
+    scope = request.form.get('scope', '')
+    scope_key = request.form.get('scope_key', '').strip() or None
+    try:
+        threshold = Decimal(request.form.get('threshold_pct', ''))
+        if not threshold.is_finite() or threshold <= 0:
+            raise ArithmeticError
+    except ArithmeticError:
+        flash('Threshold must be a positive percentage', 'error')
+        return redirect(url_for('admin_settings'))
+    
+    if scope not in ALERT_SCOPES:
+        flash('Invalid alert type', 'error')
+    elif project_site and not ProjectSite.query.filter_by(name=project_site).first():
+        flash('Unknown project site', 'error')
+    elif scope in ('item', 'request') and scope_key and not scope_key.isdigit():
+        flash('Item rules apply to one item ID, or to every item when left blank', 'error')
+    else:
+        if scope == 'budget' and scope_key:
+            # Budget rules cover the main budget ("Budget 1 - Flats"), like the actuals tab
+            scope_key = scope_key.split('(')[0].strip()
+        db.session.add(AlertRule(
+            project_site=project_site, scope=scope, scope_key=scope_key,
+            threshold_pct=threshold.quantize(CENTS), created_by=session.get('user_name', 'Unknown')
+        ))
+        db.session.commit()
+        flash('Alert rule added. It applies to actuals and plan changes from now on.', 'success')
+    return redirect(url_for('admin_settings'))
+
+def delete_alert_rule(rule_id):
+    """Delete an alert rule (Global Admin only)"""
+    if not session.get('is_global_admin'):
+        flash('Permission denied. Global admin privileges required.', 'error')
+        return redirect(url_for('admin_settings'))
+    
+    rule = AlertRule.query.get_or_404(rule_id)
+    db.session.delete(rule)
+    db.session.commit()
+    flash('Alert rule deleted', 'success')
+    return redirect(url_for('admin_settings'))
 
 def update_global_admin_code():
     """Update global admin access code"""
@@ -1201,6 +1917,7 @@ def update_global_admin_code():
             db.session.add(admin_code)
         
         db.session.commit()
+        cache.delete(LOGIN_CODE_COUNT_CACHE_KEY)
         return jsonify({'success': True})
     
     return redirect(url_for('admin_settings'))
@@ -1236,6 +1953,7 @@ def update_project_site_code():
             db.session.add(access_code)
         
         db.session.commit()
+        cache.delete(LOGIN_CODE_COUNT_CACHE_KEY)
         flash(f'Access code for "{project_site}" updated successfully!', 'success')
         return jsonify({'success': True})
     
@@ -1260,6 +1978,11 @@ def add_project_site():
             site = ProjectSite(name=name, description=description)
             db.session.add(site)
             db.session.commit()
+            if shards.enabled:
+                shards.provision(site.id)
+            cache.delete(SITE_OVERVIEW_CACHE_KEY)
+            cache.delete(PROJECT_SITES_CACHE_KEY)
+            cache.delete(SHARD_SITES_CACHE_KEY)
             
             # Create access code if provided
             if access_code:
@@ -1271,6 +1994,7 @@ def add_project_site():
                 )
                 db.session.add(code)
                 db.session.commit()
+                cache.delete(LOGIN_CODE_COUNT_CACHE_KEY)
                 flash(f'Project site "{name}" added successfully with access code!', 'success')
             else:
                 flash(f'Project site "{name}" added successfully! You can now set the access code.', 'success')
@@ -1313,6 +2037,9 @@ def edit_project_site():
                     access_code.project_site = name
             
             db.session.commit()
+            cache.delete(SITE_OVERVIEW_CACHE_KEY)
+            cache.delete(PROJECT_SITES_CACHE_KEY)
+            cache.delete(SHARD_SITES_CACHE_KEY)
             flash(f'Project site updated successfully!', 'success')
     
     return redirect(url_for('admin_settings'))
@@ -1330,6 +2057,7 @@ def delete_project_site():
     
     site = ProjectSite.query.get_or_404(site_id)
     site_name = site.name
+    shard_id = site.id
     
     # Delete associated access code
     access_code = AccessCode.query.filter_by(
@@ -1342,6 +2070,12 @@ def delete_project_site():
     # Delete project site
     db.session.delete(site)
     db.session.commit()
+    if shards.enabled:
+        # The site's inventory, requests and actuals go with its shard
+        shards.drop(shard_id)
+    cache.delete(SITE_OVERVIEW_CACHE_KEY)
+    cache.delete(PROJECT_SITES_CACHE_KEY)
+    cache.delete(LOGIN_CODE_COUNT_CACHE_KEY)
     
     flash(f'Project site "{site_name}" and its access code deleted successfully!', 'success')
     return redirect(url_for('admin_settings'))
@@ -1379,12 +2113,24 @@ def switch_project_site():
     # Default redirect to manual entry
     return redirect(url_for('manual_entry'))
 
+def count_access_logs_today():
+    """Count today's access logs with an index-friendly range instead of date(created_at)"""
+    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return AccessLog.query.filter(
+        AccessLog.created_at >= today_start,
+        AccessLog.created_at < today_start + timedelta(days=1)
+    ).count()
+
+@use_replica
 def access_logs():
     """View access logs"""
     if not is_admin():
         flash('Permission denied', 'error')
         return redirect(url_for('admin_settings'))
     
+    # Show logins still waiting in the write buffer
+    access_log_writer.flush()
+    
     role_filter = request.args.get('role_filter', 'All')
     days = int(request.args.get('days', 7))
     page = int(request.args.get('page', 1))
@@ -1401,17 +2147,15 @@ def access_logs():
     
     logs = query.order_by(AccessLog.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
     
-    # Statistics
-    all_logs = AccessLog.query.filter(AccessLog.created_at >= cutoff_date).all()
-    total_logs = len(all_logs)
-    successful = len([l for l in all_logs if l.status == 'Success'])
-    failed = len([l for l in all_logs if l.status == 'Failed'])
-    unique_users = len(set([l.user for l in all_logs if l.user]))
-    
-    today = datetime.utcnow().date()
-    today_logs = AccessLog.query.filter(
-        db.func.date(AccessLog.created_at) == today
-    ).count()
+    # Statistics - one aggregate over the indexed created_at range
+    total_logs, successful, failed, unique_users = db.session.query(
+        db.func.count(AccessLog.id),
+        db.func.count(db.case((AccessLog.status == 'Success', 1))),
+        db.func.count(db.case((AccessLog.status == 'Failed', 1))),
+        db.func.count(db.distinct(AccessLog.user))
+    ).filter(AccessLog.created_at >= cutoff_date).one()
+    
+    today_logs = count_access_logs_today()
     
     return render_template('access_logs.html',
                          logs=logs,
@@ -1431,6 +2175,7 @@ def clear_access_logs():
         return redirect(url_for('admin_settings'))
     
     if request.method == 'POST':
+        access_log_writer.flush()
         AccessLog.query.delete()
         db.session.commit()
         flash('All access logs cleared!', 'success')
@@ -0,0 +1,99 @@
+"""Latency and response size of the JSON API against the HTML pages showing the same rows
+
+Usage: python scripts/bench_api.py [--items 5000] [--requests 2000] [--repeat 20]
+
+Runs the app in-process (Flask test client) against a throwaway SQLite file seeded with one
+project site. Each pair fetches the same rows once as the server-rendered page and once from
+/api/*, logged in as the site's admin; the first request of each URL is a warm-up and is not
+counted. Sizes are of the uncompressed body and of the gzip body the browser would download.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench_api_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['LOGIN_THROTTLE_ENABLED'] = '0'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from app import app
+from database import db, init_db
+from models import Item, Request, Actual, ProjectSite, AccessCode
+from rollups import rebuild_daily_spend, rebuild_spend_totals
+
+SITE = 'Bench Site'
+BUDGET = 'Budget 1 - Flats'
+# (label, HTML page, API URL returning the same rows)
+PAIRS = (
+    ('items, first page', '/inventory', '/api/items?limit=50'),
+    ('items, budget filter', f'/inventory?budget_filter={BUDGET}', f'/api/items?limit=50&budget={BUDGET}'),
+    ('requests', '/review_history', '/api/requests?limit=20'),
+    ('actuals, one budget', f'/actuals?budget={BUDGET}', f'/api/actuals?limit=500&budget={BUDGET}'),
+)
+
+def seed(items, requests):
+    with app.app_context():
+        init_db()
+        db.session.add(ProjectSite(name=SITE))
+        db.session.add(AccessCode(code_type='project_site', project_site=SITE,
+                                  code_hash=generate_password_hash('bench'), display_code='bench'))
+        subgroups = ('General Materials', 'Woods', 'Labour')
+        db.session.execute(db.insert(Item), [dict(
+            name=f'Item {n}', code=f'I{n}', qty=1 + n % 40, unit_cost=5 + n % 13, category='materials',
+            budget=f'Budget {1 + n % 5} - {("Flats", "Terraces")[n % 2]}({subgroups[n % 3]})',
+            section='SUBSTRUCTURE (GROUND TO DPC LEVEL)', grp=('Materials', 'MATERIAL(WOODS)', 'Labour')[n % 3],
+            building_type=('Flats', 'Terraces')[n % 2], project_site=SITE
+        ) for n in range(items)])
+        today = date.today()
+        db.session.execute(db.insert(Request), [dict(
+            section='materials', item_id=1 + n % items, qty=1 + n % 5, requested_by='bench', note='bench',
+            status=('Pending', 'Approved', 'Rejected')[n % 3], project_site=SITE, building_type='Flats',
+            budget=BUDGET
+        ) for n in range(requests)])
+        db.session.execute(db.insert(Actual), [dict(
+            item_id=1 + n % items, actual_qty=1, actual_cost=10, actual_date=today - timedelta(days=n % 90),
+            recorded_by='bench', notes=f'Request #{n}', project_site=SITE
+        ) for n in range(1, requests, 3)])
+        db.session.commit()
+        rebuild_daily_spend()
+        rebuild_spend_totals()
+
+def measure(client, url, repeat):
+    """(median ms, body bytes, gzip body bytes) of GET url"""
+    client.get(url)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise SystemExit(f'{url}: {response.status_code}')
+    gzipped = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    return statistics.median(timings) * 1000, len(response.data), len(gzipped.data)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    seed(args.items, args.requests)
+    client = app.test_client()
+    client.post('/login', data={'access_code': 'bench'})
+    print(f'{args.items} items, {args.requests} requests; median of {args.repeat} requests, sizes raw / gzip')
+    print(f'{"":22} {"HTML page":>26} {"JSON API":>26} {"speed-up":>9}')
+    for label, page, api in PAIRS:
+        page_ms, page_bytes, page_gzip = measure(client, page, args.repeat)
+        api_ms, api_bytes, api_gzip = measure(client, api, args.repeat)
+        print(f'{label:22} {page_ms:7.1f} ms {page_bytes / 1024:6.0f} / {page_gzip / 1024:4.0f} KB'
+              f' {api_ms:7.1f} ms {api_bytes / 1024:6.0f} / {api_gzip / 1024:4.0f} KB {page_ms / api_ms:8.1f}x')
+
+if __name__ == '__main__':
+    main()
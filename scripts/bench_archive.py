@@ -0,0 +1,98 @@
+"""Time archive-before and restore-archive on a large requests table
+
+Usage: python scripts/bench_archive.py [--requests 1000000] [--batch-sizes 500,5000]
+
+Seeds a throwaway SQLite file with --requests decided requests spread over 10 project sites,
+all older than the cutoff, one notification per 10 requests and as many access log rows as
+notifications. For each batch size it archives everything before the cutoff, restores the
+batch, and prints the wall time and rows/s of both, the hot table sizes and scan times before
+and after archiving, and checks that every row ended up back in the hot tables exactly once.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench_archive_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['LOGIN_THROTTLE_ENABLED'] = '0'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from archive import archive_before, restore_batch, hot_table_stats
+from database import db, init_db
+from models import Item, Request, Notification, AccessLog, ProjectSite, ArchivedRow
+
+SITES = [f'Site {n}' for n in range(10)]
+CUTOFF = datetime(2024, 1, 1)
+CHUNK = 50000
+
+def seed(requests):
+    init_db()
+    db.session.add_all([ProjectSite(name=site) for site in SITES])
+    db.session.execute(db.insert(Item), [dict(
+        name=f'Item {n}', qty=10, unit_cost=5, category='materials', project_site=site
+    ) for n, site in enumerate(SITES)])
+    old = CUTOFF - timedelta(days=400)
+    for start in range(0, requests, CHUNK):
+        db.session.execute(db.insert(Request), [dict(
+            section='materials', item_id=1 + n % len(SITES), qty=1 + n % 5, requested_by='bench',
+            note=f'Request {n}', status=('Approved', 'Rejected')[n % 2], approved_by='admin', current_price=5,
+            building_type='Flats', budget='Budget 1 - Flats', project_site=SITES[n % len(SITES)],
+            ts=old + timedelta(seconds=n * 30), created_at=old + timedelta(seconds=n * 30)
+        ) for n in range(start, min(start + CHUNK, requests))])
+        db.session.commit()
+    for start in range(0, requests // 10, CHUNK):
+        count = min(CHUNK, requests // 10 - start)
+        db.session.execute(db.insert(Notification), [dict(
+            notification_type='approved', title='Request approved', message=f'Request #{1 + n * 10} was approved',
+            request_id=1 + n * 10, created_at=old + timedelta(seconds=n * 300)
+        ) for n in range(start, start + count)])
+        db.session.execute(db.insert(AccessLog), [dict(
+            user='bench', role='project_site', status='Success', created_at=old + timedelta(seconds=n * 300)
+        ) for n in range(start, start + count)])
+        db.session.commit()
+
+def counts():
+    return {model.__tablename__: db.session.execute(
+        db.select(db.func.count()).select_from(model.__table__)
+    ).scalar() for model in (Request, Notification, AccessLog, ArchivedRow)}
+
+def print_stats(label):
+    stats = hot_table_stats()
+    print(f'  {label}: ' + ', '.join(
+        f'{table} {rows} rows / {ms:.1f} ms' for table, (rows, ms) in stats.items()
+        if table in ('requests', 'notifications', 'access_logs')
+    ))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=1000000)
+    parser.add_argument('--batch-sizes', default='500,5000')
+    args = parser.parse_args()
+
+    with app.app_context():
+        started = time.perf_counter()
+        seed(args.requests)
+        expected = counts()
+        print(f'seeded {expected} in {time.perf_counter() - started:.0f} s')
+        for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+            print(f'batch size {batch_size}:')
+            print_stats('hot tables before')
+            started = time.perf_counter()
+            batch = archive_before(CUTOFF, archived_by='bench', batch_size=batch_size)
+            seconds = time.perf_counter() - started
+            print(f'  archive-before: {batch.row_count} rows in {seconds:.1f} s ({batch.row_count / seconds:.0f} rows/s)')
+            print_stats('hot tables after')
+            started = time.perf_counter()
+            restored = restore_batch(batch.id, batch_size=batch_size)
+            seconds = time.perf_counter() - started
+            print(f'  restore-archive: {restored} rows in {seconds:.1f} s ({restored / seconds:.0f} rows/s)')
+            if counts() != expected:
+                raise SystemExit(f'row counts after restore {counts()} != {expected}')
+
+if __name__ == '__main__':
+    main()
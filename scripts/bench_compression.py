@@ -0,0 +1,119 @@
+"""CPU cost against bytes saved of gzip levels on the app's real responses
+
+Usage: python scripts/bench_compression.py [--items 2000] [--repeat 20]
+
+Renders pages, API responses and a CSV export through the Flask test client (compression
+off) from a throwaway SQLite file seeded with one project site, then gzips each body at
+levels 1, 3, 6 and 9. For every level it prints the compressed size and the median time
+to compress. "pays" is the link speed under which the bytes saved arrive sooner
+than the CPU time spent: compression is a win for clients slower than that. The totals
+show the same for each step up in level.
+"""
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench_compression_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['LOGIN_THROTTLE_ENABLED'] = '0'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from app import app
+from database import db, init_db
+from models import Item, Request, ProjectSite, AccessCode
+
+SITE = 'Bench Site'
+LEVELS = (1, 3, 6, 9)
+URLS = (
+    '/inventory',
+    '/review_history',
+    '/budget_summary?download=csv',
+    '/api/items?limit=500',
+    '/api/items?limit=20',
+    '/api/items?limit=3&fields=name,qty',
+    '/api/items?limit=1&fields=name',
+    '/api/session_info',
+)
+
+def seed(items):
+    with app.app_context():
+        init_db()
+        db.session.add(ProjectSite(name=SITE))
+        db.session.add(AccessCode(code_type='project_site', project_site=SITE,
+                                  code_hash=generate_password_hash('bench'), display_code='bench'))
+        subgroups = ('General Materials', 'Woods', 'Labour')
+        db.session.execute(db.insert(Item), [dict(
+            name=f'Item {n}', code=f'I{n}', qty=1 + n % 40, unit_cost=5 + n % 13, category='materials',
+            budget=f'Budget {1 + n % 5} - {("Flats", "Terraces")[n % 2]}({subgroups[n % 3]})',
+            section='SUBSTRUCTURE (GROUND TO DPC LEVEL)', grp=('Materials', 'MATERIAL(WOODS)', 'Labour')[n % 3],
+            building_type=('Flats', 'Terraces')[n % 2], project_site=SITE
+        ) for n in range(items)])
+        db.session.execute(db.insert(Request), [dict(
+            section='materials', item_id=1 + n, qty=1, requested_by='bench', note='bench',
+            status=('Pending', 'Approved', 'Rejected')[n % 3], project_site=SITE, building_type='Flats'
+        ) for n in range(min(items, 300))])
+        db.session.commit()
+
+def compress_time(data, level, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        gzip.compress(data, compresslevel=level)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    seed(args.items)
+    app.config['COMPRESS_ENABLED'] = False
+    client = app.test_client()
+    client.post('/login', data={'access_code': 'bench'})
+
+    print(f'{"response":36} {"bytes":>8}  ' + '  '.join(f'{"level " + str(level):>24}' for level in LEVELS))
+    print(f'{"":36} {"":>8}  ' + '  '.join(f'{"gzip bytes":>11} {"CPU µs":>7} {"pays":>4}' for _ in LEVELS))
+    totals = {level: [0, 0.0] for level in LEVELS}
+    for url in URLS:
+        data = client.get(url).get_data()
+        cells = []
+        for level in LEVELS:
+            size = len(gzip.compress(data, compresslevel=level))
+            seconds = compress_time(data, level, args.repeat)
+            saved = len(data) - size
+            # Link speed (bits/s) at which the saved bytes take as long to send as compressing them
+            break_even = saved * 8 / seconds if saved > 0 else 0
+            cells.append(f'{size:11} {seconds * 1e6:7.0f} {_rate(break_even):>4}')
+            if len(data) >= 1024:
+                totals[level][0] += size
+                totals[level][1] += seconds
+        print(f'{url[:36]:36} {len(data):8}  ' + '  '.join(cells))
+    print('"pays" = link speed below which compressing is faster than sending the saved bytes')
+    print('Totals of the responses of 1 KB and more:')
+    for previous, level in zip((None,) + LEVELS, LEVELS):
+        size, seconds = totals[level]
+        line = f'  level {level}: {size} gzip bytes, {seconds * 1e3:.2f} ms CPU'
+        if previous is not None:
+            # What the step up from the previous level buys, and for which clients it is worth it
+            saved = totals[previous][0] - size
+            extra = seconds - totals[previous][1]
+            line += (f'; vs level {previous}: {saved} bytes less for {extra * 1e3:.2f} ms more, '
+                     f'pays below {_rate(saved * 8 / extra) if extra > 0 and saved > 0 else "-"}bit/s')
+        print(line)
+
+def _rate(bits_per_second):
+    for unit, scale in (('G', 1e9), ('M', 1e6), ('k', 1e3)):
+        if bits_per_second >= scale:
+            return f'{bits_per_second / scale:.0f}{unit}'
+    return '-'
+
+if __name__ == '__main__':
+    main()
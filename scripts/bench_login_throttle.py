@@ -0,0 +1,134 @@
+"""Login latency of legitimate users while a distributed attack guesses access codes
+
+Usage: python scripts/bench_login_throttle.py [--seconds 30] [--interval 6] [--attack-rate 100] [--sites 5]
+
+Runs the app in-process (Flask test client) against throwaway SQLite files. Attack threads
+post wrong codes at --attack-rate requests per second, from a new client IP each time
+(X-Forwarded-For), well above what LOGIN_MAX_HASHES_PER_SECOND lets through; meanwhile one browser that
+has logged in before (trusted-login cookie) and one new browser log in every --interval seconds.
+LOGIN_MAX_HASHES_PER_SECOND is set to half of what this machine's CPUs can hash (measured), as
+it should be in production. Each phase prints the legitimate logins' success rate and latency, first without an attack,
+then under attack with the hash budget fully shared (LOGIN_TRUSTED_HASH_SHARE=0, the old
+behaviour) and with the default reserved share.
+"""
+import argparse
+import itertools
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ATTACK_THREADS = 8
+WORK_DIR = tempfile.mkdtemp(prefix='bench_login_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['LOGIN_THROTTLE_DB'] = os.path.join(WORK_DIR, 'throttle.db')
+os.environ['LOGIN_THROTTLE_PROXY_HOPS'] = '1'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import app
+from database import db, init_db
+from cache import cache
+from models import ProjectSite, AccessCode
+
+def affordable_hashes_per_second():
+    """Half of the password hash checks per second this machine's CPUs can do"""
+    code_hash = generate_password_hash('benchmark')
+    started = time.perf_counter()
+    for _ in range(5):
+        check_password_hash(code_hash, 'wrong')
+    return 0.5 * (os.cpu_count() or 1) / ((time.perf_counter() - started) / 5)
+
+def seed(sites):
+    with app.app_context():
+        init_db()
+        for n in range(sites):
+            db.session.add(ProjectSite(name=f'Site {n}'))
+            db.session.add(AccessCode(code_type='project_site', project_site=f'Site {n}',
+                                      code_hash=generate_password_hash(f'code{n}'), display_code=f'code{n}'))
+        db.session.commit()
+
+def reset_buckets():
+    import sqlite3
+    conn = sqlite3.connect(os.environ['LOGIN_THROTTLE_DB'])
+    conn.execute('DELETE FROM buckets')
+    conn.commit()
+    conn.close()
+
+def legit_user(client, ip, code, interval, stop, results):
+    """Logs in every interval seconds; records (status code, seconds) per attempt
+
+    client None stands for a new browser each time (no trusted-login cookie).
+    """
+    while not stop.is_set():
+        browser = client or app.test_client()
+        started = time.perf_counter()
+        response = browser.post('/login', data={'access_code': code, 'override_session': 'true'},
+                               headers={'X-Forwarded-For': ip})
+        results.append((response.status_code, time.perf_counter() - started))
+        stop.wait(interval)
+
+def attacker(ips, interval, stop, counts):
+    client = app.test_client()
+    while not stop.wait(interval):
+        response = client.post('/login', data={'access_code': 'guess'}, headers={'X-Forwarded-For': next(ips)})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+def run_phase(name, args, attack_rate, share, trusted_client):
+    app.config['LOGIN_TRUSTED_HASH_SHARE'] = share
+    reset_buckets()
+    stop = threading.Event()
+    trusted_results, new_results, counts = [], [], {}
+    ips = (f'10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}' for n in itertools.count(1))
+    threads = [
+        threading.Thread(target=legit_user, args=(trusted_client, '192.0.2.1', 'code0', args.interval, stop, trusted_results)),
+        threading.Thread(target=legit_user, args=(None, '192.0.2.2', 'code1', args.interval, stop, new_results)),
+    ] + [threading.Thread(target=attacker, args=(ips, ATTACK_THREADS / attack_rate, stop, counts))
+         for _ in range(ATTACK_THREADS if attack_rate else 0)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(f'{name} (LOGIN_TRUSTED_HASH_SHARE={share})')
+    for label, results in (('returning browser', trusted_results), ('new browser', new_results)):
+        ok = [elapsed for status, elapsed in results if status == 302]
+        refused = sum(1 for status, _ in results if status == 429)
+        latency = (f'p50 {statistics.median(ok) * 1000:.0f} ms, p95 {statistics.quantiles(ok, n=20)[-1] * 1000:.0f} ms'
+                   if len(ok) > 1 else 'too few logins for latency')
+        print(f'  {label:17} {len(ok)}/{len(results)} logged in ({refused} refused with 429), {latency}')
+    if counts:
+        print(f'  attack requests   {sum(counts.values())} ({", ".join(f"{k}: {v}" for k, v in sorted(counts.items()))})')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--interval', type=float, default=6, help='seconds between logins of each legitimate user')
+    parser.add_argument('--attack-rate', type=float, default=100, help='attack requests per second')
+    parser.add_argument('--sites', type=int, default=5)
+    args = parser.parse_args()
+
+    seed(args.sites)
+    with app.app_context():
+        cache.clear()
+    # Per-IP limits do not matter here: every legitimate user has an IP of its own
+    app.config['LOGIN_IP_ATTEMPTS_PER_MINUTE'] = 600
+    app.config['LOGIN_IP_BURST'] = 20
+    app.config['LOGIN_MAX_HASHES_PER_SECOND'] = round(affordable_hashes_per_second(), 1)
+    print(f'{args.sites + 1} codes per login, LOGIN_MAX_HASHES_PER_SECOND={app.config["LOGIN_MAX_HASHES_PER_SECOND"]:g}, '
+          f'attack at {args.attack_rate:g} requests/s, {args.seconds:g}s per phase')
+
+    trusted_client = app.test_client()
+    response = trusted_client.post('/login', data={'access_code': 'code0'}, headers={'X-Forwarded-For': '192.0.2.1'})
+    assert response.status_code == 302, 'seed login failed'
+
+    run_phase('No attack', args, 0, 0.5, trusted_client)
+    run_phase('Attack, shared budget only', args, args.attack_rate, 0.0, trusted_client)
+    run_phase('Attack, reserved budget for returning browsers', args, args.attack_rate, 0.5, trusted_client)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Search latency on a million-item site: full-text index (FTS5) against ILIKE substring scans
+
+Usage: python scripts/bench_search.py [--items 1000000] [--requests 200000] [--repeat 5]
+
+Seeds a throwaway SQLite file with one project site holding --items items and --requests
+requests, then times each query three ways, median of --repeat runs after one warm-up:
+
+- ILIKE: every term as a case-insensitive substring of name, code, section or budget (notes
+  and requester for requests), as lookups worked before the full-text index
+- FTS5: search_statement(), the ranked prefix match /api/search runs
+- /api/search: the whole request through the Flask test client, as the site's admin
+
+Rows is the number of matches the query has in the whole site (the searches return the top 20).
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench_search_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['LOGIN_THROTTLE_ENABLED'] = '0'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from app import app
+from database import db, init_db
+from models import Item, Request, ProjectSite, AccessCode
+from search import SEARCH_INDEXES, search_statement, search_terms
+
+SITE = 'Bench Site'
+CHUNK = 50000
+MATERIALS = (
+    'cement', 'sand', 'granite', 'blocks', 'rods', 'binding wire', 'nails', 'plywood', 'timber', 'roofing sheets',
+    'tiles', 'paint', 'pipes', 'cables', 'sockets', 'switches', 'gravel', 'lintel', 'doors', 'windows',
+    'glass', 'gutters', 'fascia', 'ceiling boards', 'screws', 'hinges', 'locks', 'primer', 'putty', 'adhesive',
+    'membrane', 'insulation', 'conduit', 'trunking', 'breakers', 'meters', 'tanks', 'valves', 'fittings', 'sealant',
+    'mesh', 'formwork', 'scaffold', 'bitumen', 'kerbs', 'pavers', 'manholes', 'culverts', 'bollards', 'railings',
+)
+FINISHES = ('galvanised', 'treated', 'reinforced', 'polished', 'coated', 'heavy duty', 'standard', 'premium')
+SECTIONS = ('SUBSTRUCTURE (GROUND TO DPC LEVEL)', 'SUPERSTRUCTURE', 'ROOFING', 'FINISHES', 'SERVICES')
+NOTES = ('urgent for slab pour', 'replacement for damaged stock', 'second floor works', 'external works',
+         'needed before inspection', 'top up after count')
+# (label, table, query)
+QUERIES = (
+    ('common word', 'items', 'cement'),
+    ('two words', 'items', 'galvanised cement'),
+    ('word prefix', 'items', 'reinf'),
+    ('exact code', 'items', 'C424242'),
+    ('no match', 'items', 'zeppelin'),
+    ('request note', 'requests', 'slab pour'),
+)
+
+def seed(items, requests):
+    with app.app_context():
+        init_db()
+        db.session.add(ProjectSite(name=SITE))
+        db.session.add(AccessCode(code_type='project_site', project_site=SITE,
+                                  code_hash=generate_password_hash('bench'), display_code='bench'))
+        db.session.commit()
+        # The FTS5 triggers index every row as it is inserted, as in production
+        for start in range(0, items, CHUNK):
+            db.session.execute(db.insert(Item), [dict(
+                name=f'{FINISHES[n // len(MATERIALS) % len(FINISHES)]} {MATERIALS[n % len(MATERIALS)]} {n}'.title(),
+                code=f'C{n}', qty=1 + n % 40, unit_cost=5 + n % 13, category='materials',
+                budget=f'Budget {1 + n % 20} - Flats(General Materials)', section=SECTIONS[n % len(SECTIONS)],
+                grp='Materials', building_type='Flats', project_site=SITE
+            ) for n in range(start, min(start + CHUNK, items))])
+            db.session.commit()
+        for start in range(0, requests, CHUNK):
+            db.session.execute(db.insert(Request), [dict(
+                section='materials', item_id=1 + n % items, qty=1, requested_by=f'Foreman {n % 30}',
+                note=NOTES[n % len(NOTES)], status='Approved', project_site=SITE, building_type='Flats'
+            ) for n in range(start, min(start + CHUNK, requests))])
+            db.session.commit()
+
+def ilike_statement(table, terms, where=(), limit=20):
+    """Every term as a substring of one of the indexed columns, the way lookups worked without the index"""
+    model = SEARCH_INDEXES[table]['model']
+    columns = [getattr(model, column) for column in SEARCH_INDEXES[table]['columns']]
+    matches = [db.or_(*(column.ilike(f'%{term}%') for column in columns)) for term in terms]
+    return db.select(model).where(*matches, *where).order_by(model.id).limit(limit)
+
+def median_ms(fn, repeat):
+    fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=1000000)
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.items, args.requests)
+    print(f'seeded {args.items} items and {args.requests} requests in {time.perf_counter() - started:.0f} s')
+    client = app.test_client()
+    client.post('/login', data={'access_code': 'bench'})
+
+    print(f'{"query":30} {"rows":>8} {"ILIKE ms":>10} {"FTS5 ms":>10} {"/api/search ms":>15}')
+    with app.app_context():
+        for label, table, text in QUERIES:
+            terms = search_terms(text)
+            model = SEARCH_INDEXES[table]['model']
+            where = [model.project_site == SITE]
+            rows = db.session.execute(db.select(db.func.count()).select_from(
+                ilike_statement(table, terms, where, limit=None).subquery()
+            )).scalar()
+            ilike = median_ms(lambda: db.session.execute(ilike_statement(table, terms, where)).all(), args.repeat)
+            fts = median_ms(lambda: db.session.execute(search_statement(table, terms, where)).all(), args.repeat)
+            api = median_ms(lambda: client.get(f'/api/search?type={table}&q={text}'), args.repeat)
+            print(f'{label + " (" + text + ")":30} {rows:8} {ilike:10.1f} {fts:10.1f} {api:15.1f}')
+
+if __name__ == '__main__':
+    main()
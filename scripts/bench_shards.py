@@ -0,0 +1,111 @@
+"""Per-request shard routing cost and cross-site fan-out time with many sharded project sites
+
+Usage: python scripts/bench_shards.py [--sites 100] [--items 200] [--repeat 20]
+
+Runs the app in-process with SHARDING_ENABLED=1 against a throwaway SQLite main database and
+one shard file per site (all in a temp directory), each site seeded with --items items and
+as many requests. Prints median times of:
+
+- shard routing: select_shard() with the site name -> id map cached, and with the cache
+  dropped before every call (one lookup query per request, as without the map)
+- GET /api/session_info as a site admin, the smallest routed request, both ways
+- fan_out() of a no-op over every site, and compute_site_overview() (the Site Overview before
+  it is cached), with 1 worker and with SHARD_FAN_OUT_WORKERS
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench_shards_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['SHARDING_ENABLED'] = '1'
+os.environ['SHARD_DIR'] = os.path.join(WORK_DIR, 'shards')
+os.environ['LOGIN_THROTTLE_ENABLED'] = '0'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import session
+from werkzeug.security import generate_password_hash
+from app import app
+from cache import cache
+from database import db, init_db
+from models import Item, Request, ProjectSite, AccessCode
+from routes import compute_site_overview
+from shard import shards, SHARD_SITES_CACHE_KEY
+
+def seed(sites, items):
+    with app.app_context():
+        init_db()
+        names = [f'Site {n:03}' for n in range(sites)]
+        for name in names:
+            site = ProjectSite(name=name)
+            db.session.add(site)
+            db.session.commit()
+            shards.provision(site.id)
+        # The benchmarked site admin logs in to the last site, so its lookup is not the first row
+        db.session.add(AccessCode(code_type='project_site', project_site=names[-1],
+                                  code_hash=generate_password_hash('bench'), display_code='bench'))
+        db.session.commit()
+        for name in names:
+            with shards.use_site(name):
+                db.session.execute(db.insert(Item), [dict(
+                    name=f'Item {n}', qty=1 + n % 40, unit_cost=5 + n % 13, category='materials',
+                    budget='Budget 1 - Flats', building_type='Flats', project_site=name
+                ) for n in range(items)])
+                db.session.execute(db.insert(Request), [dict(
+                    section='materials', item_id=1 + n, qty=1, requested_by='bench', note='bench',
+                    status=('Pending', 'Approved', 'Rejected')[n % 3], project_site=name
+                ) for n in range(items)])
+                db.session.commit()
+        return names
+
+def median_ms(fn, repeat, before=None):
+    fn()
+    timings = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+def drop_site_map():
+    cache.delete(SHARD_SITES_CACHE_KEY)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sites', type=int, default=100)
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    names = seed(args.sites, args.items)
+    print(f'{args.sites} sites, {args.items} items and requests each; median of {args.repeat}')
+
+    with app.test_request_context('/api/session_info'):
+        session['project_site'] = names[-1]
+        cached = median_ms(shards.select_shard, args.repeat * 10)
+        uncached = median_ms(shards.select_shard, args.repeat * 10, before=drop_site_map)
+    print(f'  select_shard: {cached:.3f} ms cached map, {uncached:.3f} ms with a lookup query')
+
+    client = app.test_client()
+    client.post('/login', data={'access_code': 'bench'})
+    cached = median_ms(lambda: client.get('/api/session_info'), args.repeat)
+    uncached = median_ms(lambda: client.get('/api/session_info'), args.repeat, before=drop_site_map)
+    print(f'  GET /api/session_info: {cached:.2f} ms cached map, {uncached:.2f} ms with a lookup query')
+
+    workers = app.config['SHARD_FAN_OUT_WORKERS']
+    with app.app_context():
+        for count in (1, workers):
+            app.config['SHARD_FAN_OUT_WORKERS'] = count
+            no_op = median_ms(lambda: shards.fan_out(lambda site: None), args.repeat)
+            overview = median_ms(compute_site_overview, args.repeat)
+            print(f'  {count} fan-out worker(s): fan_out no-op {no_op:.1f} ms, compute_site_overview {overview:.1f} ms')
+        app.config['SHARD_FAN_OUT_WORKERS'] = workers
+
+if __name__ == '__main__':
+    main()
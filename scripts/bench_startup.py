@@ -0,0 +1,126 @@
+"""Startup time and first-request latency with and without warm-up and preload
+
+Usage: python scripts/bench_startup.py [--items 2000] [--repeat 3]
+
+Every scenario runs in a fresh Python process against a throwaway SQLite file, with an empty
+template bytecode cache (a fresh deploy), and reports the median over --repeat runs:
+
+- import: `import app`, which is all a CLI command such as `flask bootstrap` pays
+- cold: import, then the first requests of a process nobody warmed up
+- warm: import and warm_up(prime_caches=True), as the gunicorn master does in when_ready
+- fork (no preload): the app is imported in a parent that is then forked without warm-up
+- fork (preload): the parent warms up before forking, like gunicorn with preload_app; the
+  child drops the inherited connections as post_fork does
+
+The first requests are GET /login (the first page render), then /inventory twice as a
+logged-in site admin.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('import', 'cold', 'warm', 'fork (no preload)', 'fork (preload)')
+
+def run_scenario(scenario):
+    """Runs in the child process; prints the timings (ms) as JSON"""
+    timings = {}
+    started = time.perf_counter()
+    import app as app_module
+    timings['import'] = (time.perf_counter() - started) * 1000
+    if scenario == 'import':
+        return timings
+
+    def first_requests():
+        client = app_module.app.test_client()
+        for label, url in (('first /login', '/login'), ('first /inventory', '/inventory'),
+                           ('second /inventory', '/inventory')):
+            if label == 'first /inventory':
+                client.post('/login', data={'access_code': 'bench'})
+            began = time.perf_counter()
+            response = client.get(url)
+            timings[label] = (time.perf_counter() - began) * 1000
+            assert response.status_code == 200, (url, response.status_code)
+
+    if scenario in ('warm', 'fork (preload)'):
+        began = time.perf_counter()
+        app_module.warm_up(prime_caches=True)
+        timings['warm_up'] = (time.perf_counter() - began) * 1000
+    if scenario.startswith('fork'):
+        reader, writer = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            app_module.dispose_engines(close=False)
+            first_requests()
+            os.write(writer, json.dumps(timings).encode())
+            os._exit(0)
+        os.close(writer)
+        with os.fdopen(reader) as pipe:
+            timings = json.loads(pipe.read())
+        os.waitpid(pid, 0)
+    else:
+        first_requests()
+    return timings
+
+def seed(items):
+    from werkzeug.security import generate_password_hash
+    from app import app
+    from database import db, init_db
+    from models import Item, ProjectSite, AccessCode
+    with app.app_context():
+        init_db()
+        db.session.add(ProjectSite(name='Bench Site'))
+        db.session.add(AccessCode(code_type='project_site', project_site='Bench Site',
+                                  code_hash=generate_password_hash('bench'), display_code='bench'))
+        db.session.execute(db.insert(Item), [dict(
+            name=f'Item {n}', code=f'I{n}', qty=1 + n % 40, unit_cost=5 + n % 13, category='materials',
+            budget=f'Budget {1 + n % 5} - Flats(General Materials)', section='SUBSTRUCTURE (GROUND TO DPC LEVEL)',
+            grp='Materials', building_type='Flats', project_site='Bench Site'
+        ) for n in range(items)])
+        db.session.commit()
+
+def child(work_dir, *arguments):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(work_dir, "bench.db")}',
+               JINJA_BYTECODE_CACHE_DIR=tempfile.mkdtemp(dir=work_dir),
+               LOGIN_THROTTLE_ENABLED='0', SUMMARY_ASYNC='0')
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), *arguments], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return output.strip().splitlines()[-1] if output.strip() else ''
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--seed', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        sys.path.insert(0, ROOT)
+        seed(args.items)
+        return
+    if args.scenario:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(run_scenario(args.scenario)))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    child(work_dir, '--seed', '--items', str(args.items))
+    columns = ('import', 'warm_up', 'first /login', 'first /inventory', 'second /inventory')
+    print(f'median ms of {args.repeat} runs, {args.items} items')
+    print(f'{"":20}' + ''.join(f'{column:>19}' for column in columns))
+    for scenario in SCENARIOS:
+        runs = [json.loads(child(work_dir, '--scenario', scenario)) for _ in range(args.repeat)]
+        cells = []
+        for column in columns:
+            values = [run[column] for run in runs if column in run]
+            cells.append(f'{statistics.median(values):19.1f}' if values else f'{"-":>19}')
+        print(f'{scenario:20}' + ''.join(cells))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Variance matrix on a large site: /api/variance_matrix against the per-budget Actuals pages it replaces
+
+Usage: python scripts/bench_variance.py [--items 200000] [--actuals 100000] [--repeat 5]
+
+Seeds a throwaway SQLite file with one project site holding --items items spread over every
+budget (1-20) x building type x subgroup and --actuals actuals, then times, logged in as the
+site's admin:
+
+- before: the full-project picture as the Actuals tab gives it, one /actuals?budget= page per
+  budget x building type (80 pages), each loaded once
+- compute_variance_matrix(): the two grouped queries and the columnar pass
+- /api/variance_matrix as JSON and as CSV, through the Flask test client
+
+The matrix timings are the median of --repeat runs after one warm-up.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+WORK_DIR = tempfile.mkdtemp(prefix='bench_variance_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['LOGIN_THROTTLE_ENABLED'] = '0'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import session
+from werkzeug.security import generate_password_hash
+from app import app
+from api import compute_variance_matrix
+from database import db, init_db
+from models import Item, Actual, ProjectSite, AccessCode
+from rollups import rebuild_daily_spend, rebuild_spend_totals
+from utils import PROPERTY_TYPES, SUBGROUPS_EXTENDED, determine_group_from_category_and_budget
+from routes import MAX_BUDGET_NUM
+
+SITE = 'Bench Site'
+CHUNK = 50000
+# Every budget x building type x subgroup the budget options offer
+BUDGETS = [f'Budget {number} - {building_type}({subgroup})'
+           for number in range(1, MAX_BUDGET_NUM + 1)
+           for building_type in PROPERTY_TYPES for subgroup in SUBGROUPS_EXTENDED]
+
+def seed(items, actuals):
+    with app.app_context():
+        init_db()
+        db.session.add(ProjectSite(name=SITE))
+        db.session.add(AccessCode(code_type='project_site', project_site=SITE,
+                                  code_hash=generate_password_hash('bench'), display_code='bench'))
+        db.session.commit()
+        for start in range(0, items, CHUNK):
+            rows = []
+            for n in range(start, min(start + CHUNK, items)):
+                budget = BUDGETS[n % len(BUDGETS)]
+                category = 'labour' if '(Labour)' in budget else 'materials'
+                rows.append(dict(
+                    name=f'Item {n}', code=f'I{n}', qty=1 + n % 40, unit_cost=5 + n % 13, category=category,
+                    budget=budget, section='SUBSTRUCTURE (GROUND TO DPC LEVEL)',
+                    grp=determine_group_from_category_and_budget(category, budget),
+                    building_type=budget.split(' - ')[1].split('(')[0], project_site=SITE
+                ))
+            db.session.execute(db.insert(Item), rows)
+            db.session.commit()
+        today = date.today()
+        for start in range(0, actuals, CHUNK):
+            db.session.execute(db.insert(Actual), [dict(
+                item_id=1 + n * 7 % items, actual_qty=1, actual_cost=10 + n % 50,
+                actual_date=today - timedelta(days=n % 365), recorded_by='bench', notes=f'Actual {n}',
+                project_site=SITE
+            ) for n in range(start, min(start + CHUNK, actuals))])
+            db.session.commit()
+        rebuild_daily_spend()
+        rebuild_spend_totals()
+
+def median_ms(fn, repeat):
+    fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+def get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise SystemExit(f'{url}: {response.status_code}')
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--actuals', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.items, args.actuals)
+    print(f'seeded {args.items} items and {args.actuals} actuals in {time.perf_counter() - started:.0f} s')
+    client = app.test_client()
+    client.post('/login', data={'access_code': 'bench'})
+
+    pages = [f'/actuals?budget=Budget {number} - {building_type}'
+             for number in range(1, MAX_BUDGET_NUM + 1) for building_type in PROPERTY_TYPES]
+    get(client, pages[0])
+    started = time.perf_counter()
+    for page in pages:
+        get(client, page)
+    before = (time.perf_counter() - started) * 1000
+    print(f'before: {len(pages)} Actuals pages {before:10.0f} ms ({before / len(pages):.0f} ms per page)')
+
+    with app.test_request_context():
+        # The site's rows, as project_site_clause() selects them for a global admin on this site
+        session.update(is_global_admin=True, project_site=SITE)
+        cells = len(compute_variance_matrix())
+        compute = median_ms(compute_variance_matrix, args.repeat)
+    print(f'compute_variance_matrix()    {compute:10.1f} ms ({cells} cells)')
+    for label, url in (('JSON', '/api/variance_matrix'), ('CSV', '/api/variance_matrix?format=csv')):
+        size = len(get(client, url).data)
+        ms = median_ms(lambda: get(client, url), args.repeat)
+        print(f'/api/variance_matrix {label:4}    {ms:10.1f} ms ({size / 1024:.0f} KB, {before / ms:.0f}x faster)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Concurrent approve/reject and claim race test for the approval queue
+
+Usage: python scripts/race_approvals.py [--threads 8] [--rounds 20] [--database-url URL]
+
+Runs the app in-process (Flask test client), by default against a throwaway SQLite file.
+Pass a PostgreSQL URL to run the claim phase through SELECT ... FOR UPDATE SKIP LOCKED
+(SQLite takes the conditional UPDATE path instead).
+
+Decision rounds: --threads admins, each logged in separately, approve or reject the same
+pending request at once (the review page's approve/reject forms with the version they
+rendered, and the by-id form, mixed). Every admin has loaded the request before any of
+them commits, so the losers go through the conditional UPDATE (status Pending and the
+version). Checked per round: no 500s, exactly one decision wins, the others get an error
+flash, and an approval leaves exactly one Actual, one daily_spend entry and one stock
+issue (a rejection none).
+
+Stale pages: a decided request is decided again the other way, from a page rendered
+before the decision and through the by-id form. Checked: both are refused and the
+request keeps its status, version, Actual, daily_spend entry and stock issue.
+
+Claim phase: the same admins start claiming batches of pending requests at once and
+approve what they claimed, until none are left. Checked: every request is claimed by
+exactly one admin, and no approval of a claimed request fails.
+
+Exits non-zero on the first failed check.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+parser.add_argument('--threads', type=int, default=8)
+parser.add_argument('--rounds', type=int, default=20)
+parser.add_argument('--database-url', help='default: a new SQLite file')
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(tempfile.mkdtemp(prefix="race_"), "race.db")}'
+os.environ['LOGIN_THROTTLE_ENABLED'] = '0'
+os.environ['SUMMARY_ASYNC'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routes
+from app import app
+from database import db, init_db
+from models import Item, Request, Actual, DailySpend, StockMovement, ProjectSite
+
+SITE = 'Race Site'
+# Decisions each admin makes, by thread number: the four ways of deciding a request
+DECISIONS = (
+    ('page', '/approve_request/{id}', None),
+    ('page', '/reject_request/{id}', None),
+    ('post', '/approve_reject_by_id', 'approve'),
+    ('post', '/approve_reject_by_id', 'reject'),
+)
+STALE_MESSAGE = 'was changed by another admin'
+
+def fail(message):
+    print(f'FAILED: {message}')
+    sys.exit(1)
+
+def seed():
+    with app.app_context():
+        init_db()
+        if ProjectSite.query.filter_by(name=SITE).first() is None:
+            db.session.add(ProjectSite(name=SITE))
+            db.session.add(Item(name='Race cement', code='RACE', qty=1000, unit_cost=10, category='materials',
+                                budget='Budget 1 - Flats(General Materials)', section='SUBSTRUCTURE (GROUND TO DPC LEVEL)',
+                                grp='Materials', building_type='Flats', project_site=SITE))
+            db.session.commit()
+        return Item.query.filter_by(code='RACE').one().id
+
+def add_requests(item_id, count):
+    with app.app_context():
+        reqs = [Request(section='materials', item_id=item_id, qty=1, requested_by='race', note='race',
+                        status='Pending', project_site=SITE, building_type='Flats') for _ in range(count)]
+        db.session.add_all(reqs)
+        db.session.commit()
+        return [req.id for req in reqs]
+
+def counts(request_id):
+    with app.app_context():
+        return (
+            Actual.query.filter_by(notes=f'Request #{request_id}').count(),
+            db.session.query(db.func.coalesce(db.func.sum(DailySpend.entries), 0)).filter(
+                DailySpend.project_site == SITE).scalar(),
+            StockMovement.query.filter_by(request_id=request_id, kind='issue').count(),
+        )
+
+def take_flashes(client):
+    with client.session_transaction() as sess:
+        return sess.pop('_flashes', [])
+
+def admin_clients(count):
+    clients = []
+    for _ in range(count):
+        client = app.test_client()
+        if client.post('/login', data={'access_code': 'admin123'}).status_code != 302:
+            fail('admin login failed')
+        clients.append(client)
+    return clients
+
+def run_threads(clients, target):
+    results = [None] * len(clients)
+    def run(n):
+        results[n] = target(n, clients[n])
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(len(clients))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def decision_round(clients, item_id, arrived):
+    request_id = add_requests(item_id, 1)[0]
+    before = counts(request_id)
+
+    def decide(n, client):
+        method, path, action = DECISIONS[n % len(DECISIONS)]
+        if method == 'page':
+            # The version a review page rendered for a new request
+            response = client.post(path.format(id=request_id), data={'version': 1})
+        else:
+            response = client.post(path, data={'request_id': request_id, 'action': action})
+        return action or path.split('_')[0].strip('/'), response.status_code, take_flashes(client)
+
+    arrived.reset()
+    results = run_threads(clients, decide)
+    statuses = Counter(status for _, status, _ in results)
+    if set(statuses) != {302}:
+        fail(f'request #{request_id}: responses {dict(statuses)}')
+    winners = [(action, flashes) for action, _, flashes in results if not any(c == 'error' for c, _ in flashes)]
+    losers = [message for _, _, flashes in results for category, message in flashes if category == 'error']
+    if len(winners) != 1 or len(losers) != len(clients) - 1:
+        fail(f'request #{request_id}: {len(winners)} winning decisions, flashes {[r[2] for r in results]}')
+
+    with app.app_context():
+        status = db.session.get(Request, request_id).status
+    expected = (1, 1, 1) if winners[0][0] == 'approve' else (0, 0, 0)
+    added = tuple(after - was for after, was in zip(counts(request_id), before))
+    if not status.lower().startswith(winners[0][0][:5]) or added != expected:
+        fail(f'request #{request_id}: {status} after {winners[0][0]}, added (actuals, daily spend entries, issues) {added}')
+    return winners[0][0], Counter('stale' if STALE_MESSAGE in m else 'already decided' for m in losers)
+
+def stale_page_check(client, item_id):
+    """Decide each request once, then again the other way from a stale page and by id"""
+    for first, second in (('approve', 'reject'), ('reject', 'approve')):
+        request_id = add_requests(item_id, 1)[0]
+        before = counts(request_id)
+        client.post(f'/{first}_request/{request_id}', data={'version': 1})
+        take_flashes(client)
+        with app.app_context():
+            decided = db.session.get(Request, request_id)
+            decided = (decided.status, decided.version, counts(request_id))
+        for path, data in ((f'/{second}_request/{request_id}', {'version': 1}),
+                           ('/approve_reject_by_id', {'request_id': request_id, 'action': second})):
+            response = client.post(path, data=data)
+            errors = [message for category, message in take_flashes(client) if category == 'error']
+            with app.app_context():
+                after = db.session.get(Request, request_id)
+                after = (after.status, after.version, counts(request_id))
+            if response.status_code != 302 or not errors or after != decided:
+                fail(f'request #{request_id} {first}d then {second}ed: {response.status_code} {errors}, '
+                     f'{decided} -> {after} (before {before})')
+
+def claim_phase(clients, item_id):
+    request_ids = set(add_requests(item_id, len(clients) * routes.APPROVAL_CLAIM_BATCH * 2))
+    claimed = Counter()
+    barrier = threading.Barrier(len(clients))
+
+    def claim(n, client):
+        mine = []
+        barrier.wait()
+        while True:
+            response = client.post('/claim_requests')
+            if response.status_code != 302:
+                return mine, response.status_code
+            messages = ' '.join(message for _, message in take_flashes(client))
+            ids = [int(i) for i in re.findall(r'#(\d+)', messages)]
+            if not ids:
+                return mine, 302
+            mine += ids
+            # Work through the batch, as an admin would; claimed requests are never contested
+            for request_id in ids:
+                response = client.get(f'/approve_request/{request_id}')
+                errors = [message for category, message in take_flashes(client) if category == 'error']
+                if response.status_code != 302 or errors:
+                    return mine, f'{response.status_code} {errors} approving #{request_id}'
+
+    results = run_threads(clients, claim)
+    for ids, status in results:
+        if status != 302:
+            fail(f'claim phase: {status}')
+        claimed.update(ids)
+    twice = [request_id for request_id, times in claimed.items() if times > 1]
+    if twice or set(claimed) != request_ids:
+        fail(f'claimed twice: {twice[:10]}, unclaimed: {sorted(request_ids - set(claimed))[:10]}')
+    return len(request_ids), [len(ids) for ids, _ in results]
+
+def main():
+    item_id = seed()
+    clients = admin_clients(args.threads)
+
+    # Hold every admin until all of them have loaded the request, so the decisions really race
+    arrived = threading.Barrier(args.threads, timeout=30)
+    decide_request = routes.decide_request
+    def racing_decide_request(*args):
+        arrived.wait()
+        return decide_request(*args)
+    routes.decide_request = racing_decide_request
+
+    outcomes, losses = Counter(), Counter()
+    for _ in range(args.rounds):
+        outcome, lost = decision_round(clients, item_id, arrived)
+        outcomes[outcome] += 1
+        losses.update(lost)
+    routes.decide_request = decide_request
+    if not losses['stale']:
+        fail('no decision lost on the version check; the race did not happen')
+    print(f'{args.rounds} rounds x {args.threads} admins: winners {dict(outcomes)}, '
+          f'losers {dict(losses)} (all 302 + error flash, one Actual/daily spend entry/issue per approval)')
+
+    stale_page_check(clients[0], item_id)
+    print('stale page and by-id decisions of decided requests refused, nothing changed')
+
+    total, per_admin = claim_phase(clients, item_id)
+    with app.app_context():
+        path = 'FOR UPDATE SKIP LOCKED' if db.engine.dialect.name == 'postgresql' else 'conditional UPDATE'
+    print(f'claims ({path}): {total} requests claimed exactly once, per admin {per_admin}')
+    print('OK')
+
+if __name__ == '__main__':
+    main()
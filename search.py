@@ -0,0 +1,86 @@
+"""Full-text search over items and requests (SQLite FTS5 or Postgres tsvector/GIN)"""
+import re
+from database import db
+from models import Item, Request
+
+# Indexed text per table: FTS5 virtual table columns / tsvector inputs
+SEARCH_INDEXES = {
+    'items': {'model': Item, 'columns': ('name', 'code', 'section', 'budget')},
+    'requests': {'model': Request, 'columns': ('note', 'requested_by')},
+}
+
+# Search terms beyond this are ignored (each one is a prefix lookup in the index)
+MAX_SEARCH_TERMS = 8
+
+def ensure_search_index(engine=None):
+    """Create the full-text index for each searchable table and keep it in sync on write"""
+    engine = engine or db.engine
+    for table, spec in SEARCH_INDEXES.items():
+        if engine.dialect.name == 'postgresql':
+            _ensure_tsvector(engine, table, spec['columns'])
+        elif engine.dialect.name == 'sqlite':
+            _ensure_fts5(engine, table, spec['columns'])
+
+def _ensure_fts5(engine, table, columns):
+    """External-content FTS5 table plus triggers; built from existing rows the first time"""
+    fts = f'{table}_fts'
+    cols = ', '.join(columns)
+    new_values = ', '.join(f'new.{c}' for c in columns)
+    old_values = ', '.join(f'old.{c}' for c in columns)
+    with engine.begin() as conn:
+        exists = conn.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+        ), {'name': fts}).first()
+        if exists:
+            return
+        conn.execute(db.text(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', content_rowid='id')"
+        ))
+        conn.execute(db.text(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+        ))
+        conn.execute(db.text(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); END"
+        ))
+        # Only changes to indexed columns touch the index (qty/status updates do not)
+        conn.execute(db.text(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+        ))
+        conn.execute(db.text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+def _ensure_tsvector(engine, table, columns):
+    """Generated tsvector column (maintained by Postgres on every write) with a GIN index"""
+    document = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+    with engine.begin() as conn:
+        conn.execute(db.text(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED"
+        ))
+        conn.execute(db.text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING GIN (search_vector)"
+        ))
+
+def search_terms(text):
+    """Words of a search string, lowercased (punctuation and query syntax are dropped)"""
+    return re.findall(r'\w+', text.lower())[:MAX_SEARCH_TERMS]
+
+def search_statement(table, terms, where=(), limit=20):
+    """Select (model, rank) rows matching every term as a word prefix, best match first"""
+    model = SEARCH_INDEXES[table]['model']
+    if db.engine.dialect.name == 'postgresql':
+        vector = db.literal_column(f'{table}.search_vector')
+        query = db.func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        rank = db.func.ts_rank(vector, query)
+        stmt = db.select(model, rank.label('rank')).where(vector.op('@@')(query)).order_by(rank.desc())
+    else:
+        fts = db.table(f'{table}_fts', db.column('rowid'), db.column('rank'))
+        query = ' '.join(f'"{term}"*' for term in terms)
+        # FTS5 rank is bm25(): lower is better
+        stmt = db.select(model, (-fts.c.rank).label('rank')).join(
+            fts, fts.c.rowid == model.id
+        ).where(db.literal_column(f'{table}_fts').op('MATCH')(query)).order_by(fts.c.rank)
+    return stmt.where(*where).limit(limit)
@@ -0,0 +1,283 @@
+"""Optional per-site sharding: each project site's rows live in their own SQLite file or Postgres schema"""
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, request, session, current_app
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from database import db, SHARDED_TABLES
+from cache import cache
+
+# Rows copied per statement when moving a site's existing rows into its shard
+SHARD_MIGRATION_BATCH_SIZE = 1000
+
+# Site name -> id map every request is routed by (cached, see cache.py)
+SHARD_SITES_CACHE_KEY = 'shard_sites'
+
+class ShardMigrationError(Exception):
+    """A site's rows could not be moved into its shard (nothing was deleted from the main database)"""
+
+class ShardRouter:
+    """Points RoutingSession at the current project site's shard while SHARDING_ENABLED is set
+
+    Shards are keyed by ProjectSite.id, so renaming a site keeps its data. Global tables (sites,
+    access codes, access logs) stay in the primary database, as does per-site data read or written
+    while no project site is selected (global admins on "All Sites").
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._engines = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SHARDING_ENABLED', os.environ.get('SHARDING_ENABLED', '0') == '1')
+        # SQLite: one database file per site in this directory (Postgres uses a schema per site)
+        app.config.setdefault('SHARD_DIR', os.environ.get('SHARD_DIR', os.path.join(app.instance_path, 'shards')))
+        # Parallel queries when a view fans out across every site
+        app.config.setdefault('SHARD_FAN_OUT_WORKERS', int(os.environ.get('SHARD_FAN_OUT_WORKERS', 8)))
+        # Seconds other workers may keep routing a renamed or deleted site's old name to its shard
+        app.config.setdefault('SHARD_SITES_TTL', float(os.environ.get('SHARD_SITES_TTL', 10)))
+        app.before_request(self.select_shard)
+        self.app = app
+
+    @property
+    def enabled(self):
+        return self.app.config['SHARDING_ENABLED']
+
+    def select_shard(self):
+        """Route this request's sharded tables to the session's project site"""
+        if not self.enabled or request.endpoint in ('static', 'hashed_asset'):
+            return
+        if session.get('is_global_admin'):
+            site = session.get('project_site')
+        else:
+            site = session.get('assigned_project_site') or session.get('project_site')
+        if site:
+            site_id = self.site_id(site)
+            if site_id is not None:
+                g.shard_engine = self.engine(site_id)
+
+    def site_ids(self):
+        """Name -> id of every project site, cached for SHARD_SITES_TTL seconds"""
+        from models import ProjectSite
+        return cache.get_or_set(SHARD_SITES_CACHE_KEY, lambda: dict(
+            db.session.execute(db.select(ProjectSite.name, ProjectSite.id)).tuples().all()
+        ), ttl=self.app.config['SHARD_SITES_TTL'])
+
+    def site_id(self, site):
+        """Id of the project site named site (None if there is none)"""
+        site_id = self.site_ids().get(site)
+        if site_id is None:
+            # Created or renamed by another worker since this one cached the map
+            cache.delete(SHARD_SITES_CACHE_KEY)
+            site_id = self.site_ids().get(site)
+        return site_id
+
+    def schema(self, site_id):
+        return f'site_{int(site_id)}'
+
+    def engine(self, site_id):
+        """Engine for a site's shard, provisioned the first time this process uses it"""
+        with self._lock:
+            engine = self._engines.get(site_id)
+            if engine is None:
+                url = db.engine.url
+                if url.get_backend_name() == 'postgresql':
+                    # Unqualified table names resolve to the site's schema, so ORM and raw SQL both work
+                    engine = create_engine(
+                        url, pool_pre_ping=True, pool_size=2, max_overflow=3,
+                        connect_args={'options': f'-csearch_path={self.schema(site_id)},public'}
+                    )
+                else:
+                    os.makedirs(self.app.config['SHARD_DIR'], exist_ok=True)
+                    # No pooled connections, so a file dropped by another worker is never kept open
+                    engine = create_engine(f'sqlite:///{self._path(site_id)}', poolclass=NullPool)
+                self._provision(engine, site_id)
+                self._engines[site_id] = engine
+            return engine
+
+    def _path(self, site_id):
+        return os.path.join(self.app.config['SHARD_DIR'], f'{self.schema(site_id)}.db')
+
+    def provision(self, site_id):
+        """Create a site's shard with every sharded table, index and search index (idempotent)"""
+        with self._lock:
+            engine = self._engines.get(site_id)
+        if engine is None:
+            self.engine(site_id)
+        else:
+            self._provision(engine, site_id)
+
+    def _provision(self, engine, site_id):
+        from search import ensure_search_index
+        tables = [db.metadata.tables[name] for name in SHARDED_TABLES]
+        if engine.dialect.name == 'postgresql':
+            schema = self.schema(site_id)
+            with engine.begin() as conn:
+                conn.execute(db.text(f'CREATE SCHEMA IF NOT EXISTS {schema}'))
+                # Schema-qualified DDL and existence checks: with search_path=site_N,public an
+                # unqualified check finds public.items and would never create the site's tables
+                db.metadata.create_all(conn.execution_options(schema_translate_map={None: schema}), tables=tables)
+        else:
+            db.metadata.create_all(engine, tables=tables)
+        ensure_search_index(engine)
+
+    def drop(self, site_id):
+        """Remove a site's shard and all of its rows at once (file unlink or DROP SCHEMA)"""
+        with self._lock:
+            engine = self._engines.pop(site_id, None)
+        cache.delete(SHARD_SITES_CACHE_KEY)
+        if engine is not None:
+            engine.dispose()
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.begin() as conn:
+                conn.execute(db.text(f'DROP SCHEMA IF EXISTS {self.schema(site_id)} CASCADE'))
+        else:
+            path = self._path(site_id)
+            for name in (path, path + '-wal', path + '-shm', path + '-journal'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def _site_rows(self, site):
+        """(table, condition) of a site's sharded rows in the main database, parents first"""
+        from models import (
+            Item, Request, Notification, Actual, DailySpend, BuildingTypeConfig, StockMovement,
+            ItemBalance, StockSnapshot, SpendTotal, ChangeEvent, AccessCode
+        )
+        site_items = db.select(Item.__table__.c.id).where(Item.project_site == site)
+        site_requests = db.select(Request.__table__.c.id).where(Request.project_site == site)
+        site_codes = db.select(AccessCode.id).where(AccessCode.project_site == site)
+        return [
+            (Item.__table__, Item.project_site == site),
+            (Request.__table__, Request.project_site == site),
+            (Actual.__table__, Actual.project_site == site),
+            (Notification.__table__, db.or_(Notification.request_id.in_(site_requests),
+                                            Notification.user_id.in_(site_codes))),
+            (StockMovement.__table__, StockMovement.project_site == site),
+            (ItemBalance.__table__, ItemBalance.item_id.in_(site_items)),
+            (StockSnapshot.__table__, StockSnapshot.item_id.in_(site_items)),
+            (DailySpend.__table__, DailySpend.project_site == site),
+            (SpendTotal.__table__, SpendTotal.project_site == site),
+            (BuildingTypeConfig.__table__, BuildingTypeConfig.project_site == site),
+            (ChangeEvent.__table__, db.or_(ChangeEvent.project_site == site, ChangeEvent.recipient_id.in_(site_codes))),
+        ]
+
+    def migrate_primary_rows(self, batch_size=SHARD_MIGRATION_BATCH_SIZE):
+        """Move the rows each site left in the main database before sharding was turned on into its shard
+
+        Rows keep their ids. Every table is copied before anything is deleted, and a row already in
+        the shard with the same values is skipped, so an interrupted run can simply be repeated.
+        A different row holding the same id in the shard stops the site's move. Returns rows moved per site.
+        """
+        from models import ProjectSite
+        sites = db.session.execute(db.select(ProjectSite.id, ProjectSite.name).order_by(ProjectSite.name)).all()
+        db.session.commit()
+        moved = {}
+        for site in sites:
+            plan = self._site_rows(site.name)
+            engine = self.engine(site.id)
+            copied = {}
+            for table, condition in plan:
+                copied[table.name] = self._copy_rows(engine, site.name, table, condition, batch_size)
+            if not any(copied.values()):
+                continue
+            # Children before parents, and only up to the last id copied
+            with db.engine.begin() as conn:
+                for table, condition in reversed(plan):
+                    if copied[table.name]:
+                        conn.execute(db.delete(table).where(condition, table.c.id <= copied[table.name][1]))
+            moved[site.name] = sum(entry[0] for entry in copied.values() if entry)
+        return moved
+
+    def _copy_rows(self, engine, site, table, condition, batch_size):
+        """Copy matching main database rows into a shard; returns (rows copied, last id) or None"""
+        last_id = 0
+        count = 0
+        while True:
+            with db.engine.connect() as source:
+                rows = [dict(row) for row in source.execute(
+                    db.select(table).where(condition, table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+                ).mappings()]
+            if not rows:
+                break
+            with engine.begin() as target:
+                existing = {row['id']: dict(row) for row in target.execute(
+                    db.select(table).where(table.c.id.in_([row['id'] for row in rows]))
+                ).mappings()}
+                for row in rows:
+                    if row['id'] in existing and existing[row['id']] != row:
+                        raise ShardMigrationError(
+                            f'{table.name} row {row["id"]} of site "{site}" is already used by another row in its shard'
+                        )
+                new_rows = [row for row in rows if row['id'] not in existing]
+                if new_rows:
+                    target.execute(db.insert(table), new_rows)
+            last_id = rows[-1]['id']
+            count += len(rows)
+        if not count:
+            return None
+        if engine.dialect.name == 'postgresql':
+            # Copied ids were set explicitly; move the shard's sequence past them
+            with engine.begin() as target:
+                target.execute(db.text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"(SELECT coalesce(max(id), 1) FROM {table.name}))"
+                ))
+        return count, last_id
+
+    def dispose(self, close=True):
+        """Drop the pooled connections of every shard engine (close=False in a forked child)"""
+        with self._lock:
+            engines = list(self._engines.values())
+        for engine in engines:
+            engine.dispose(close=close)
+
+    @contextmanager
+    def primary(self):
+        """Read and write sharded tables in the primary database inside the block"""
+        engine = g.pop('shard_engine', None)
+        try:
+            yield
+        finally:
+            if engine is not None:
+                g.shard_engine = engine
+
+    @contextmanager
+    def use_site(self, site):
+        """Read and write sharded tables in a site's shard inside the block (outside a request)"""
+        previous = g.pop('shard_engine', None)
+        site_id = None
+        if self.enabled and site:
+            site_id = self.site_id(site)
+        if site_id is not None:
+            g.shard_engine = self.engine(site_id)
+        try:
+            yield
+        finally:
+            g.pop('shard_engine', None)
+            if previous is not None:
+                g.shard_engine = previous
+
+    def fan_out(self, fn):
+        """Call fn(site_name) once per site shard, in parallel, and return the results in site order"""
+        app = current_app._get_current_object()
+        sites = sorted(self.site_ids().items())
+        if not sites:
+            return []
+
+        def run(site):
+            name, site_id = site
+            # Own app context per thread: its own db.session, bound to this site's shard
+            with app.app_context():
+                g.shard_engine = self.engine(site_id)
+                return fn(name)
+
+        workers = min(app.config['SHARD_FAN_OUT_WORKERS'], len(sites))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, sites))
+
+shards = ShardRouter()
@@ -0,0 +1,77 @@
+"""Append-only stock ledger with materialized per-item balances and daily snapshots"""
+from datetime import datetime
+from database import db
+from models import Item, Request, StockMovement, ItemBalance, StockSnapshot, to_decimal
+from rollups import upsert
+
+MOVEMENT_KINDS = ('receipt', 'issue', 'adjustment')
+
+# Totals kept in ItemBalance and StockSnapshot
+STOCK_TOTALS = ('received', 'issued', 'adjusted', 'on_hand')
+
+def record_movement(item, kind, qty, request_id=None, note=None, recorded_by=None, when=None):
+    """Append a movement (qty = signed change in stock on hand) and update the balance and snapshot (caller commits)
+
+    when defaults to now; older timestamps are only valid while replaying history in order.
+    """
+    qty = to_decimal(qty)
+    if kind not in MOVEMENT_KINDS:
+        raise ValueError(f'Unknown stock movement kind: {kind}')
+    if (kind == 'receipt' and qty <= 0) or (kind == 'issue' and qty >= 0) or qty == 0:
+        raise ValueError('Receipts must add stock, issues must remove it, and adjustments cannot be zero')
+    when = when or datetime.utcnow()
+
+    movement = StockMovement(
+        item_id=item.id, kind=kind, qty=qty, request_id=request_id, note=note,
+        recorded_by=recorded_by, project_site=item.project_site, created_at=when
+    )
+    db.session.add(movement)
+    upsert(ItemBalance, {'item_id': item.id}, {
+        'received': qty if kind == 'receipt' else 0,
+        'issued': -qty if kind == 'issue' else 0,
+        'adjusted': qty if kind == 'adjustment' else 0,
+        'on_hand': qty,
+        'movements': 1,
+    }, {'last_movement_at': when})
+
+    # The day's snapshot is the balance after its latest movement (the balance row is locked until commit)
+    totals = db.session.execute(
+        db.select(*[getattr(ItemBalance, name) for name in STOCK_TOTALS]).where(ItemBalance.item_id == item.id)
+    ).one()
+    upsert(StockSnapshot, {'item_id': item.id, 'day': when.date()}, values=dict(totals._mapping))
+    return movement
+
+def record_request_issue(req, recorded_by=None):
+    """Issue the quantity of an approved request from stock (caller commits)"""
+    return record_movement(
+        req.item, 'issue', -to_decimal(req.qty), request_id=req.id,
+        note=f'Request #{req.id}', recorded_by=recorded_by
+    )
+
+def stock_as_of(day, item_id):
+    """Snapshot table and join condition giving each item_id its stock totals at the end of day
+
+    Correlated to item_id (e.g. Item.id): every joined item reads its latest snapshot on or before
+    day with one descending seek on uq_stock_snapshots_item_day, however many snapshots other
+    items and sites have.
+    """
+    snapshot = StockSnapshot.__table__.alias('stock_as_of')
+    latest = db.select(StockSnapshot.id).where(
+        StockSnapshot.item_id == item_id, StockSnapshot.day <= day
+    ).order_by(StockSnapshot.day.desc()).limit(1).scalar_subquery()
+    return snapshot, snapshot.c.id == latest
+
+def backfill_request_issues():
+    """Replay approved requests into an empty ledger as issues, oldest first"""
+    requests = db.session.execute(
+        db.select(Request).join(Item, Item.id == Request.item_id).where(Request.status == 'Approved')
+        .order_by(Request.updated_at, Request.id)
+    ).scalars().all()
+    for req in requests:
+        if to_decimal(req.qty) <= 0:
+            continue
+        record_movement(
+            req.item, 'issue', -to_decimal(req.qty), request_id=req.id, note=f'Request #{req.id}',
+            recorded_by=req.approved_by, when=req.updated_at or req.created_at
+        )
+    db.session.commit()
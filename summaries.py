@@ -0,0 +1,130 @@
+"""Write-behind site summaries: writes mark a site dirty, a background thread recomputes its summaries"""
+import os
+import threading
+import time
+from shard import shards
+
+class SiteSummaries:
+    """Per-process cache of per-site summaries (budget totals, actual totals) refreshed off the request path
+
+    Writes call mark_dirty(site) after committing. Once a site has had no writes for
+    SUMMARY_DEBOUNCE_SECONDS (or has been dirty for half of SUMMARY_MAX_STALENESS, so a steady
+    stream of writes cannot starve it), the thread recomputes the summaries that have been used for
+    that site. Pages keep being served the previous value meanwhile, and never one older than
+    SUMMARY_MAX_STALENESS seconds: past that, get() recomputes synchronously. The same bound
+    covers writes made in other gunicorn workers, which this process does not see.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._compute = {}
+        self._entries = {}   # (kind, site) -> (computed at, value)
+        self._dirty = {}     # site -> (first write, last write) not yet reflected in the entries
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SUMMARY_ASYNC', os.environ.get('SUMMARY_ASYNC', '1') != '0')
+        app.config.setdefault('SUMMARY_DEBOUNCE_SECONDS', float(os.environ.get('SUMMARY_DEBOUNCE_SECONDS', 2.0)))
+        app.config.setdefault('SUMMARY_MAX_STALENESS', float(os.environ.get('SUMMARY_MAX_STALENESS', 60.0)))
+        self.app = app
+
+    def register(self, kind, compute):
+        """compute(site) builds the summary of a site (None = every site) from plain values only"""
+        self._compute[kind] = compute
+
+    def get(self, kind, site):
+        """The cached summary if it is fresh enough, else computed now (in the request's database/shard)"""
+        now = time.monotonic()
+        max_staleness = self.app.config['SUMMARY_MAX_STALENESS']
+        with self._lock:
+            entry = self._entries.get((kind, site))
+            dirty = self._dirty.get(site)
+        if entry is not None and now - entry[0] <= max_staleness and (
+            # Not dirty, computed after the last write, or dirty for less than the bound
+            dirty is None or entry[0] >= dirty[1] or now - dirty[0] <= max_staleness
+        ):
+            return entry[1]
+
+        # Synchronous fallback: no summary yet, or the background refresh is late
+        value = self._compute[kind](site)
+        with self._lock:
+            self._entries[(kind, site)] = (now, value)
+        return value
+
+    def mark_dirty(self, site):
+        """Queue a refresh of a site's summaries (and the all-sites ones) after a committed write
+
+        site is the written rows' project site ('' for rows without one), or None when the write
+        may have touched every site.
+        """
+        with self._lock:
+            sites = {site, None} if site is not None else {entry_site for _, entry_site in self._entries} | {None}
+            if not self.app.config['SUMMARY_ASYNC']:
+                # Recomputed by the next page view instead
+                for key in [key for key in self._entries if key[1] in sites]:
+                    del self._entries[key]
+                return
+            now = time.monotonic()
+            for key in sites:
+                first, _ = self._dirty.get(key, (now, now))
+                self._dirty[key] = (first, now)
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each gunicorn worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='site-summaries', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['SUMMARY_DEBOUNCE_SECONDS'] / 2)
+            for site in self._settled():
+                self.refresh(site)
+
+    def _settled(self):
+        """Dirty sites whose writes have settled (or that have waited long enough)"""
+        now = time.monotonic()
+        debounce = self.app.config['SUMMARY_DEBOUNCE_SECONDS']
+        max_staleness = self.app.config['SUMMARY_MAX_STALENESS']
+        with self._lock:
+            return [
+                site for site, (first, last) in self._dirty.items()
+                if now - last >= debounce or now - first >= max_staleness / 2
+            ]
+
+    def refresh(self, site):
+        """Recompute the summaries already used for a site, then clear its dirty mark if no write came in meanwhile"""
+        started = time.monotonic()
+        with self._lock:
+            kinds = [kind for kind, entry_site in self._entries if entry_site == site]
+            marked = self._dirty.get(site)
+        values = {}
+        try:
+            with self.app.app_context():
+                with shards.use_site(site):
+                    for kind in kinds:
+                        values[kind] = self._compute[kind](site)
+        except Exception as e:
+            # Dropped entries are recomputed synchronously by the next page view
+            self.app.logger.warning(f'Site summary refresh failed for {site or "all sites"}: {e}')
+            values = {}
+            with self._lock:
+                for kind in kinds:
+                    self._entries.pop((kind, site), None)
+        with self._lock:
+            for kind, value in values.items():
+                self._entries[(kind, site)] = (started, value)
+            if self._dirty.get(site) == marked:
+                self._dirty.pop(site, None)
+
+summaries = SiteSummaries()
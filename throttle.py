@@ -0,0 +1,142 @@
+"""Token-bucket login throttle shared by all workers on a host through a local SQLite file"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# Signed cookie given to browsers after a successful login
+TRUSTED_COOKIE = 'login_trusted'
+
+class LoginThrottle:
+    """Per-IP attempt limit plus a global cap on password hash verifications per second
+
+    Bucket state lives in a small SQLite file (LOGIN_THROTTLE_DB) so every gunicorn worker on
+    the machine draws from the same buckets. Each check is one short IMMEDIATE transaction.
+
+    The hash budget is split in two: LOGIN_TRUSTED_HASH_SHARE of it is reserved for browsers
+    that have logged in successfully before (TRUSTED_COOKIE), the rest is shared by everyone.
+    A distributed guessing attack can drain the shared part, but not lock out known users.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_THROTTLE_ENABLED', os.environ.get('LOGIN_THROTTLE_ENABLED', '1') != '0')
+        app.config.setdefault('LOGIN_THROTTLE_DB', os.environ.get(
+            'LOGIN_THROTTLE_DB', os.path.join(app.instance_path, 'login_throttle.db')))
+        # Global budget of check_password_hash calls (all IPs together)
+        app.config.setdefault('LOGIN_MAX_HASHES_PER_SECOND', float(os.environ.get('LOGIN_MAX_HASHES_PER_SECOND', 20)))
+        # Part of that budget only browsers with a trusted-login cookie may use, and how long the cookie lasts
+        app.config.setdefault('LOGIN_TRUSTED_HASH_SHARE', float(os.environ.get('LOGIN_TRUSTED_HASH_SHARE', 0.5)))
+        app.config.setdefault('LOGIN_TRUSTED_DAYS', int(os.environ.get('LOGIN_TRUSTED_DAYS', 30)))
+        # Per-IP attempts: sustained rate and burst
+        app.config.setdefault('LOGIN_IP_ATTEMPTS_PER_MINUTE', float(os.environ.get('LOGIN_IP_ATTEMPTS_PER_MINUTE', 10)))
+        app.config.setdefault('LOGIN_IP_BURST', float(os.environ.get('LOGIN_IP_BURST', 5)))
+        # Number of reverse proxies in front of the app (1 on Render) for X-Forwarded-For
+        app.config.setdefault('LOGIN_THROTTLE_PROXY_HOPS', int(os.environ.get('LOGIN_THROTTLE_PROXY_HOPS', 0)))
+        self.app = app
+
+    def client_ip(self, request):
+        """Client address as seen by the nearest trusted proxy"""
+        hops = self.app.config['LOGIN_THROTTLE_PROXY_HOPS']
+        if hops and request.access_route:
+            route = request.access_route
+            return route[max(len(route) - hops, 0)]
+        return request.remote_addr or 'unknown'
+
+    def _serializer(self):
+        return URLSafeTimedSerializer(self.app.secret_key, salt='login-trusted')
+
+    def is_trusted(self, request):
+        """Whether the request carries a valid trusted-login cookie"""
+        token = request.cookies.get(TRUSTED_COOKIE)
+        if not token:
+            return False
+        try:
+            self._serializer().loads(token, max_age=self.app.config['LOGIN_TRUSTED_DAYS'] * 86400)
+        except BadSignature:
+            return False
+        return True
+
+    def trust(self, response):
+        """Give the browser a trusted-login cookie (after a successful login); returns the response"""
+        response.set_cookie(
+            TRUSTED_COOKIE, self._serializer().dumps(1), max_age=self.app.config['LOGIN_TRUSTED_DAYS'] * 86400,
+            httponly=True, samesite='Lax', secure=self.app.config.get('SESSION_COOKIE_SECURE', False)
+        )
+        return response
+
+    def check(self, ip, hash_cost, trusted=False):
+        """Take one attempt from the IP bucket and hash_cost tokens from the hash budget
+
+        Trusted clients draw from the reserved bucket first, then from the shared one.
+        Returns 0 when the login may proceed, otherwise the number of seconds to wait.
+        """
+        config = self.app.config
+        if not config['LOGIN_THROTTLE_ENABLED']:
+            return 0
+
+        ip_rate = config['LOGIN_IP_ATTEMPTS_PER_MINUTE'] / 60.0
+        ip_burst = config['LOGIN_IP_BURST']
+        share = min(max(config['LOGIN_TRUSTED_HASH_SHARE'], 0.0), 1.0)
+        hash_buckets = [('shared:hashes', config['LOGIN_MAX_HASHES_PER_SECOND'] * (1 - share))]
+        if trusted:
+            hash_buckets.insert(0, ('trusted:hashes', config['LOGIN_MAX_HASHES_PER_SECOND'] * share))
+
+        conn = self._connection()
+        now = time.time()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # The IP pays for every attempt, even one the hash budget then refuses
+            wait = self._take(conn, f'ip:{ip}', 1, ip_rate, ip_burst, now)
+            if not wait:
+                for key, hash_rate in hash_buckets:
+                    # Allow one second's worth of burst, but never less than a single login's cost
+                    wait = self._take(conn, key, hash_cost, hash_rate, max(hash_rate, hash_cost), now)
+                    if not wait:
+                        break
+            if random.random() < 0.01:
+                # Forget idle IPs; a bucket idle for an hour is full again anyway
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - 3600,))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            # Fail open: the throttle must never lock everyone out
+            self.app.logger.warning(f'Login throttle unavailable: {e}')
+            return 0
+        return wait
+
+    def _take(self, conn, key, cost, rate, burst, now):
+        """Refill a bucket and try to remove cost tokens; returns seconds to wait (0 = taken)"""
+        row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+        if tokens < cost:
+            return max((cost - tokens) / rate, 1.0) if rate > 0 else 60.0
+        conn.execute(
+            'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+            (key, tokens - cost, now)
+        )
+        return 0
+
+    def _connection(self):
+        # One connection per thread and process (connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            path = self.app.config['LOGIN_THROTTLE_DB']
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = sqlite3.connect(path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+login_throttle = LoginThrottle()
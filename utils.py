@@ -30,22 +30,21 @@ def generate_budget_options(max_budget_num=20, building_type=None, existing_budg
     if building_type:
         options = [opt for opt in options if f"- {building_type}(" in opt]
     
-    # Sort numerically by budget number, not alphabetically
-    def extract_budget_number(budget_str):
-        """Extract budget number from string like 'Budget 1 - Flats(...)'"""
-        try:
-            # Extract number after "Budget "
-            parts = budget_str.split("Budget ", 1)
-            if len(parts) > 1:
-                num_str = parts[1].split(" -")[0].strip()
-                return int(num_str)
-        except (ValueError, IndexError):
-            pass
-        return 999  # Put invalid formats at the end
-    
     # Sort by budget number first, then alphabetically for same budget number
     return sorted(options, key=lambda x: (extract_budget_number(x), x))
 
+def extract_budget_number(budget_str):
+    """Extract budget number from string like 'Budget 1 - Flats(...)'"""
+    try:
+        # Extract number after "Budget "
+        parts = budget_str.split("Budget ", 1)
+        if len(parts) > 1:
+            num_str = parts[1].split(" -")[0].strip()
+            return int(num_str)
+    except (ValueError, IndexError, AttributeError):
+        pass
+    return 999  # Put invalid formats at the end
+
 def normalize_budget(budget_str):
     """Normalize budget string for comparison"""
     if not budget_str: